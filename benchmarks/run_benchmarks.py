@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+run_benchmarks.py - Packaging and deployment benchmarks with stored, comparable results
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+REPO_ROOT = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'src'))
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+from app_packager import PerlPackager, PythonPackager
+from distribution import simulate_distribution
+from synthetic import PROFILES, generate_tree, modify_tree
+
+logger = logging.getLogger("benchmarks")
+
+DEFAULT_RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+# Packaging modes: name -> (packager class, extra app config, change a few files before each build)
+PACKAGING_MODES = {
+    'python-gzip': (PythonPackager, {'compression': 'gzip', 'package_cache': False}, False),
+    'python-gzip-parallel': (PythonPackager, {'compression': 'gzip', 'compression_threads': 'auto',
+                                              'package_cache': False}, False),
+    'python-xz': (PythonPackager, {'compression': 'xz', 'package_cache': False}, False),
+    'python-none': (PythonPackager, {'compression': 'none', 'package_cache': False}, False),
+    'python-cache-hit': (PythonPackager, {'compression': 'gzip'}, False),
+    'python-delta': (PythonPackager, {'compression': 'gzip', 'package_mode': 'delta'}, True),
+    'perl-gzip': (PerlPackager, {'compression': 'gzip', 'package_cache': False}, False),
+}
+
+
+def _measure(func, repeat):
+    """Return (median seconds, peak traced bytes, last result) of calling func()"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+
+    # One extra traced run for memory; tracing slows the code, so it is not timed
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(timings), peak, result
+
+
+def bench_packaging(workdir, scale, repeat, profiles=None, modes=None):
+    """Package each synthetic tree in each mode and return result records"""
+    results = []
+    for profile_name in profiles or sorted(PROFILES):
+        source_root = os.path.join(workdir, 'sources', profile_name)
+        files, total_bytes = generate_tree(source_root, profile_name, scale=scale)
+
+        for mode in modes or PACKAGING_MODES:
+            packager_class, extra, incremental = PACKAGING_MODES[mode]
+            app_name = f"bench-{profile_name}-{mode}"
+            source_dir = os.path.join(workdir, 'sources', app_name)
+            shutil.rmtree(source_dir, ignore_errors=True)
+            shutil.copytree(source_root, source_dir)
+            shutil.rmtree(os.path.join('build', app_name), ignore_errors=True)
+
+            app_type = 'perl' if packager_class is PerlPackager else 'python'
+            config = dict({'name': app_name, 'type': app_type, 'source_dir': source_dir}, **extra)
+            packager = packager_class(config)
+            counter = iter(range(1, 1000000))
+
+            # Cache-hit and delta modes are measured against an already packaged version
+            if mode == 'python-cache-hit' or incremental:
+                packager.package('base')
+
+            def build():
+                if incremental:
+                    modify_tree(source_dir, seed=next(counter))
+                return packager.package(f"v{next(counter)}")
+
+            seconds, peak, artifact = _measure(build, repeat)
+            results.append({
+                'suite': 'packaging',
+                'name': f"{profile_name}/{mode}",
+                'params': {'profile': profile_name, 'mode': mode, 'files': files, 'input_bytes': total_bytes},
+                'seconds': seconds,
+                'throughput_mb_s': total_bytes / seconds / (1024 * 1024) if seconds > 0 else None,
+                'peak_memory_bytes': peak,
+                'artifact_bytes': os.path.getsize(artifact),
+            })
+            logger.info(f"{profile_name}/{mode}: {seconds:.3f}s, {results[-1]['artifact_bytes']} byte artifact")
+    return results
+
+
+def bench_orchestrator(workdir, scale, repeat, app_counts=None, host_counts=None):
+    """Deploy batches of small apps to local-directory hosts and return result records"""
+    from deployer import DeploymentManager
+    from orchestrator import BatchDeployer
+
+    results = []
+    app_counts = app_counts or [1, 4, 16]
+    host_counts = host_counts or sorted({max(1, int(count * scale)) for count in (1, 8, 32)})
+
+    for app_count in app_counts:
+        apps = {}
+        for index in range(app_count):
+            name = f"bench-app{index}"
+            source_dir = os.path.join(workdir, 'apps', name)
+            if not os.path.isdir(source_dir):
+                generate_tree(source_dir, 'many_small', scale=0.02 * scale, seed=index)
+            apps[name] = {'name': name, 'type': 'python', 'source_dir': source_dir, 'package_type': 'tarball'}
+
+        for host_count in host_counts:
+            environments = {'bench': {
+                'type': 'vm',
+                'transport': 'local',
+                'transport_root': os.path.join(workdir, 'hosts'),
+                'hosts': [f"bench-host{i}" for i in range(host_count)],
+                'deploy_dir': '/opt/deploy',
+            }}
+            for pipelined in (False, True):
+                counter = iter(range(1, 1000000))
+
+                def run():
+                    batch = BatchDeployer('all', 'bench', environments, apps, version=f"v{next(counter)}",
+                                          jobs=4, manager_class=DeploymentManager, pipelined=pipelined)
+                    outcome = batch.run()
+                    if not all(result.success for result in outcome):
+                        raise RuntimeError(f"Benchmark deployment failed: {outcome}")
+                    return outcome
+
+                seconds, peak, _ = _measure(run, repeat)
+                name = f"{'pipelined' if pipelined else 'concurrent'}/apps={app_count}/hosts={host_count}"
+                results.append({
+                    'suite': 'orchestrator',
+                    'name': name,
+                    'params': {'apps': app_count, 'hosts': host_count, 'pipelined': pipelined},
+                    'seconds': seconds,
+                    'peak_memory_bytes': peak,
+                })
+                logger.info(f"{name}: {seconds:.3f}s")
+            shutil.rmtree(os.path.join(workdir, 'hosts'), ignore_errors=True)
+
+    # Simulated fleets far larger than can be run locally: modelled completion time, not wall time
+    for host_count in (10, 100, 1000):
+        for label, seeds, fanout in (('direct', 10, 0), ('tree', 2, 2)):
+            summary = simulate_distribution(host_count, 100 * 1024 * 1024, bandwidth=100 * 1024 * 1024,
+                                            latency=0.05, seeds=seeds, fanout=fanout)
+            results.append({
+                'suite': 'distribution',
+                'name': f"{label}/hosts={host_count}",
+                'params': {'hosts': host_count, 'seeds': seeds, 'fanout': fanout},
+                'seconds': summary['completion_time'],
+            })
+    return results
+
+
+def compare_results(baseline, current, threshold=0.10):
+    """Return (lines, regressions) comparing the seconds of benchmarks present in both runs"""
+    previous = {(r['suite'], r['name']): r for r in baseline['results']}
+    lines = []
+    regressions = []
+    for record in current['results']:
+        key = (record['suite'], record['name'])
+        if key not in previous or not previous[key]['seconds']:
+            continue
+        before, after = previous[key]['seconds'], record['seconds']
+        change = (after - before) / before
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(key)
+        elif change < -threshold:
+            flag = 'improved'
+        lines.append(f"{record['suite']:<13} {record['name']:<45} {before:9.3f}s {after:9.3f}s {change:+8.1%} {flag}")
+    return lines, regressions
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark packaging and deployment hot paths")
+    parser.add_argument("--suite", default="packaging,orchestrator",
+                        help="Comma-separated suites to run: packaging, orchestrator")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier for synthetic tree sizes and host counts")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (the median is kept)")
+    parser.add_argument("--profiles", help=f"Comma-separated tree profiles (default: {','.join(sorted(PROFILES))})")
+    parser.add_argument("--modes", help=f"Comma-separated packaging modes (default: {','.join(PACKAGING_MODES)})")
+    parser.add_argument("--results-dir", default=DEFAULT_RESULTS_DIR, help="Where result files are stored")
+    parser.add_argument("--compare", help="Result file to compare against (default: the latest stored one)")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown fraction reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with 1 if any benchmark regressed")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the generated trees and build output")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+
+    suites = [suite.strip() for suite in args.suite.split(',') if suite.strip()]
+    profiles = args.profiles.split(',') if args.profiles else None
+    modes = args.modes.split(',') if args.modes else None
+    os.makedirs(args.results_dir, exist_ok=True)
+    baseline_path = args.compare or _latest_result(args.results_dir)
+
+    # Packagers write to ./build, so run inside a scratch directory
+    workdir = tempfile.mkdtemp(prefix='deploy-bench-')
+    cwd = os.getcwd()
+    records = []
+    try:
+        os.chdir(workdir)
+        if 'packaging' in suites:
+            records.extend(bench_packaging(workdir, args.scale, args.repeat, profiles, modes))
+        if 'orchestrator' in suites:
+            records.extend(bench_orchestrator(workdir, args.scale, args.repeat))
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    commit = current_commit()
+    run = {
+        'meta': {
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': args.scale,
+            'repeat': args.repeat,
+        },
+        'results': records,
+    }
+    result_path = os.path.join(args.results_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(result_path, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f"Stored {len(records)} result(s) in {result_path}")
+
+    if not baseline_path:
+        return 0
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    lines, regressions = compare_results(baseline, run, args.threshold)
+    print(f"\n=== Compared with {baseline['meta']['commit']} ({os.path.basename(baseline_path)}) ===")
+    if baseline['meta'].get('scale') != args.scale:
+        print(f"Note: baseline ran at scale {baseline['meta'].get('scale')}, this run at {args.scale}")
+    print('\n'.join(lines) if lines else "No common benchmarks")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+def _latest_result(results_dir):
+    names = sorted(name for name in os.listdir(results_dir) if name.endswith('.json'))
+    return os.path.join(results_dir, names[-1]) if names else None
+
+
+if __name__ == "__main__":
+    sys.exit(main())
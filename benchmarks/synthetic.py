@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+synthetic.py - Deterministic synthetic source trees for benchmarks
+"""
+import os
+import random
+
+WORDS = ("deploy package archive host version release config build source layer "
+         "cache stream worker batch upload verify checksum python perl module").split()
+
+# Shapes at scale 1.0; counts (or sizes, for few_huge) are multiplied by the scale
+PROFILES = {
+    'many_small': {'files': 5000, 'dirs': 50, 'min_size': 512, 'max_size': 4096, 'binary': False},
+    'few_huge': {'files': 3, 'dirs': 1, 'min_size': 24 * 1024 * 1024, 'max_size': 32 * 1024 * 1024,
+                 'binary': 'mixed'},
+    'deep_nesting': {'files': 400, 'depth': 40, 'min_size': 256, 'max_size': 2048, 'binary': False},
+    'binary_assets': {'files': 200, 'dirs': 10, 'min_size': 64 * 1024, 'max_size': 512 * 1024, 'binary': True},
+}
+
+
+def _text(rng, size):
+    chunks = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 12))) + '\n'
+        chunks.append(line)
+        length += len(line)
+    return ''.join(chunks)[:size].encode('utf-8')
+
+
+def _content(rng, size, binary):
+    if binary == 'mixed':
+        # Half text, half random bytes: partly compressible like real bundles
+        return _text(rng, size // 2) + rng.randbytes(size - size // 2)
+    if binary:
+        return rng.randbytes(size)
+    return _text(rng, size)
+
+
+def _relative_dir(profile, index):
+    if 'depth' in profile:
+        depth = index % profile['depth'] + 1
+        return os.path.join(*[f"level{level}" for level in range(depth)])
+    return f"pkg{index % profile['dirs']}"
+
+
+def generate_tree(root, profile_name, scale=1.0, seed=0):
+    """Write the named profile under root and return (file_count, total_bytes).
+
+    The same profile, scale and seed always produce identical trees.
+    """
+    profile = PROFILES[profile_name]
+    rng = random.Random(f"{profile_name}:{seed}")
+    if profile_name == 'few_huge':
+        count = profile['files']
+        min_size, max_size = int(profile['min_size'] * scale), int(profile['max_size'] * scale)
+    else:
+        count = max(1, int(profile['files'] * scale))
+        min_size, max_size = profile['min_size'], profile['max_size']
+
+    total = 0
+    suffix = '.bin' if profile['binary'] else '.py'
+    for index in range(count):
+        directory = os.path.join(root, _relative_dir(profile, index))
+        os.makedirs(directory, exist_ok=True)
+        data = _content(rng, rng.randint(min_size, max(min_size, max_size)), profile['binary'])
+        with open(os.path.join(directory, f"file{index}{suffix}"), 'wb') as f:
+            f.write(data)
+        total += len(data)
+
+    return count, total
+
+
+def modify_tree(root, fraction=0.01, seed=1):
+    """Rewrite about fraction of the files under root so the next build sees a small change"""
+    rng = random.Random(seed)
+    paths = sorted(os.path.join(dirpath, name) for dirpath, _, names in os.walk(root) for name in names)
+    changed = paths[:max(1, int(len(paths) * fraction))] if paths else []
+    for path in changed:
+        with open(path, 'ab') as f:
+            f.write(_text(rng, 64))
+    return len(changed)
@@ -31,6 +31,7 @@ setup(
     ],
     extras_require={
         "wheel": ["wheel"],
+        "zstd": ["zstandard>=0.15"],
         "dev": [
             "pytest>=6.0",
             "black",
@@ -3,14 +3,31 @@
 app_packager.py - Base packaging functionality
 """
 import os
+import sys
+import stat
 import logging
 from abc import ABC, abstractmethod
 import shutil
-import subprocess
-import tempfile
+
+from archive_builder import COMPRESSION_EXTENSIONS, build_tarball, compression_settings, deterministic_mtime
+from artifact_store import ArtifactStore
+from command_runner import run_command
+from docker_export import LayerIndex, export_image, merge_layer_export
+from package_cache import PackageCache
+from package_delta import ManifestStore, apply_delta, build_delta, build_manifest, diff_manifests
+from plugins import PACKAGE_FORMATS
+from profiling import span
+from source_scanner import scan_app, scan_tree
+from wheelhouse import DEFAULT_WHEELHOUSE, Wheelhouse
 
 logger = logging.getLogger("packager")
 
+# Package types handled by the packagers themselves; others come from PACKAGE_FORMATS plugins
+BUILTIN_PACKAGE_TYPES = ('tarball', 'wheel', 'docker')
+
+# In delta mode and for layer exports, every this many versions is packaged in full so chains stay short
+DEFAULT_FULL_PACKAGE_EVERY = 10
+
 class BasePackager(ABC):
     """Base abstract class for application packagers"""
     
@@ -19,256 +36,477 @@ class BasePackager(ABC):
         self.app_name = app_config['name']
         self.source_dir = app_config['source_dir']
         self.build_dir = os.path.join('build', self.app_name)
+        # Scan of the source tree used by the current package() call
+        self.manifest = None
+        # Version the current artifact is a delta against, if any
+        self.artifact_base = None
         
         # Create build directory if it doesn't exist
         os.makedirs(self.build_dir, exist_ok=True)
+
+        # Reuse artifacts of unchanged source trees unless disabled per app
+        self.cache = PackageCache(self.build_dir) if app_config.get('package_cache', True) else None
+
+        # Fixed member mtime when deterministic_archives is set, None otherwise
+        self.archive_mtime = deterministic_mtime(app_config)
+
+        # Seconds docker, wheel and pip builds may run before they are stopped
+        self.build_timeout = app_config.get('build_timeout')
+
+        # Every packaged version is indexed; old ones are evicted per the retention settings
+        self.artifacts = ArtifactStore.for_app(app_config, self.build_dir, on_evict=self._forget_version)
     
     @abstractmethod
-    def package(self, version):
-        """Package the application and return the path to the package"""
+    def package(self, version, manifest=None):
+        """Package the application and return the path to the package.
+
+        manifest is a scan of the source tree shared with earlier stages;
+        the tree is scanned again when it is not given.
+        """
         pass
 
-    def _create_dockerfile(self, dockerfile_path, base_image, commands):
+    def _use_manifest(self, manifest):
+        self.manifest = manifest if manifest is not None else scan_app(self.app_config)
+        self.artifact_base = None
+        return self.manifest
+
+    def _package_format_plugin(self):
+        """Return the PACKAGE_FORMATS plugin named by package_type, or None for the built-in formats.
+
+        Raises ValueError for a package_type that is neither built in nor a plugin.
+        """
+        package_type = self.app_config.get('package_type')
+        if package_type in (None,) + BUILTIN_PACKAGE_TYPES:
+            return None
+        if package_type not in PACKAGE_FORMATS:
+            supported = ', '.join(BUILTIN_PACKAGE_TYPES + tuple(PACKAGE_FORMATS.names()))
+            raise ValueError(f"Unsupported package type: {package_type} (supported: {supported})")
+        return PACKAGE_FORMATS.load(package_type)
+
+    def _store_artifact(self, version, package_path):
+        """Record a packaged version in the artifact store and return its path"""
+        if os.path.isfile(package_path):
+            self.artifacts.add(version, package_path, depends_on=self.artifact_base)
+        return package_path
+
+    def _forget_version(self, record):
+        """Drop the build state of an evicted version"""
+        ManifestStore(self.build_dir).remove(record['version'])
+        full_path = self._full_package_path(record['version'])
+        if os.path.exists(full_path):
+            os.remove(full_path)
+        if self.cache is not None:
+            self.cache.prune()
+
+    def _package_cached(self, version, extension, recipe, builder):
+        """Return a versioned package, building it with builder(path) only on a cache miss"""
+        package_path = os.path.join(self.build_dir, f"{self.app_name}-{version}{extension}")
+        if self.cache is None:
+            builder(package_path)
+            return package_path
+
+        # The archive layout depends on the source directory name as well as its contents
+        recipe = f"{recipe}:{os.path.basename(os.path.normpath(self.source_dir))}"
+        key, cached_path = self.cache.lookup(self.source_dir, recipe, extension, manifest=self.manifest)
+        if cached_path:
+            logger.info(f"Reusing cached package for {self.app_name} version {version}")
+            return self.cache.materialize(cached_path, package_path)
+
+        builder(package_path)
+        self.cache.store(key, extension, package_path)
+        return package_path
+
+    def _package_simple_tarball(self, version):
+        """Package as a simple tarball"""
+        compression, level, threads = compression_settings(self.app_config)
+        extension = COMPRESSION_EXTENSIONS[compression]
+        recipe = f"tarball:{compression}:{level}:{self.archive_mtime}"
+
+        if self.app_config.get('package_mode') != 'delta':
+            return self._package_cached(version, extension, recipe, self._write_tarball)
+
+        # Delta mode: ship only what changed since the previously built version
+        manifests = ManifestStore(self.build_dir)
+        previous = manifests.latest(exclude_version=version)
+        files = build_manifest(self.source_dir, self.manifest, previous['files'] if previous else None)
+        previous_version = previous['version'] if previous else None
+
+        full_every = int(self.app_config.get('full_package_every', DEFAULT_FULL_PACKAGE_EVERY))
+        if previous is None or previous.get('depth', 0) + 1 >= full_every:
+            package_path = self._package_cached(version, extension, recipe, self._write_tarball)
+            manifests.save(version, files, package_path, previous=previous_version)
+            return package_path
+
+        changed, deleted = diff_manifests(previous['files'], files)
+        self.artifact_base = previous_version
+        package_path = os.path.join(self.build_dir, f"{self.app_name}-{version}.delta{extension}")
+        build_delta(self.source_dir, package_path, changed, deleted, previous_version, version,
+                    compression=compression, level=level, threads=threads, mtime=self.archive_mtime,
+                    scan=self.manifest)
+        manifests.save(version, files, package_path, kind='delta', base_version=previous_version,
+                       previous=previous_version, depth=previous.get('depth', 0) + 1)
+        return package_path
+
+    def deployable(self, version, package_path):
+        """Return (full_package_path, delta) to deploy a packaged version.
+
+        delta is None unless package_path is a delta package. Then it is
+        {'path', 'base_version', 'base_package'}, where base_package names the
+        base version's full package as deployed to hosts, and
+        full_package_path is the version's reconstructed full package for the
+        hosts that do not hold it. A docker layer export is merged with its
+        complete export into a loadable image, which is deployed whole.
+        """
+        if self.app_config.get('package_type') == 'docker':
+            return self._loadable_image(version, package_path), None
+
+        manifests = ManifestStore(self.build_dir)
+        try:
+            manifest = manifests.load(version)
+            base = manifests.load(manifest['base_version']) if manifest['kind'] == 'delta' else None
+        except (OSError, ValueError):
+            return package_path, None
+        if base is None or manifest['artifact'] != os.path.basename(package_path):
+            return package_path, None
+
+        full_path = self._full_package_path(version)
+        if not os.path.isfile(full_path) or os.path.getmtime(full_path) < os.path.getmtime(package_path):
+            self.reconstruct(version, full_path)
+        base_package = base['artifact'] if base['kind'] == 'full' else os.path.basename(
+            self._full_package_path(base['version']))
+        return full_path, {'path': package_path, 'base_version': base['version'], 'base_package': base_package}
+
+    def _loadable_image(self, version, package_path):
+        """Return package_path, or for a layer export the full image merged from it and its base"""
+        record = self.artifacts.get(version)
+        if record is None or not record.get('depends_on') or record['artifact'] != os.path.basename(package_path):
+            return package_path
+
+        full_path = self._full_package_path(version)
+        if not os.path.isfile(full_path) or os.path.getmtime(full_path) < os.path.getmtime(package_path):
+            compression, level, threads = compression_settings(self.app_config)
+            base_path = self.artifacts.fetch(record['depends_on'])
+            logger.info(f"Merging layer export of version {version} with version {record['depends_on']}")
+            merge_layer_export(base_path, package_path, full_path,
+                               compression=compression, level=level, threads=threads)
+        return full_path
+
+    def reconstruct(self, version, output_path=None):
+        """Rebuild the full tarball of a delta-packaged version from its base and deltas"""
+        compression, level, threads = compression_settings(self.app_config)
+        if output_path is None:
+            output_path = self._full_package_path(version)
+
+        chain = ManifestStore(self.build_dir).chain(version)
+        base_path = os.path.join(self.build_dir, chain[0]['artifact'])
+        delta_paths = [os.path.join(self.build_dir, manifest['artifact']) for manifest in chain[1:]]
+        return apply_delta(base_path, delta_paths, output_path,
+                           compression=compression, level=level, threads=threads, mtime=self.archive_mtime)
+
+    def _full_package_path(self, version):
+        """Where reconstruct() writes the full tarball of a delta-packaged version"""
+        compression = compression_settings(self.app_config)[0]
+        return os.path.join(self.build_dir, f"{self.app_name}-{version}.full{COMPRESSION_EXTENSIONS[compression]}")
+
+    def _write_tarball(self, tar_path):
+        compression, level, threads = compression_settings(self.app_config)
+        build_tarball(self.source_dir, tar_path, compression=compression, level=level, threads=threads,
+                      manifest=self.manifest, mtime=self.archive_mtime)
+
+    def _create_dockerfile(self, dockerfile_path, base_image, commands, syntax=None):
         with open(dockerfile_path, 'w') as f:
+            if syntax:
+                f.write(f"# syntax={syntax}\n")
             f.write(f"FROM {base_image}\n\n")
             f.write("WORKDIR /app\n\n")
             
             for cmd in commands:
                 f.write(f"{cmd}\n")
 
+    def _docker_base_image(self):
+        raise NotImplementedError(f"{type(self).__name__} does not support Docker packaging")
+
+    def _docker_dependency_commands(self, cache_mounts):
+        """Dockerfile commands that install dependencies before the sources are copied"""
+        return []
+
+    def _docker_default_commands(self):
+        return []
+
+    def _package_docker(self, version):
+        """Package as a Docker image built from a persistent, incrementally synced context"""
+        cache_config = self.app_config.get('docker_cache', {}) or {}
+        buildkit = cache_config.get('buildkit', True)
+
+        # Dependencies first, sources next, version-specific lines last, so a
+        # code change only rebuilds the final layers
+        commands = self._docker_dependency_commands(cache_mounts=buildkit)
+        commands.append("COPY . /app/")
+        commands.extend(self._docker_default_commands())
+        # Add custom commands if specified
+        commands.extend(self.app_config.get('docker_commands', []))
+        commands.extend([
+            f"ENV APP_VERSION={version}",
+            f"LABEL version={version}",
+        ])
+
+        docker_dir = os.path.join(self.build_dir, 'docker')
+        context_dir = os.path.join(docker_dir, 'context')
+        with span('sync_context', app=self.app_name) as stage:
+            stage.add_bytes(sync_directory(self.source_dir, context_dir, self.manifest))
+
+        # The Dockerfile lives outside the context so it never invalidates COPY . /app/
+        dockerfile_path = os.path.join(docker_dir, 'Dockerfile')
+        self._create_dockerfile(dockerfile_path, self._docker_base_image(), commands,
+                                syntax='docker/dockerfile:1' if buildkit else None)
+
+        image_name = f"{self.app_name.lower()}:{version}"
+        logger.info(f"Building Docker image: {image_name}")
+
+        build_cmd = ['docker', 'build', '-f', dockerfile_path, '-t', image_name]
+        for cache_from in cache_config.get('cache_from', []):
+            build_cmd.extend(['--cache-from', cache_from])
+        if cache_config.get('inline_cache', False):
+            build_cmd.extend(['--build-arg', 'BUILDKIT_INLINE_CACHE=1'])
+        build_cmd.append(context_dir)
+
+        env = dict(os.environ, DOCKER_BUILDKIT='1' if buildkit else '0')
+        with span('docker_build', app=self.app_name, image=image_name):
+            run_command(build_cmd, env=env, timeout=self.build_timeout, label='docker build', log=logger,
+                        check=True, message="Docker build")
+
+        logger.info("Docker image built successfully")
+        
+        export_mode = self.app_config.get('docker_export', 'file')
+        if export_mode in ('stream', 'layers'):
+            return self._export_docker_image(image_name, version, docker_dir, export_mode)
+
+        tar_path = os.path.join(self.build_dir, f"{self.app_name}-{version}.tar")
+        logger.info(f"Saving Docker image to: {tar_path}")
+        
+        with span('docker_save', app=self.app_name, image=image_name) as stage:
+            run_command(['docker', 'save', '-o', tar_path, image_name], timeout=self.build_timeout,
+                        label='docker save', log=logger, check=True, message="Docker save")
+            stage.add_bytes(os.path.getsize(tar_path))
+            
+        logger.info(f"Docker image saved to {tar_path}")
+        return tar_path
+
+    def _export_docker_image(self, image_name, version, docker_dir, export_mode):
+        """Stream `docker save` straight into the compressor, optionally leaving out known layers.
+
+        Layer exports leave out the layers of the last complete export, and
+        every full_package_every versions the export is complete again.
+        """
+        compression, level, threads = compression_settings(self.app_config)
+        extension = COMPRESSION_EXTENSIONS[compression]
+
+        index = LayerIndex(docker_dir)
+        previous = index.load() if export_mode == 'layers' else None
+        full_every = int(self.app_config.get('full_package_every', DEFAULT_FULL_PACKAGE_EVERY))
+        if previous and previous.get('depth', 0) + 1 >= full_every:
+            previous = None
+        if previous:
+            self.artifact_base = previous['version']
+            tar_path = os.path.join(self.build_dir, f"{self.app_name}-{version}.layers{extension}")
+            logger.info(f"Exporting layers of {image_name} not in version {previous['version']} to: {tar_path}")
+        else:
+            tar_path = os.path.join(self.build_dir, f"{self.app_name}-{version}{extension}")
+            logger.info(f"Streaming Docker image to: {tar_path}")
+
+        with span('docker_save', app=self.app_name, image=image_name, mode=export_mode) as stage:
+            layers = export_image(image_name, tar_path, compression=compression, level=level, threads=threads,
+                                  previous_layers=previous['layers'] if previous else None)
+            stage.args['output_bytes'] = os.path.getsize(tar_path)
+        if previous:
+            index.record_diff(previous)
+        else:
+            index.save(version, layers, os.path.basename(tar_path))
+        return tar_path
+
 class PythonPackager(BasePackager):
     """Handles packaging of Python applications"""
     
-    def package(self, version):
+    def package(self, version, manifest=None):
         """Package a Python application"""
         logger.info(f"Packaging Python application {self.app_name} version {version}")
+        self._use_manifest(manifest)
         
         # Determine packaging method
         if self.app_config.get('package_type') == 'wheel':
-            return self._package_wheel(version)
+            package_path = self._package_wheel(version)
+        elif self.app_config.get('package_type') == 'docker':
+            package_path = self._package_docker(version)
+        elif self._package_format_plugin() is not None:
+            package_path = self._package_format_plugin()(self, version)
         else:
             # Default to simple tarball for now
-            return self._package_simple_tarball(version)
+            package_path = self._package_simple_tarball(version)
+        return self._store_artifact(version, package_path)
     
     def _package_wheel(self, version):
-        """Package as Python wheel"""
-        # Create a temporary directory for building
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Copy source to temp directory
-            temp_source = os.path.join(temp_dir, self.app_name)
-            shutil.copytree(self.source_dir, temp_source)
-            
-            # Check if setup.py exists
-            setup_py = os.path.join(temp_source, 'setup.py')
-            if not os.path.exists(setup_py):
-                logger.error(f"No setup.py found in {self.source_dir}")
-                raise FileNotFoundError(f"No setup.py found in {self.source_dir}")
-            
-            # Build the wheel
-            subprocess.run(
-                ['python', 'setup.py', 'bdist_wheel'],
-                cwd=temp_source,
-                check=True
-            )
-            
-            # Copy the wheel to our build directory
-            dist_dir = os.path.join(temp_source, 'dist')
-            wheel_name = None
-            for file in os.listdir(dist_dir):
-                if file.endswith('.whl'):
-                    wheel_name = file
-                    break
-            
-            if not wheel_name:
-                raise RuntimeError("Failed to build wheel package")
-            
-            wheel_path = os.path.join(dist_dir, wheel_name)
-            target_path = os.path.join(self.build_dir, wheel_name)
-            shutil.copy(wheel_path, target_path)
-            
+        """Package as Python wheel, plus its dependency wheels when wheel_bundle is set"""
+        if not os.path.exists(os.path.join(self.source_dir, 'setup.py')):
+            logger.error(f"No setup.py found in {self.source_dir}")
+            raise FileNotFoundError(f"No setup.py found in {self.source_dir}")
+
+        wheelhouse = Wheelhouse(self.app_config.get('wheelhouse', DEFAULT_WHEELHOUSE), timeout=self.build_timeout)
+        wheel_path = wheelhouse.app_wheel(self.app_name, self.source_dir, self._build_wheel, manifest=self.manifest)
+        target_path = os.path.join(self.build_dir, os.path.basename(wheel_path))
+        shutil.copy(wheel_path, target_path)
+
+        if not self.app_config.get('wheel_bundle', False):
             return target_path
-    
-    def _package_simple_tarball(self, version):
-        """Package as a simple tarball"""
-        tar_name = f"{self.app_name}-{version}.tar.gz"
-        tar_path = os.path.join(self.build_dir, tar_name)
-        
-        # Create tarball using tar command
-        subprocess.run(
-            ['tar', '-czf', tar_path, '-C', os.path.dirname(self.source_dir), 
-             os.path.basename(self.source_dir)],
-            check=True
-        )
-        
-        return tar_path
 
-    def _package_docker(self, version):
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_copy = os.path.join(temp_dir, self.app_name)
-            shutil.copytree(self.source_dir, source_copy)
-            
-            # Create Dockerfile
-            dockerfile_path = os.path.join(temp_dir, 'Dockerfile')
-            base_image = self.app_config.get('python_base_image', 'python:3.9-slim')
-                
-            # Define Docker commands
-            commands = [
-                "COPY . /app/",
-                "RUN pip install --no-cache-dir -r requirements.txt",
-                f"ENV APP_VERSION={version}",
-                f"LABEL version={version}",
-                "EXPOSE 8000",
-                "CMD [\"python\", \"app.py\"]"
-            ]
-                
-            # Add custom commands if specified
-            if 'docker_commands' in self.app_config:
-                commands.extend(self.app_config['docker_commands'])
-                    
-                self._create_dockerfile(dockerfile_path, base_image, commands)
-                
-                # Build Docker image - using subprocess with shell=True for Windows compatibility
-                image_name = f"{self.app_name.lower()}:{version}"
-                logger.info(f"Building Docker image: {image_name}")
-                
-                build_cmd = f"docker build -t {image_name} ."
-                build_result = subprocess.run(
-                    build_cmd,
-                    cwd=temp_dir,
-                    shell=True,
-                    check=False,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                
-            if build_result.returncode != 0:
-                error_msg = f"Docker build failed: {build_result.stderr}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
-                    
-            logger.info("Docker image built successfully")
-                
-
-            tar_path = os.path.join(self.build_dir, f"{self.app_name}-{version}.tar")
-            logger.info(f"Saving Docker image to: {tar_path}")
-                
-            save_cmd = f"docker save -o {tar_path} {image_name}"
-            save_result = subprocess.run(
-                save_cmd,
-                shell=True,
-                check=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
+        # Offline bundle: the app wheel and every dependency wheel in one archive
+        wheels = [wheel_path]
+        requirements = os.path.join(self.source_dir, 'requirements.txt')
+        if os.path.exists(requirements):
+            wheels.extend(wheelhouse.dependency_wheels(requirements))
+        else:
+            requirements = None
+
+        compression, level, threads = compression_settings(self.app_config)
+        bundle_path = os.path.join(self.build_dir, f"{self.app_name}-{version}-bundle{COMPRESSION_EXTENSIONS[compression]}")
+        return wheelhouse.bundle(bundle_path, wheels, requirements,
+                                 compression=compression, level=level, threads=threads, mtime=self.archive_mtime)
+
+    def _build_wheel(self, dist_dir):
+        """Build the wheel from the source tree, keeping every build output under dist_dir"""
+        work_dir = os.path.abspath(os.path.join(dist_dir, 'work'))
+        os.makedirs(work_dir, exist_ok=True)
+        env = None
+        if self.archive_mtime is not None:
+            # bdist_wheel stamps the zip entries with SOURCE_DATE_EPOCH when it is set
+            env = dict(os.environ, SOURCE_DATE_EPOCH=str(self.archive_mtime))
+        with span('wheel_build', app=self.app_name):
+            run_command(
+                [sys.executable, 'setup.py', '-q',
+                 'egg_info', '--egg-base', work_dir,
+                 'build', '--build-base', os.path.join(work_dir, 'build'),
+                 'bdist_wheel', '--bdist-dir', os.path.join(work_dir, 'bdist'),
+                 '--dist-dir', os.path.abspath(dist_dir)],
+                cwd=self.source_dir,
+                env=env,
+                timeout=self.build_timeout,
+                label='bdist_wheel',
+                log=logger,
+                check=True,
+                message="Wheel build"
             )
-                
-            if save_result.returncode != 0:
-                error_msg = f"Docker save failed: {save_result.stderr}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
-                    
-            logger.info(f"Docker image saved to {tar_path}")
-            return tar_path
+
+    def _docker_base_image(self):
+        return self.app_config.get('python_base_image', 'python:3.9-slim')
+
+    def _docker_dependency_commands(self, cache_mounts):
+        """Copy and install requirements before the sources so code changes keep this layer cached"""
+        # The docker context is built from the manifest, so an excluded file is not in it
+        if 'requirements.txt' not in self.manifest.by_path:
+            return []
+        mount = "--mount=type=cache,target=/root/.cache/pip " if cache_mounts else ""
+        no_cache = "" if cache_mounts else "--no-cache-dir "
+        return [
+            "COPY requirements.txt /app/requirements.txt",
+            f"RUN {mount}pip install {no_cache}-r requirements.txt",
+        ]
+
+    def _docker_default_commands(self):
+        return [
+            "EXPOSE 8000",
+            "CMD [\"python\", \"app.py\"]"
+        ]
         
 class PerlPackager(BasePackager):
     """Handles packaging of Perl applications"""
     
-    def package(self, version):
+    def package(self, version, manifest=None):
         """Package a Perl application"""
         logger.info(f"Packaging Perl application {self.app_name} version {version}")
+        self._use_manifest(manifest)
         
-        # For now, just create a simple tarball
-        tar_name = f"{self.app_name}-{version}.tar.gz"
-        tar_path = os.path.join(self.build_dir, tar_name)
-        
-        # Create tarball using tar command
-        subprocess.run(
-            ['tar', '-czf', tar_path, '-C', os.path.dirname(self.source_dir), 
-             os.path.basename(self.source_dir)],
-            check=True
-        )
-        
-        return tar_path
+        if self.app_config.get('package_type') == 'docker':
+            return self._store_artifact(version, self._package_docker(version))
+        if self._package_format_plugin() is not None:
+            return self._store_artifact(version, self._package_format_plugin()(self, version))
 
-    def _package_simple_tarball(self, version):
-        """Package as a simple tarball"""
-        tar_name = f"{self.app_name}-{version}.tar.gz"
-        tar_path = os.path.join(self.build_dir, tar_name)
-        
-        # Create tarball using tar command
-        subprocess.run(
-            ['tar', '-czf', tar_path, '-C', os.path.dirname(self.source_dir), 
-             os.path.basename(self.source_dir)],
-            check=True
-        )
-        
-        return tar_path
-    
-    def _package_docker(self, version):
-        """Package as a Docker image"""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            source_copy = os.path.join(temp_dir, self.app_name)
-            shutil.copytree(self.source_dir, source_copy)
-        
-            # Create Dockerfile
-            dockerfile_path = os.path.join(temp_dir, 'Dockerfile')
-            base_image = self.app_config.get('perl_base_image', 'perl:5.32-slim')
-            
-            # Define Docker commands
-            commands = [
-                "COPY . /app/",
-                f"ENV APP_VERSION={version}",
-                f"LABEL version={version}",
-                "EXPOSE 8000",
-                "CMD [\"perl\", \"app.pl\"]"
-            ]
-            
-            # Add custom commands if specified
-            if 'docker_commands' in self.app_config:
-                commands.extend(self.app_config['docker_commands'])
-                
-            self._create_dockerfile(dockerfile_path, base_image, commands)
-            
-            # Build Docker image - using subprocess with shell=True for Windows compatibility
-            image_name = f"{self.app_name.lower()}:{version}"
-            logger.info(f"Building Docker image: {image_name}")
-            
-            build_cmd = f"docker build -t {image_name} ."
-            build_result = subprocess.run(
-                build_cmd,
-                cwd=temp_dir,
-                shell=True,
-                check=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            if build_result.returncode != 0:
-                error_msg = f"Docker build failed: {build_result.stderr}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
-                
-            logger.info("Docker image built successfully")
-            
-            tar_path = os.path.join(self.build_dir, f"{self.app_name}-{version}.tar")
-            logger.info(f"Saving Docker image to: {tar_path}")
-            
-            save_cmd = f"docker save -o {tar_path} {image_name}"
-            save_result = subprocess.run(
-                save_cmd,
-                shell=True,
-                check=False,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            if save_result.returncode != 0:
-                error_msg = f"Docker save failed: {save_result.stderr}"
-                logger.error(error_msg)
-                raise RuntimeError(error_msg)
-                
-            logger.info(f"Docker image saved to {tar_path}")
-            return tar_path
\ No newline at end of file
+        # Otherwise create a simple tarball
+        return self._store_artifact(version, self._package_simple_tarball(version))
+
+    def _docker_base_image(self):
+        return self.app_config.get('perl_base_image', 'perl:5.32-slim')
+
+    def _docker_dependency_commands(self, cache_mounts):
+        """Install CPAN dependencies from cpanfile before the sources are copied"""
+        if 'cpanfile' not in self.manifest.by_path:
+            return []
+        mount = "--mount=type=cache,target=/root/.cpanm " if cache_mounts else ""
+        return [
+            "COPY cpanfile /app/cpanfile",
+            f"RUN {mount}cpanm --notest --installdeps .",
+        ]
+
+    def _docker_default_commands(self):
+        return [
+            "EXPOSE 8000",
+            "CMD [\"perl\", \"app.pl\"]"
+        ]
+
+
+def sync_directory(source_dir, target_dir, manifest=None, origin=None):
+    """Mirror source_dir into target_dir, copying only files whose size or mtime changed.
+
+    Uses manifest for the source listing, scanning source_dir when it is not
+    given. Relative manifest paths are resolved against origin when it is
+    set, for manifests scanned in another working directory. Returns the
+    number of bytes copied.
+    """
+    if manifest is None:
+        manifest = scan_tree(source_dir)
+    os.makedirs(target_dir, exist_ok=True)
+    copied = removed = copied_bytes = 0
+
+    for entry in manifest.entries:
+        target = os.path.join(target_dir, entry.rel_path)
+        if entry.kind == 'dir':
+            if os.path.islink(target) or (os.path.exists(target) and not os.path.isdir(target)):
+                os.remove(target)
+            os.makedirs(target, exist_ok=True)
+            continue
+        if entry.kind == 'link':
+            if os.path.islink(target) and os.readlink(target) == entry.link_target:
+                continue
+            _remove_path(target)
+            os.symlink(entry.link_target, target)
+            copied += 1
+            continue
+
+        try:
+            target_stat = os.stat(target, follow_symlinks=False)
+            if target_stat.st_size == entry.size and target_stat.st_mtime_ns == entry.mtime_ns:
+                continue
+            if not stat.S_ISREG(target_stat.st_mode):
+                _remove_path(target)
+        except FileNotFoundError:
+            pass
+        shutil.copy2(os.path.join(origin, entry.path) if origin else entry.path, target)
+        copied += 1
+        copied_bytes += entry.size
+
+    # Remove entries that no longer exist in the source, deepest first
+    for root, dirs, files in os.walk(target_dir, topdown=False):
+        for name in files + dirs:
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, target_dir).replace(os.sep, '/')
+            if rel_path not in manifest.by_path:
+                _remove_path(path)
+                removed += 1
+
+    logger.info(f"Synced build context {target_dir}: {copied} file(s) copied, {removed} removed")
+    return copied_bytes
+
+
+def _remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
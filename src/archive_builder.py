@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+archive_builder.py - In-process tarball builder with pluggable compression
+"""
+import os
+import io
+import gzip
+import lzma
+import stat
+import copy
+import zlib
+import tarfile
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import span
+from source_scanner import scan_tree
+
+logger = logging.getLogger("archive_builder")
+
+# Compression name -> archive file extension
+COMPRESSION_EXTENSIONS = {
+    'gzip': '.tar.gz',
+    'xz': '.tar.xz',
+    'zstd': '.tar.zst',
+    'none': '.tar',
+}
+
+DEFAULT_LEVELS = {
+    'gzip': 6,
+    'xz': 6,
+    'zstd': 3,
+    'none': None,
+}
+
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+
+# Default mtime of deterministic archives: 1980-01-01, the earliest date zip and wheel tooling accept
+DETERMINISTIC_MTIME = 315532800
+
+
+def compression_settings(app_config):
+    """Return (compression, level, threads) for an app from apps.yaml settings"""
+    compression = app_config.get('compression', 'gzip')
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"Unsupported compression: {compression}")
+
+    level = app_config.get('compression_level', DEFAULT_LEVELS[compression])
+
+    threads = app_config.get('compression_threads', 1)
+    if threads == 'auto' or threads == 0:
+        threads = os.cpu_count() or 1
+    threads = int(threads)
+    if threads < 1:
+        raise ValueError(f"compression_threads must be positive, got {threads}")
+
+    return compression, level, threads
+
+
+def deterministic_mtime(app_config=None):
+    """Return the mtime stored in deterministic archives, or None if the app has them disabled.
+
+    SOURCE_DATE_EPOCH, the reproducible-builds convention, overrides the default.
+    """
+    if app_config is not None and not app_config.get('deterministic_archives', False):
+        return None
+    return int(os.environ.get('SOURCE_DATE_EPOCH', DETERMINISTIC_MTIME))
+
+
+def normalize_tarinfo(info, mtime):
+    """Strip the host-specific fields of a tar member in place"""
+    info.mtime = mtime
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    if info.isdir() or info.mode & 0o111:
+        info.mode = 0o755
+    elif not info.issym():
+        info.mode = 0o644
+    info.pax_headers = {}
+    return info
+
+
+class DeterministicTarFile(tarfile.TarFile):
+    """TarFile that normalizes ownership, permissions and mtime of every member it writes"""
+
+    deterministic_mtime = DETERMINISTIC_MTIME
+
+    def addfile(self, tarinfo, fileobj=None):
+        super().addfile(normalize_tarinfo(copy.copy(tarinfo), self.deterministic_mtime), fileobj)
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Write-only stream that gzips fixed-size blocks on a thread pool.
+
+    Each block becomes an independent gzip member; concatenated members are a
+    valid gzip file that standard tools and the gzip module decompress.
+    zlib releases the GIL while compressing, so the blocks use all threads.
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, block_size=PARALLEL_BLOCK_SIZE):
+        super().__init__()
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        self._buffer = bytearray()
+        self._pending = deque()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed ParallelGzipWriter")
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer or not self._pending:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self.fileobj.write(self._pending.popleft().result())
+        finally:
+            self._executor.shutdown(wait=True)
+            super().close()
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(self._compress_block, block))
+        # Bound memory by writing finished blocks in order once the queue is deep
+        while len(self._pending) > self.threads * 2:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def _compress_block(self, block):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush()
+
+
+def open_compressor(fileobj, compression, level=None, threads=1):
+    """Wrap fileobj in a write stream for the given compression.
+
+    No compressor embeds a timestamp or file name, so equal input gives equal
+    output for the same compression, level and thread count.
+    """
+    if level is None:
+        level = DEFAULT_LEVELS[compression]
+
+    if compression == 'none':
+        return _NonClosingWriter(fileobj)
+    if compression == 'gzip':
+        if threads > 1:
+            return ParallelGzipWriter(fileobj, level=level, threads=threads)
+        return gzip.GzipFile(filename='', fileobj=fileobj, mode='wb', compresslevel=level, mtime=0)
+    if compression == 'xz':
+        return lzma.LZMAFile(fileobj, mode='wb', preset=level)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        compressor = zstandard.ZstdCompressor(level=level, threads=threads if threads > 1 else 0)
+        return compressor.stream_writer(fileobj, closefd=False)
+
+    raise ValueError(f"Unsupported compression: {compression}")
+
+
+@contextmanager
+def write_archive(output_path, compression='gzip', level=None, threads=1, mtime=None):
+    """Yield a streaming tarfile that is atomically moved to output_path on success.
+
+    With mtime set, every member is normalized (see normalize_tarinfo) and
+    stamped with it, so the archive bytes depend only on names and contents.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as raw:
+            compressor = open_compressor(raw, compression, level, threads)
+            try:
+                if mtime is None:
+                    tar = tarfile.open(fileobj=compressor, mode='w|')
+                else:
+                    tar = DeterministicTarFile.open(fileobj=compressor, mode='w|')
+                    tar.deterministic_mtime = mtime
+                with tar:
+                    yield tar
+            finally:
+                compressor.close()
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+@contextmanager
+def read_archive(archive_path):
+    """Yield a streaming tarfile for reading any archive this module writes"""
+    if archive_path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression requires the 'zstandard' package")
+        with open(archive_path, 'rb') as raw:
+            with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    yield tar
+    else:
+        with tarfile.open(archive_path, mode='r|*') as tar:
+            yield tar
+
+
+def compression_for_path(archive_path):
+    """Return the compression name implied by an archive file name"""
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if compression != 'none' and archive_path.endswith(extension):
+            return compression
+    return 'none'
+
+
+def build_tarball(source_dir, output_path, compression='gzip', level=None, threads=1, arcname=None, manifest=None,
+                  mtime=None):
+    """Stream source_dir into a compressed tarball at output_path.
+
+    Entries are stored under arcname (default: the source directory name),
+    matching `tar -C <parent> <name>`, in sorted depth-first order. The files
+    come from manifest, or from a fresh scan of source_dir when it is not
+    given. mtime makes the archive deterministic, as in write_archive.
+    """
+    source_dir = os.path.normpath(source_dir)
+    if arcname is None:
+        arcname = os.path.basename(os.path.abspath(source_dir))
+    if manifest is None:
+        manifest = scan_tree(source_dir)
+
+    logger.info(f"Writing {compression} tarball {output_path} ({threads} thread(s))")
+
+    with span('tar_compress', compression=compression, level=level, threads=threads) as stage:
+        with write_archive(output_path, compression, level, threads, mtime=mtime) as tar:
+            tar.add(source_dir, arcname=arcname, recursive=False)
+            add_manifest_entries(tar, manifest, arcname)
+            uncompressed = tar.offset
+        stage.add_bytes(uncompressed)
+        stage.args['output_bytes'] = os.path.getsize(output_path)
+
+    return output_path
+
+
+def add_manifest_entries(tar, manifest, arcname):
+    """Add every scanned entry under arcname using the stat data captured by the scan"""
+    for entry in manifest.entries:
+        add_entry(tar, entry, f"{arcname}/{entry.rel_path}")
+
+
+def add_entry(tar, entry, name):
+    """Add one scanned entry as name; symlinks to files are stored as the file they point to"""
+    if entry.kind == 'link':
+        tar.add(entry.path, arcname=name, recursive=False)
+        return
+
+    info = tarfile.TarInfo(name)
+    info.mode = stat.S_IMODE(entry.mode)
+    info.mtime = entry.mtime_ns // 1000000000
+    info.uid = entry.uid
+    info.gid = entry.gid
+    if entry.kind == 'dir':
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+    else:
+        info.size = entry.size
+        with open(entry.path, 'rb') as f:
+            tar.addfile(info, f)
+
+
+class _NonClosingWriter(io.RawIOBase):
+    """Pass-through stream that leaves the underlying file open on close"""
+
+    def __init__(self, fileobj):
+        super().__init__()
+        self.fileobj = fileobj
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.fileobj.write(data)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+artifact_store.py - Versioned package store with retention, eviction and pinning
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from datetime import datetime
+
+from package_cache import file_digest
+
+logger = logging.getLogger("artifact_store")
+
+INDEX_NAME = 'artifacts.json'
+DEFAULT_MAX_VERSIONS = 10
+
+
+class LocalBackend:
+    """Keeps artifacts in a local directory, by default the app's build directory itself"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def put(self, local_path, name):
+        target = os.path.join(self.root, name)
+        if os.path.exists(target) and os.path.samefile(local_path, target):
+            return
+        temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(local_path, temp_path)
+        os.replace(temp_path, target)
+
+    def get(self, name, local_path):
+        source = os.path.join(self.root, name)
+        if os.path.exists(local_path) and os.path.samefile(source, local_path):
+            return
+        shutil.copyfile(source, local_path)
+
+    def exists(self, name):
+        return os.path.isfile(os.path.join(self.root, name))
+
+    def delete(self, name):
+        path = os.path.join(self.root, name)
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+class S3Backend:
+    """Keeps artifacts in an S3-compatible bucket under <prefix><name>.
+
+    client is anything with the boto3 S3 client methods used here:
+    upload_file, download_file, delete_object and list_objects_v2.
+    """
+
+    def __init__(self, client, bucket, prefix=''):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, local_path, name):
+        self.client.upload_file(local_path, self.bucket, self._key(name))
+
+    def get(self, name, local_path):
+        self.client.download_file(self.bucket, self._key(name), local_path)
+
+    def exists(self, name):
+        key = self._key(name)
+        response = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key)
+        return any(item['Key'] == key for item in response.get('Contents', []))
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+
+class LocalS3Client:
+    """Stand-in for a boto3 S3 client that stores objects under <root>/<bucket>/<key>"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def upload_file(self, Filename, Bucket, Key):
+        target = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(Filename, target)
+
+    def download_file(self, Bucket, Key, Filename):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"s3://{Bucket}/{Key} does not exist")
+        shutil.copyfile(path, Filename)
+
+    def delete_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if os.path.isfile(path):
+            os.remove(path)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix=''):
+        bucket_dir = os.path.join(self.root, Bucket)
+        contents = []
+        for dirpath, _, files in os.walk(bucket_dir):
+            for name in files:
+                key = os.path.relpath(os.path.join(dirpath, name), bucket_dir).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    contents.append({'Key': key, 'Size': os.path.getsize(os.path.join(dirpath, name))})
+        contents.sort(key=lambda item: item['Key'])
+        return {'Contents': contents, 'KeyCount': len(contents)}
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+
+def create_backend(store_config, build_dir, app_name):
+    """Return the backend selected by an app's artifact_store settings"""
+    backend = store_config.get('backend', 'local')
+    if backend == 'local':
+        return LocalBackend(store_config.get('path', build_dir))
+    if backend == 's3':
+        prefix = store_config.get('prefix', '')
+        prefix = f"{prefix}{app_name}/"
+        if store_config.get('local_root'):
+            # Local stand-in with the same layout as a bucket, for tests and air-gapped runners
+            return S3Backend(LocalS3Client(store_config['local_root']), store_config['bucket'], prefix)
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("The s3 artifact store requires the 'boto3' package")
+        client = boto3.client('s3', endpoint_url=store_config.get('endpoint_url'))
+        return S3Backend(client, store_config['bucket'], prefix)
+    raise ValueError(f"Unsupported artifact store backend: {backend}")
+
+
+class ArtifactStore:
+    """Index of an app's packaged versions with least-recently-used eviction.
+
+    Every packaged version is recorded with its artifact file, digest, size,
+    creation time and last deployment. After each new artifact the store
+    evicts the least recently used versions (by last deployment, else by
+    creation) until at most max_versions remain and they take at most
+    max_bytes. Versions that are pinned or currently deployed to an
+    environment are never evicted, and neither is the base of any retained
+    delta, so a delta chain is evicted newest first. Delta chains are cut by
+    periodic full packages (full_package_every), which bounds what the limits
+    cannot reclaim.
+
+    The index lives in build/<app>/artifacts.json. Artifacts are written to the
+    backend, and the copy in the build directory is removed on eviction too.
+    """
+
+    def __init__(self, build_dir, backend=None, max_versions=DEFAULT_MAX_VERSIONS, max_bytes=None,
+                 on_evict=None):
+        self.build_dir = build_dir
+        self.backend = backend or LocalBackend(build_dir)
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.index_path = os.path.join(build_dir, INDEX_NAME)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_app(cls, app_config, build_dir, on_evict=None):
+        """Build the store from an app's artifact_store settings in apps.yaml"""
+        store_config = app_config.get('artifact_store', {}) or {}
+        max_bytes = store_config.get('max_bytes')
+        return cls(build_dir, create_backend(store_config, build_dir, app_config['name']),
+                   max_versions=store_config.get('max_versions', DEFAULT_MAX_VERSIONS),
+                   max_bytes=int(max_bytes) if max_bytes else None,
+                   on_evict=on_evict)
+
+    def add(self, version, package_path, depends_on=None):
+        """Record package_path as the artifact of version, then apply the retention limits"""
+        record = {
+            'version': version,
+            'artifact': os.path.basename(package_path),
+            'digest': file_digest(package_path),
+            'size': os.path.getsize(package_path),
+            'created': datetime.now().isoformat(),
+            'last_deployed': None,
+            'depends_on': depends_on,
+        }
+        self.backend.put(package_path, record['artifact'])
+        with self._lock:
+            index = self._load_index()
+            previous = index['artifacts'].get(version)
+            if previous:
+                record['last_deployed'] = previous['last_deployed']
+            index['artifacts'][version] = record
+            evicted = self._evict(index, keep=version)
+            self._save_index(index)
+        self._remove(evicted, index)
+        return record
+
+    def get(self, version):
+        """Return the index record of version, or None"""
+        return self._load_index()['artifacts'].get(version)
+
+    def versions(self):
+        """Return the records of every stored version, least recently used first"""
+        return sorted(self._load_index()['artifacts'].values(), key=_last_used)
+
+    def fetch(self, version, target_path=None):
+        """Return a local path holding version's artifact, downloading it from the backend if needed"""
+        record = self.get(version)
+        if record is None:
+            raise KeyError(f"Version {version} is not in the artifact store")
+        if target_path is None:
+            target_path = os.path.join(self.build_dir, record['artifact'])
+        if not os.path.isfile(target_path) or file_digest(target_path) != record['digest']:
+            self.backend.get(record['artifact'], target_path)
+        return target_path
+
+    def mark_deployed(self, version, env_name):
+        """Record a deployment; the version stays pinned as env_name's current version"""
+        with self._lock:
+            index = self._load_index()
+            record = index['artifacts'].get(version)
+            if record is None:
+                return
+            record['last_deployed'] = datetime.now().isoformat()
+            index['pins'][f"env:{env_name}"] = version
+            self._save_index(index)
+
+    def pin(self, version, label='manual'):
+        """Protect version from eviction until the pin label is removed or moved"""
+        with self._lock:
+            index = self._load_index()
+            if version not in index['artifacts']:
+                raise KeyError(f"Version {version} is not in the artifact store")
+            index['pins'][label] = version
+            self._save_index(index)
+
+    def unpin(self, label='manual'):
+        with self._lock:
+            index = self._load_index()
+            index['pins'].pop(label, None)
+            self._save_index(index)
+
+    def pinned(self):
+        """Return {label: version} for every pin"""
+        return dict(self._load_index()['pins'])
+
+    def _evict(self, index, keep):
+        """Drop least recently used records beyond the limits and return them.
+
+        Only records that no retained record depends on are candidates, so
+        evicting the last delta of a chain can make its base a candidate.
+        """
+        artifacts = index['artifacts']
+        protected = self._protected(index, keep)
+        evicted = []
+        while True:
+            total = sum(entry['size'] for entry in artifacts.values())
+            over_count = self.max_versions is not None and len(artifacts) > self.max_versions
+            over_bytes = self.max_bytes is not None and total > self.max_bytes
+            if not (over_count or over_bytes):
+                break
+            bases = {entry.get('depends_on') for entry in artifacts.values()}
+            candidates = [record for record in artifacts.values()
+                          if record['version'] not in protected and record['version'] not in bases]
+            if not candidates:
+                break
+            record = min(candidates, key=_last_used)
+            del artifacts[record['version']]
+            evicted.append(record)
+        return evicted
+
+    def _protected(self, index, keep):
+        artifacts = index['artifacts']
+        protected = {keep} | set(index['pins'].values())
+        # A delta or layer export is unusable without the versions it builds on
+        pending = list(protected)
+        while pending:
+            record = artifacts.get(pending.pop())
+            base = record and record.get('depends_on')
+            if base and base not in protected:
+                protected.add(base)
+                pending.append(base)
+        return protected
+
+    def _remove(self, evicted, index):
+        retained = {record['artifact'] for record in index['artifacts'].values()}
+        for record in evicted:
+            logger.info(f"Evicting {record['artifact']} (version {record['version']}, {record['size']} bytes)")
+            # Several versions may share one file, e.g. wheels named by the package version
+            if record['artifact'] not in retained:
+                self.backend.delete(record['artifact'])
+                local_path = os.path.join(self.build_dir, record['artifact'])
+                if os.path.lexists(local_path):
+                    os.remove(local_path)
+            if self.on_evict is not None:
+                self.on_evict(record)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('artifacts', {})
+        index.setdefault('pins', {})
+        return index
+
+    def _save_index(self, index):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.index_path)
+
+
+def _last_used(record):
+    return max(record['created'], record['last_deployed'] or '')
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+block_sync.py - rsync-style sync of release trees to hosts with rolling block checksums
+
+The host side (tree_signatures, apply_delta and the command line at the
+bottom) uses only the standard library. Remote sessions upload this file
+with Session.run_helper() and run it there with python3, so hosts need
+nothing but a Python 3 interpreter. The host side must therefore not import
+anything outside the standard library, and it only reads files the deploy
+host uploaded next to it, such as deltas and path lists.
+"""
+import os
+import sys
+import json
+import stat
+import shutil
+import struct
+import hashlib
+import logging
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger("block_sync")
+
+DEFAULT_BLOCK_SIZE = 8192
+RELEASES_DIR = 'releases'
+# The last release synced to the app directory, with the size, mtime and sha256 of its files
+STATE_NAME = '.synced.json'
+DELTA_PREFIX = '.sync-delta-'
+# Changed-path lists are uploaded as files, since a large tree's list would not fit on a command line
+PATHS_PREFIX = '.sync-paths-'
+COPY_BUFFER = 1024 * 1024
+# The rolling match runs at roughly 0.6 s/MiB in pure Python; larger files only match aligned blocks
+ROLLING_MATCH_LIMIT = 4 * 1024 * 1024
+_MOD = 1 << 16
+
+
+def weak_checksum(data):
+    """Return the rsync weak checksum of a block as (a, b)"""
+    a = sum(data) % _MOD
+    b = (len(data) * sum(data) - sum(map(int.__mul__, range(len(data)), data))) % _MOD
+    return a, b
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def block_signatures(path, block_size):
+    """Return [[weak, strong], ...] for each block of a file; the last block may be short"""
+    blocks = []
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            a, b = weak_checksum(block)
+            blocks.append([a | (b << 16), strong_checksum(block)])
+    return blocks
+
+
+def match_blocks(data, blocks, block_size, base_size):
+    """Describe data as ['copy', offset, length] runs of the base file and ['data', bytes] literals.
+
+    Rolls the weak checksum one byte at a time through data, so blocks are
+    found in the base file wherever they moved to.
+    """
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        table.setdefault(weak, []).append((index, strong))
+    # The short last block can only match the end of data
+    last_length = base_size - (len(blocks) - 1) * block_size if blocks else 0
+
+    ops = []
+    literal_start = pos = 0
+    size = len(data)
+    a = b = 0
+    if blocks and size >= block_size:
+        a, b = weak_checksum(data[:block_size])
+    while blocks and pos + block_size <= size:
+        match = None
+        candidates = table.get(a | (b << 16))
+        if candidates:
+            strong = strong_checksum(data[pos:pos + block_size])
+            match = next((index for index, candidate in candidates
+                          if candidate == strong and (index < len(blocks) - 1 or last_length == block_size)), None)
+        if match is not None:
+            _append_literal(ops, data, literal_start, pos)
+            _append_copy(ops, match * block_size, block_size)
+            pos += block_size
+            literal_start = pos
+            if pos + block_size <= size:
+                a, b = weak_checksum(data[pos:pos + block_size])
+            continue
+        if pos + block_size < size:
+            old, new = data[pos], data[pos + block_size]
+            a = (a - old + new) % _MOD
+            b = (b - block_size * old + a) % _MOD
+        pos += 1
+
+    # The short last block, if data still ends with it
+    if (blocks and 0 < last_length < block_size and size - literal_start >= last_length
+            and strong_checksum(data[size - last_length:]) == blocks[-1][1]):
+        _append_literal(ops, data, literal_start, size - last_length)
+        _append_copy(ops, (len(blocks) - 1) * block_size, last_length)
+        return ops
+    _append_literal(ops, data, literal_start, size)
+    return ops
+
+
+def match_aligned_blocks(f, blocks, block_size, base_size):
+    """Yield ['copy', offset, length] and ['data', bytes] ops for a file object, one block at a time.
+
+    Only blocks at the same block-aligned offsets as some base block are
+    found, so an insertion turns the rest of the file into literals, but the
+    hashing runs at C speed and the file is never held in memory.
+    """
+    last_length = base_size - (len(blocks) - 1) * block_size if blocks else 0
+    table = {}
+    for index, (_, strong) in enumerate(blocks):
+        length = last_length if index == len(blocks) - 1 else block_size
+        table.setdefault((length, strong), index)
+    for block in iter(lambda: f.read(block_size), b''):
+        index = table.get((len(block), strong_checksum(block)))
+        if index is None:
+            yield ['data', block]
+        else:
+            yield ['copy', index * block_size, len(block)]
+
+
+def _append_literal(ops, data, start, end):
+    if end > start:
+        ops.append(['data', data[start:end]])
+
+
+def _append_copy(ops, offset, length):
+    if ops and ops[-1][0] == 'copy' and ops[-1][1] + ops[-1][2] == offset:
+        ops[-1][2] += length
+    else:
+        ops.append(['copy', offset, length])
+
+
+def walk_tree(root):
+    """Yield (rel_path, path, lstat) below root, each directory before its contents"""
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in sorted(dir_names + file_names):
+            path = os.path.join(dir_path, name)
+            yield os.path.relpath(path, root).replace(os.sep, '/'), path, os.lstat(path)
+
+
+def tree_signatures(app_dir, block_size=DEFAULT_BLOCK_SIZE, paths=None):
+    """Describe the last release synced to app_dir.
+
+    Returns {'base': version, 'files': {rel_path: {...}}} with the size, mtime,
+    mode and sha256 of every file. Digests recorded when the release was
+    applied are reused for files whose size and mtime have not changed since.
+    Files named in paths also get their block signatures. base is None when
+    nothing was synced yet.
+    """
+    state = _read_state(app_dir)
+    base_dir = os.path.join(app_dir, RELEASES_DIR, state['version']) if state else None
+    if base_dir is None or not os.path.isdir(base_dir):
+        return {'base': None, 'files': {}}
+
+    wanted = set(paths or ())
+    files = {}
+    for rel_path, path, st in walk_tree(base_dir):
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        recorded = state['files'].get(rel_path)
+        if recorded is not None and recorded[:2] == [st.st_size, st.st_mtime_ns]:
+            digest = recorded[2]
+        else:
+            digest = _file_sha256(path)
+        info = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'mode': stat.S_IMODE(st.st_mode), 'digest': digest}
+        if rel_path in wanted:
+            info['blocks'] = block_signatures(path, block_size)
+        files[rel_path] = info
+    return {'base': state['version'], 'files': files}
+
+
+class DeltaWriter:
+    """Writes a delta: the literal bytes as they are produced, then the JSON header and its 8-byte length"""
+
+    def __init__(self, delta_path):
+        self.file = open(delta_path, 'wb')
+        self.offset = 0
+
+    def literal(self, data):
+        """Append literal bytes and return their offset in the delta"""
+        offset = self.offset
+        self.file.write(data)
+        self.offset += len(data)
+        return offset
+
+    def finish(self, base, entries):
+        header = json.dumps({'base': base, 'entries': entries}).encode('utf-8')
+        self.file.write(header)
+        self.file.write(struct.pack('>Q', len(header)))
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+def apply_delta(app_dir, version, delta_path):
+    """Build releases/<version> under app_dir from the delta's base release and the delta.
+
+    Unchanged files are hardlinked from the base release. Every written file
+    is checked against its sha256 before the release is moved into place.
+    """
+    with open(delta_path, 'rb') as delta:
+        delta.seek(-8, os.SEEK_END)
+        header_length = struct.unpack('>Q', delta.read(8))[0]
+        delta.seek(-8 - header_length, os.SEEK_END)
+        header = json.loads(delta.read(header_length).decode('utf-8'))
+        data_start = 0
+
+        releases_dir = os.path.join(app_dir, RELEASES_DIR)
+        base_dir = os.path.join(releases_dir, header['base']) if header['base'] else None
+        target_dir = os.path.join(releases_dir, version)
+        partial_dir = f"{target_dir}.partial"
+        if os.path.lexists(partial_dir):
+            shutil.rmtree(partial_dir)
+        os.makedirs(partial_dir)
+
+        dir_modes = []
+        recorded = {}
+        for entry in header['entries']:
+            path = os.path.join(partial_dir, entry['path'])
+            if entry['kind'] == 'dir':
+                os.makedirs(path, exist_ok=True)
+                dir_modes.append((path, entry['mode']))
+            elif entry['kind'] == 'link':
+                os.symlink(entry['target'], path)
+            else:
+                _apply_file(entry, path, base_dir, delta, data_start)
+                st = os.stat(path)
+                recorded[entry['path']] = [st.st_size, st.st_mtime_ns, entry['digest']]
+        # Last, so read-only directories do not block writing their contents
+        for path, mode in reversed(dir_modes):
+            os.chmod(path, mode)
+
+    if os.path.lexists(target_dir):
+        shutil.rmtree(target_dir)
+    os.rename(partial_dir, target_dir)
+    _write_state(app_dir, {'version': version, 'files': recorded})
+
+
+def _apply_file(entry, path, base_dir, delta, data_start):
+    source = os.path.join(base_dir, entry['source']) if entry.get('source') else None
+    if entry['ops'] is None:
+        # Unchanged: share the base release's file
+        try:
+            os.link(source, path)
+            return
+        except OSError:
+            shutil.copyfile(source, path)
+    else:
+        with open(path, 'wb') as out:
+            base = open(source, 'rb') if source else None
+            try:
+                for op in entry['ops']:
+                    if op[0] == 'copy':
+                        _copy_range(base, op[1], op[2], out)
+                    else:
+                        _copy_range(delta, data_start + op[1], op[2], out)
+            finally:
+                if base is not None:
+                    base.close()
+    if _file_sha256(path) != entry['digest']:
+        raise ValueError(f"{entry['path']} does not match its digest after applying the delta")
+    os.chmod(path, entry['mode'])
+    os.utime(path, ns=(entry['mtime'], entry['mtime']))
+
+
+def _copy_range(source, offset, length, out):
+    source.seek(offset)
+    while length > 0:
+        data = source.read(min(COPY_BUFFER, length))
+        if not data:
+            raise ValueError("Delta refers past the end of its source")
+        out.write(data)
+        length -= len(data)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_state(app_dir):
+    try:
+        with open(os.path.join(app_dir, STATE_NAME), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) and state.get('version') else None
+
+
+def _write_state(app_dir, state):
+    path = os.path.join(app_dir, STATE_NAME)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+class TreeSyncer:
+    """Sends one package's release tree to hosts as deltas against what each host last received.
+
+    The package is unpacked and hashed locally once. For each host the syncer
+    asks for the file listing of the host's last synced release, then for
+    block signatures of the files whose content differs, and sends a delta
+    holding only the bytes the host does not have. Hosts reporting the same
+    listing share one delta; other hosts build theirs concurrently.
+    """
+
+    def __init__(self, package_path, block_size=DEFAULT_BLOCK_SIZE, rolling_match_limit=ROLLING_MATCH_LIMIT):
+        from archive_builder import read_archive
+
+        self.block_size = block_size
+        self.rolling_match_limit = rolling_match_limit
+        self.staging_dir = tempfile.mkdtemp(prefix='deploy-sync-')
+        self.tree_dir = os.path.join(self.staging_dir, 'tree')
+        self.delta_dir = os.path.join(self.staging_dir, 'deltas')
+        self._deltas = {}
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(self.delta_dir)
+            with read_archive(package_path) as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(self.tree_dir, filter='data')
+                else:
+                    tar.extractall(self.tree_dir)
+        except Exception:
+            self.close()
+            raise
+        self.tree = list(walk_tree(self.tree_dir))
+        self.digests = {rel_path: _file_sha256(path) for rel_path, path, st in self.tree if stat.S_ISREG(st.st_mode)}
+
+    def sync(self, session, app_dir, version):
+        """Rebuild <app_dir>/releases/<version> on the host; returns the bytes sent"""
+        listing = session.tree_signatures(app_dir, self.block_size)
+        key = hashlib.sha256(json.dumps(listing, sort_keys=True).encode('utf-8')).hexdigest()
+        delta_path = self._delta_for(key, session, app_dir, listing)
+
+        remote_delta = f"{app_dir.rstrip('/')}/{DELTA_PREFIX}{version}"
+        session.makedirs(app_dir)
+        session.put(delta_path, remote_delta)
+        try:
+            session.apply_tree_delta(app_dir, version, remote_delta)
+        finally:
+            session.remove(remote_delta)
+        return os.path.getsize(delta_path)
+
+    def close(self):
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def _delta_for(self, key, session, app_dir, listing):
+        """Return the delta for a host listing, building it once per distinct listing.
+
+        Only the lookup holds the lock, so hosts with different listings fetch
+        signatures and build deltas in parallel. Hosts waiting on a build that
+        fails build the delta themselves.
+        """
+        while True:
+            with self._lock:
+                future = self._deltas.get(key)
+                building = future is None
+                if building:
+                    future = self._deltas[key] = Future()
+            if not building:
+                try:
+                    return future.result()
+                except Exception:
+                    continue
+            try:
+                delta_path = self._build_delta(session, app_dir, listing, key)
+            except Exception as e:
+                with self._lock:
+                    self._deltas.pop(key, None)
+                future.set_exception(e)
+                raise
+            future.set_result(delta_path)
+            return delta_path
+
+    def _build_delta(self, session, app_dir, listing, key):
+        base_files = listing['files']
+        changed = [rel_path for rel_path, digest in self.digests.items()
+                   if rel_path in base_files and base_files[rel_path]['digest'] != digest]
+        if changed:
+            signatures = session.tree_signatures(app_dir, self.block_size, changed)
+            if signatures['base'] != listing['base']:
+                raise RuntimeError(f"{session.host}: release {signatures['base']} was synced while "
+                                   f"computing a delta against {listing['base']}")
+            base_files = signatures['files']
+
+        delta_path = os.path.join(self.delta_dir, f"{key[:16]}.delta")
+        writer = DeltaWriter(delta_path)
+        entries = []
+        copied = 0
+        try:
+            for rel_path, path, st in self.tree:
+                if stat.S_ISDIR(st.st_mode):
+                    entries.append({'path': rel_path, 'kind': 'dir', 'mode': stat.S_IMODE(st.st_mode)})
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    entries.append({'path': rel_path, 'kind': 'link', 'target': os.readlink(path)})
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+
+                entry = {'path': rel_path, 'kind': 'file', 'mode': stat.S_IMODE(st.st_mode),
+                         'mtime': st.st_mtime_ns, 'digest': self.digests[rel_path], 'source': None, 'ops': None}
+                base = base_files.get(rel_path)
+                if base is not None and base['digest'] == entry['digest'] and _same_stat(base, st):
+                    entry['source'] = rel_path
+                    copied += st.st_size
+                elif base is not None and base['digest'] == entry['digest']:
+                    # Same bytes with a new mtime or mode: copy rather than share the base file
+                    entry['source'] = rel_path
+                    entry['ops'] = [['copy', 0, st.st_size]] if st.st_size else []
+                    copied += st.st_size
+                else:
+                    entry['source'] = rel_path if base is not None else None
+                    entry['ops'] = []
+                    for op in self._file_ops(path, st, base):
+                        if op[0] == 'copy':
+                            _append_copy(entry['ops'], op[1], op[2])
+                            copied += op[2]
+                        else:
+                            offset = writer.literal(op[1])
+                            last = entry['ops'][-1] if entry['ops'] else None
+                            if last and last[0] == 'data' and last[1] + last[2] == offset:
+                                last[2] += len(op[1])
+                            else:
+                                entry['ops'].append(['data', offset, len(op[1])])
+                entries.append(entry)
+        except Exception:
+            writer.abort()
+            raise
+
+        writer.finish(listing['base'], entries)
+        logger.info(f"{session.host}: delta against {listing['base'] or 'nothing'} sends {writer.offset} byte(s), "
+                    f"reuses {copied} byte(s) already on the host")
+        return delta_path
+
+    def _file_ops(self, path, st, base):
+        """Yield the copy and literal ops that rebuild a file from the host's base version of it"""
+        with open(path, 'rb') as f:
+            if base is None:
+                for chunk in iter(lambda: f.read(COPY_BUFFER), b''):
+                    yield ['data', chunk]
+            elif st.st_size > self.rolling_match_limit:
+                yield from match_aligned_blocks(f, base['blocks'], self.block_size, base['size'])
+            else:
+                yield from match_blocks(f.read(), base['blocks'], self.block_size, base['size'])
+
+
+def _same_stat(info, st):
+    return (info['size'] == st.st_size and info['mtime'] == st.st_mtime_ns
+            and info['mode'] == stat.S_IMODE(st.st_mode))
+
+
+def main(argv):
+    command, app_dir = argv[0], argv[1]
+    if command == 'signatures':
+        paths = None
+        if len(argv) > 3:
+            with open(argv[3], 'r', encoding='utf-8') as f:
+                paths = json.load(f)
+        json.dump(tree_signatures(app_dir, int(argv[2]), paths), sys.stdout)
+    elif command == 'apply':
+        apply_delta(app_dir, argv[2], argv[3])
+    else:
+        raise SystemExit(f"Unknown command: {command}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
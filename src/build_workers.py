@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+build_workers.py - Package apps on a pool of build worker processes
+"""
+import os
+import time
+import queue
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+
+from artifact_store import ArtifactStore
+from package_cache import _link_or_copy
+from source_scanner import file_digest, scan_app
+
+logger = logging.getLogger("build_workers")
+
+DEFAULT_WORKERS_ROOT = os.path.join('build', 'workers')
+SOURCES_DIR = 'sources'
+OUTBOX_DIR = 'outbox'
+# A warm worker is preferred while it has at most this many more queued builds than the least loaded one
+LOCALITY_SLACK = 1
+# Seconds between checks for workers that died with builds in flight
+RESULT_POLL = 0.5
+
+
+class BuildResult:
+    """A finished build: the artifact is identified by its digest and held in the worker's outbox"""
+
+    def __init__(self, job_id, worker, app_name, version, digest, name, size, duration,
+                 synced_bytes=0, artifact_base=None):
+        self.job_id = job_id
+        self.worker = worker
+        self.app_name = app_name
+        self.version = version
+        self.digest = digest
+        self.name = name
+        self.size = size
+        self.duration = duration
+        self.synced_bytes = synced_bytes
+        self.artifact_base = artifact_base
+
+    def __repr__(self):
+        return f"BuildResult({self.app_name} {self.version} on worker {self.worker}: {self.digest[:12]})"
+
+
+class _WorkerHandle:
+    """The pool's view of one worker process"""
+
+    def __init__(self, worker_id, workspace, process, tasks):
+        self.id = worker_id
+        self.workspace = workspace
+        self.process = process
+        self.tasks = tasks
+        self.alive = True
+        self.in_flight = {}
+        # Apps whose sources and caches this worker's workspace already holds
+        sources = os.path.join(workspace, SOURCES_DIR)
+        self.warm = set(os.listdir(sources)) if os.path.isdir(sources) else set()
+
+    @property
+    def load(self):
+        return len(self.in_flight)
+
+
+class BuildPool:
+    """Dispatches packaging jobs to build worker processes.
+
+    A job is an app config, a version and optionally the source manifest
+    scanned on the deploy host. Each worker has a workspace under root, kept
+    between runs, holding a mirror of every app's sources and its own build
+    directory with the package cache, wheelhouse and delta manifests. A job
+    therefore goes to a worker that already built the app unless that worker
+    has more than LOCALITY_SLACK builds queued beyond the least loaded
+    worker. Workers put each artifact in their outbox under its digest;
+    fetch() copies it out and checks the digest.
+
+    The workers are local processes reading sources from the shared
+    filesystem, standing in for a fleet of build hosts.
+    """
+
+    def __init__(self, workers=2, root=DEFAULT_WORKERS_ROOT, locality_slack=LOCALITY_SLACK):
+        self.size = max(1, workers)
+        self.root = os.path.abspath(root)
+        self.locality_slack = locality_slack
+        self._context = multiprocessing.get_context('spawn')
+        self._results = self._context.Queue()
+        self._workers = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._collector = None
+        self._stopping = False
+
+    def start(self):
+        for worker_id in range(self.size):
+            workspace = os.path.join(self.root, str(worker_id))
+            os.makedirs(os.path.join(workspace, OUTBOX_DIR), exist_ok=True)
+            tasks = self._context.Queue()
+            process = self._context.Process(target=_worker_main, name=f"build-worker-{worker_id}",
+                                            args=(worker_id, workspace, tasks, self._results), daemon=True)
+            process.start()
+            self._workers.append(_WorkerHandle(worker_id, workspace, process, tasks))
+        self._collector = threading.Thread(target=self._collect, name='build-results', daemon=True)
+        self._collector.start()
+        logger.info(f"Started {self.size} build worker(s) under {self.root}")
+        return self
+
+    def stop(self):
+        self._stopping = True
+        for worker in self._workers:
+            if worker.alive:
+                worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join()
+        if self._collector is not None:
+            self._collector.join()
+        self._workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def submit(self, app_config, version, manifest=None):
+        """Queue a build and return a Future resolving to its BuildResult"""
+        # Workers run in their own directory, so paths must not depend on ours
+        app_config = _pool_app_config(dict(app_config, source_dir=os.path.abspath(app_config['source_dir'])))
+        app_name = app_config['name']
+        future = Future()
+        with self._lock:
+            worker = self._choose(app_name)
+            job_id = next(self._ids)
+            worker.in_flight[job_id] = future
+            worker.warm.add(app_name)
+            worker.tasks.put((job_id, app_config, version, manifest, os.getcwd()))
+        logger.info(f"Building {app_name} {version} on worker {worker.id}")
+        return future
+
+    def fetch(self, result, target_dir):
+        """Move the artifact of result from its worker's outbox into target_dir and return its path"""
+        source = os.path.join(self._workspace(result.worker), OUTBOX_DIR, result.digest)
+        target = os.path.join(target_dir, result.name)
+        os.makedirs(target_dir, exist_ok=True)
+        _link_or_copy(source, target)
+        if file_digest(target) != result.digest:
+            os.remove(target)
+            raise RuntimeError(f"Artifact {result.name} from worker {result.worker} does not match "
+                               f"digest {result.digest[:12]}")
+        os.remove(source)
+        return target
+
+    def _workspace(self, worker_id):
+        return os.path.join(self.root, str(worker_id))
+
+    def _choose(self, app_name):
+        live = [worker for worker in self._workers if worker.alive]
+        if not live:
+            raise RuntimeError("No build workers are running")
+        least = min(live, key=lambda worker: (worker.load, worker.id))
+        warm = [worker for worker in live if app_name in worker.warm]
+        if warm:
+            best = min(warm, key=lambda worker: (worker.load, worker.id))
+            if best.load <= least.load + self.locality_slack:
+                return best
+        return least
+
+    def _collect(self):
+        while True:
+            try:
+                job_id, worker_id, success, payload = self._results.get(timeout=RESULT_POLL)
+            except queue.Empty:
+                self._reap()
+                with self._lock:
+                    idle = not any(worker.in_flight for worker in self._workers)
+                if self._stopping and idle:
+                    return
+                continue
+
+            with self._lock:
+                future = self._workers[worker_id].in_flight.pop(job_id, None)
+            if future is None:
+                continue
+            if success:
+                future.set_result(BuildResult(job_id, worker_id, **payload))
+            else:
+                future.set_exception(RuntimeError(f"Build worker {worker_id}: {payload}"))
+
+    def _reap(self):
+        """Fail the builds of workers that exited without finishing them"""
+        with self._lock:
+            for worker in self._workers:
+                if worker.process.is_alive():
+                    continue
+                if worker.alive and not self._stopping:
+                    logger.error(f"Build worker {worker.id} exited with {worker.process.exitcode}")
+                worker.alive = False
+                for job_id in list(worker.in_flight):
+                    worker.in_flight.pop(job_id).set_exception(
+                        RuntimeError(f"Build worker {worker.id} exited before finishing job {job_id}"))
+
+
+class RemotePackager:
+    """Packager that builds on a BuildPool and fetches the artifact into build/<app>/"""
+
+    def __init__(self, app_config, pool):
+        self.app_config = app_config
+        self.app_name = app_config['name']
+        self.build_dir = os.path.join('build', self.app_name)
+        self.pool = pool
+        self.artifact_base = None
+        os.makedirs(self.build_dir, exist_ok=True)
+        self.artifacts = ArtifactStore.for_app(app_config, self.build_dir)
+
+    def package(self, version, manifest=None):
+        result = self.pool.submit(self.app_config, version, manifest).result()
+        package_path = self.pool.fetch(result, self.build_dir)
+        self.artifact_base = result.artifact_base
+        logger.info(f"Fetched {result.name} ({result.size} bytes) from build worker {result.worker}")
+        self.artifacts.add(version, package_path, depends_on=self.artifact_base)
+        return package_path
+
+
+def _pool_app_config(app_config):
+    """Turn off the packaging modes that build on the previously packaged version.
+
+    Each worker keeps its own manifests and layer index, so a delta or layer
+    export built on a worker would be against the last version that worker
+    built rather than the previous version of the app.
+    """
+    if app_config.get('package_mode') == 'delta':
+        logger.warning(f"{app_config['name']}: delta packages are not built on build workers, packaging in full")
+        app_config['package_mode'] = 'full'
+    if app_config.get('docker_export') == 'layers':
+        logger.warning(f"{app_config['name']}: layer exports are not built on build workers, exporting in full")
+        app_config['docker_export'] = 'stream'
+    return app_config
+
+
+def _worker_main(worker_id, workspace, tasks, results):
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker-{worker_id} - %(name)s - %(levelname)s - %(message)s')
+    # Relative build/ paths of the packagers land in the workspace
+    os.chdir(workspace)
+    builder = _WorkerBuilder(workspace)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        job_id = task[0]
+        try:
+            results.put((job_id, worker_id, True, builder.build(*task[1:])))
+        except Exception as e:
+            logging.getLogger("build_workers").error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+            results.put((job_id, worker_id, False, f"{type(e).__name__}: {str(e)}"))
+
+
+class _WorkerBuilder:
+    """Runs builds inside a worker, keeping one packager per app between jobs"""
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.packagers = {}
+
+    def build(self, app_config, version, manifest, origin):
+        from app_packager import sync_directory
+
+        start = time.monotonic()
+        app_name = app_config['name']
+        source_dir = app_config['source_dir']
+        if manifest is None:
+            manifest = scan_app(app_config)
+        # Same directory name as the source: it is part of the archive layout and the cache recipe
+        mirror = os.path.join(self.workspace, SOURCES_DIR, app_name, os.path.basename(os.path.normpath(source_dir)))
+        synced_bytes = sync_directory(source_dir, mirror, manifest, origin=origin)
+
+        packager = self._packager(dict(app_config, source_dir=mirror))
+        package_path = packager.package(version, manifest=manifest.rebased(mirror))
+
+        record = packager.artifacts.get(version) if getattr(packager, 'artifacts', None) else None
+        digest = record['digest'] if record else file_digest(package_path)
+        _link_or_copy(package_path, os.path.join(self.workspace, OUTBOX_DIR, digest))
+        return {
+            'app_name': app_name,
+            'version': version,
+            'digest': digest,
+            'name': os.path.basename(package_path),
+            'size': os.path.getsize(package_path),
+            'duration': time.monotonic() - start,
+            'synced_bytes': synced_bytes,
+            'artifact_base': getattr(packager, 'artifact_base', None),
+        }
+
+    def _packager(self, app_config):
+        from plugins import PACKAGERS
+
+        cached = self.packagers.get(app_config['name'])
+        if cached is None or cached[0] != app_config:
+            cached = (app_config, PACKAGERS.load(app_config['type'])(app_config))
+            self.packagers[app_config['name']] = cached
+        return cached[1]
+
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+chunked_transfer.py - Chunked, resumable, checksum-verified package uploads
+"""
+import os
+import hashlib
+import logging
+import tempfile
+
+from transports import TransportError
+
+logger = logging.getLogger("chunked_transfer")
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_DIR_NAME = '.chunks'
+# Times a chunk is sent before an upload gives up on it
+CHUNK_PUT_ATTEMPTS = 3
+
+
+class ChunkManifest:
+    """Per-chunk sha256 digests and the digest of the whole file"""
+
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+
+        file_hash = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for offset, data in _read_chunks(f, chunk_size):
+                file_hash.update(data)
+                self.chunks.append((offset, len(data), hashlib.sha256(data).hexdigest()))
+                self.size += len(data)
+        self.digest = file_hash.hexdigest()
+
+
+class ChunkedUploader:
+    """Uploads a file as content-addressed chunks and assembles it on the host.
+
+    Each upload stores its chunks under its own directory,
+    <chunk_dir>/<name>-<file digest>/<sha256>, so concurrent uploads of other
+    apps or versions never touch them. Chunks are checked against their
+    digest as soon as they arrive and only renamed into place once verified,
+    so an interrupted upload leaves no partial chunk behind, and a retried
+    upload skips every chunk that arrived. The assembled file is verified
+    against the full digest before it replaces remote_path, after which the
+    upload's chunks are removed. With keep_chunks they are moved into
+    <chunk_dir> instead, where later uploads that share them skip them, at
+    the cost of a second copy of every package on the host.
+    """
+
+    def __init__(self, chunk_dir, chunk_size=DEFAULT_CHUNK_SIZE, keep_chunks=False):
+        self.chunk_dir = chunk_dir.rstrip('/')
+        self.chunk_size = chunk_size
+        self.keep_chunks = keep_chunks
+
+    def upload(self, session, local_path, remote_path, manifest=None, name=None):
+        """Upload local_path to remote_path and return (chunks_sent, chunks_skipped).
+
+        name identifies the upload on the host, e.g. '<app>-<version>'; it
+        defaults to the file name of remote_path.
+        """
+        if manifest is None:
+            manifest = ChunkManifest(local_path, self.chunk_size)
+        upload_dir = f"{self.chunk_dir}/{name or remote_path.rsplit('/', 1)[-1]}-{manifest.digest[:16]}"
+
+        session.makedirs(upload_dir)
+        arrived = set(session.list_dir(upload_dir))
+        kept = set(session.list_dir(self.chunk_dir)) if self.keep_chunks else set()
+        parts = {}
+        for _, _, digest in manifest.chunks:
+            if digest in arrived:
+                parts[digest] = f"{upload_dir}/{digest}"
+            elif digest in kept:
+                parts[digest] = f"{self.chunk_dir}/{digest}"
+
+        unique_missing = {digest: (offset, length) for offset, length, digest in manifest.chunks
+                          if digest not in parts}
+        self._send_chunks(session, local_path, upload_dir, unique_missing)
+        parts.update({digest: f"{upload_dir}/{digest}" for digest in unique_missing})
+        skipped = sum(1 for _, _, digest in manifest.chunks if digest not in unique_missing)
+        logger.info(f"{session.host}: sent {len(unique_missing)} chunk(s), "
+                    f"{skipped} already present for {os.path.basename(local_path)}")
+
+        self._assemble(session, manifest, remote_path, parts, upload_dir)
+        return len(unique_missing), skipped
+
+    def _send_chunks(self, session, local_path, upload_dir, chunks):
+        with tempfile.TemporaryDirectory() as temp_dir, open(local_path, 'rb') as source:
+            for digest, (offset, length) in chunks.items():
+                source.seek(offset)
+                local_chunk = os.path.join(temp_dir, digest)
+                with open(local_chunk, 'wb') as f:
+                    f.write(source.read(length))
+
+                partial = f"{upload_dir}/{digest}.part"
+                self._put_chunk(session, local_chunk, partial, digest)
+                session.rename(partial, f"{upload_dir}/{digest}")
+                os.remove(local_chunk)
+
+    def _put_chunk(self, session, local_chunk, partial, digest):
+        """Put one chunk and check it on the host, resending it if it arrived corrupt"""
+        for attempt in range(1, CHUNK_PUT_ATTEMPTS + 1):
+            session.put(local_chunk, partial)
+            if session.checksum(partial) == digest:
+                return
+            session.remove(partial)
+            logger.warning(f"{session.host}: chunk {digest[:12]} arrived corrupt (attempt {attempt})")
+        raise TransportError(f"{session.host}: chunk {digest[:12]} failed verification "
+                             f"{CHUNK_PUT_ATTEMPTS} times")
+
+    def _assemble(self, session, manifest, remote_path, parts, upload_dir):
+        assembling = f"{remote_path}.assembling"
+        session.makedirs(remote_path.rsplit('/', 1)[0])
+        session.concat([parts[digest] for _, _, digest in manifest.chunks], assembling)
+
+        received = session.checksum(assembling)
+        if received != manifest.digest:
+            session.remove(assembling)
+            self._drop_corrupt_chunks(session, parts)
+            raise TransportError(f"{session.host}: digest mismatch for {remote_path}: "
+                                 f"{received} != {manifest.digest}")
+
+        session.rename(assembling, remote_path)
+        for digest, part in parts.items():
+            if part != f"{upload_dir}/{digest}":
+                continue
+            if self.keep_chunks:
+                session.rename(part, f"{self.chunk_dir}/{digest}")
+            else:
+                session.remove(part)
+        session.remove_dir(upload_dir)
+
+    def _drop_corrupt_chunks(self, session, parts):
+        """Remove chunks whose content does not match their name so a retry resends them"""
+        for digest, chunk in parts.items():
+            try:
+                received = session.checksum(chunk)
+            except (TransportError, OSError, IndexError):
+                # Gone already, e.g. removed by hand; the retry sends it as a missing chunk
+                continue
+            if received != digest:
+                logger.warning(f"{session.host}: removing corrupt chunk {digest[:12]}")
+                session.remove(chunk)
+
+
+def _read_chunks(f, chunk_size):
+    offset = 0
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return
+        yield offset, data
+        offset += len(data)
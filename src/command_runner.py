@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+command_runner.py - Run external commands on asyncio, streaming their output into the log
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger("command_runner")
+
+# Lines of combined stdout/stderr kept for error messages
+DEFAULT_TAIL_LINES = 200
+# Longer lines (progress bars, minified output) are cut to this many bytes
+MAX_LINE_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+# Seconds between SIGTERM and SIGKILL when a command is stopped
+KILL_GRACE = 5.0
+# How often a running command checks its cancel event
+CANCEL_POLL = 0.1
+
+
+class CommandError(RuntimeError):
+    """Raised by CommandResult.check() for a command that failed, timed out or was cancelled"""
+
+    def __init__(self, message, result):
+        super().__init__(message)
+        self.result = result
+
+
+class Command:
+    """An argv to run, with where and how its output is logged"""
+
+    def __init__(self, argv, cwd=None, env=None, timeout=None, label=None, log=None, level=logging.INFO):
+        self.argv = [str(arg) for arg in argv]
+        self.cwd = cwd
+        self.env = env
+        self.timeout = timeout
+        self.label = label or os.path.basename(self.argv[0])
+        self.log = log or logger
+        self.level = level
+
+
+class CommandResult:
+    """Outcome of a command; tail holds the last lines it wrote to stdout and stderr"""
+
+    def __init__(self, command, returncode, tail, duration, timed_out=False, cancelled=False):
+        self.command = command
+        self.returncode = returncode
+        self.tail = tail
+        self.duration = duration
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    @property
+    def success(self):
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    @property
+    def output(self):
+        return '\n'.join(self.tail)
+
+    def check(self, message=None):
+        """Raise CommandError unless the command succeeded; returns self otherwise"""
+        if self.success:
+            return self
+        if self.timed_out:
+            reason = f"timed out after {self.command.timeout}s"
+        elif self.cancelled:
+            reason = "was cancelled"
+        else:
+            reason = f"exited with {self.returncode}"
+        error_msg = f"{message or self.command.label} {reason}: {self.output}"
+        self.command.log.error(error_msg)
+        raise CommandError(error_msg, self)
+
+    def __repr__(self):
+        return f"CommandResult({self.command.label}: {self.returncode}, {self.duration:.2f}s)"
+
+
+async def run_async(command, cancel=None, tail_lines=DEFAULT_TAIL_LINES):
+    """Run a Command, logging each output line as it arrives, and return its CommandResult.
+
+    Memory use is bounded by the tail ring buffer and MAX_LINE_BYTES however
+    much the command prints. The command is stopped when its timeout passes,
+    when cancel (a threading.Event) is set, or when the awaiting task is
+    cancelled.
+    """
+    tail = deque(maxlen=tail_lines)
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        *command.argv, cwd=command.cwd, env=command.env, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    waiter = asyncio.ensure_future(_finish(process, command, tail))
+
+    timed_out = cancelled = False
+    deadline = None if command.timeout is None else started + command.timeout
+    try:
+        while not waiter.done():
+            wait = CANCEL_POLL if cancel is not None else None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+                wait = remaining if wait is None else min(wait, remaining)
+            await asyncio.wait({waiter}, timeout=wait)
+            if waiter.done():
+                break
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+            elif deadline is not None and time.monotonic() >= deadline:
+                timed_out = True
+            else:
+                continue
+            command.log.warning(f"Stopping {command.label}: {'cancelled' if cancelled else 'timed out'}")
+            await _stop(process)
+            # A leftover grandchild can hold the pipes open; stop reading after the grace period
+            await asyncio.wait({waiter}, timeout=KILL_GRACE)
+            break
+    except asyncio.CancelledError:
+        await _stop(process)
+        waiter.cancel()
+        raise
+    if not waiter.done():
+        waiter.cancel()
+
+    return CommandResult(command, process.returncode, list(tail), time.monotonic() - started,
+                         timed_out=timed_out, cancelled=cancelled)
+
+
+def run_command(argv, cwd=None, env=None, timeout=None, label=None, log=None, level=logging.INFO,
+                check=False, message=None, cancel=None, tail_lines=DEFAULT_TAIL_LINES):
+    """Run one command to completion from synchronous code; with check, failures raise CommandError"""
+    command = Command(argv, cwd=cwd, env=env, timeout=timeout, label=label, log=log, level=level)
+    result = asyncio.run(run_async(command, cancel, tail_lines))
+    if check:
+        result.check(message)
+    return result
+
+
+def run_commands(commands, limit=None, cancel=None, tail_lines=DEFAULT_TAIL_LINES):
+    """Run Commands concurrently on one event loop, at most limit at a time; returns results in order"""
+    commands = list(commands)
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(limit or max(1, len(commands)))
+
+        async def run_one(command):
+            async with semaphore:
+                return await run_async(command, cancel, tail_lines)
+
+        return await asyncio.gather(*(run_one(command) for command in commands))
+
+    return asyncio.run(run_all())
+
+
+async def _finish(process, command, tail):
+    await asyncio.gather(_pump(process.stdout, command, tail), _pump(process.stderr, command, tail))
+    await process.wait()
+
+
+async def _pump(reader, command, tail):
+    """Log a stream line by line, cutting lines longer than MAX_LINE_BYTES"""
+    pending = bytearray()
+    # Set while discarding the rest of a line that was already cut
+    skipping = False
+    while True:
+        chunk = await reader.read(READ_SIZE)
+        if not chunk:
+            break
+        start = 0
+        while True:
+            end = chunk.find(b'\n', start)
+            if end < 0:
+                break
+            if not skipping:
+                pending += chunk[start:end]
+                _emit(command, tail, pending)
+            pending.clear()
+            skipping = False
+            start = end + 1
+        if not skipping:
+            pending += chunk[start:]
+            if len(pending) > MAX_LINE_BYTES:
+                _emit(command, tail, pending[:MAX_LINE_BYTES] + b' [truncated]')
+                pending.clear()
+                skipping = True
+    if pending:
+        _emit(command, tail, pending)
+
+
+def _emit(command, tail, data):
+    line = data.decode('utf-8', errors='replace').rstrip('\r')
+    tail.append(line)
+    command.log.log(command.level, f"[{command.label}] {line}")
+
+
+async def _stop(process):
+    """Terminate the process, killing it if it outlives KILL_GRACE"""
+    if process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+config_loader.py - Schema-checked loading of apps.yaml and environments.yaml with a cached snapshot
+"""
+import os
+import glob
+import pickle
+import hashlib
+import logging
+import threading
+
+from profiling import span
+
+logger = logging.getLogger("config_loader")
+
+DEFAULT_CONFIG_DIR = 'config'
+DEFAULT_SNAPSHOT_DIR = os.path.join('build', '.config-cache')
+# Bump when the snapshot layout or the validation rules change
+SNAPSHOT_VERSION = 1
+INCLUDES_KEY = 'includes'
+
+# key -> (accepted types, allowed values or None)
+APP_SCHEMA = {
+    'name': (str, None),
+    'type': (str, None),
+    'source_dir': (str, None),
+    # Besides tarball, wheel and docker, plugins may add package formats
+    'package_type': (str, None),
+    'package_mode': (str, ('full', 'delta')),
+    'full_package_every': (int, None),
+    'package_cache': (bool, None),
+    'compression': (str, ('gzip', 'xz', 'zstd', 'none')),
+    'compression_level': (int, None),
+    'compression_threads': ((int, str), None),
+    'deterministic_archives': (bool, None),
+    'exclude': (list, None),
+    'include': (list, None),
+    'default_excludes': (bool, None),
+    'validation_workers': ((int, str), None),
+    'validation_cache': (bool, None),
+    'perl_include_dirs': (list, None),
+    'python_base_image': (str, None),
+    'perl_base_image': (str, None),
+    'docker_commands': (list, None),
+    'docker_cache': (dict, None),
+    'docker_export': (str, ('file', 'stream', 'layers')),
+    'wheel_bundle': (bool, None),
+    'wheelhouse': (str, None),
+    'build_timeout': ((int, float), None),
+    'artifact_store': (dict, None),
+    'depends_on': (list, None),
+}
+APP_REQUIRED = ('type', 'source_dir')
+
+ENV_SCHEMA = {
+    'type': (str, None),
+    'hosts': (list, None),
+    'user': (str, None),
+    'transport': (str, None),
+    'transport_root': (str, None),
+    'ssh_command': ((str, list), None),
+    'copy_command': ((str, list), None),
+    'close_command': ((str, list), None),
+    'relay_command': ((str, list), None),
+    'deploy_dir': (str, None),
+    'max_parallel': (int, None),
+    'batch_percent': ((int, float), None),
+    'prepare_commands': (list, None),
+    'activate_commands': (list, None),
+    'max_connections': (int, None),
+    'idle_timeout': ((int, float), None),
+    'upload_mode': (str, ('full', 'chunked', 'sync')),
+    'sync_block_size': (int, None),
+    'chunk_size': (int, None),
+    'keep_chunks': (bool, None),
+    'upload_retries': (int, None),
+    'upload_skip_existing': (bool, None),
+    'distribution': (str, ('direct', 'tree')),
+    'distribution_seeds': (int, None),
+    'distribution_fanout': (int, None),
+}
+ENV_REQUIRED = ('type',)
+
+
+class ConfigError(ValueError):
+    """Raised when the configuration files are missing, malformed or fail the schema"""
+
+
+def load_configs(config_dir=DEFAULT_CONFIG_DIR, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+    """Return (environments, apps) from config_dir.
+
+    A validated snapshot is kept in memory and pickled to snapshot_dir (None
+    disables the file). It is reused while every file it was built from, and
+    every directory an include pattern searched, keeps its mtime and size.
+    """
+    with span('config_load', config_dir=config_dir) as stage:
+        loader = ConfigLoader(config_dir, snapshot_dir)
+        environments, apps = loader.load()
+        stage.args['source'] = loader.source
+    return environments, apps
+
+
+class ConfigLoader:
+    """Loads one config directory; source tells where the last load came from"""
+
+    _memory = {}
+    _memory_lock = threading.Lock()
+
+    def __init__(self, config_dir=DEFAULT_CONFIG_DIR, snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+        self.config_dir = os.path.abspath(config_dir)
+        self.snapshot_path = None
+        if snapshot_dir:
+            name = hashlib.sha256(self.config_dir.encode('utf-8')).hexdigest()[:16]
+            self.snapshot_path = os.path.join(snapshot_dir, f"{name}.pickle")
+        self.source = None
+
+    def load(self):
+        snapshot = self._memory.get(self.config_dir)
+        if snapshot is not None and _fresh(snapshot):
+            self.source = 'memory'
+        else:
+            snapshot = self._read_snapshot()
+            if snapshot is not None:
+                self.source = 'snapshot'
+            else:
+                snapshot = self._compile()
+                self.source = 'yaml'
+                self._write_snapshot(snapshot)
+            with self._memory_lock:
+                self._memory[self.config_dir] = snapshot
+        return snapshot['environments'], snapshot['apps']
+
+    def _compile(self):
+        stats = {}
+        environments = self._load_tree('environments.yaml', stats)
+        apps = self._load_tree('apps.yaml', stats)
+
+        errors = []
+        for name, app_config in apps.items():
+            app_config.setdefault('name', name)
+            errors.extend(_check(f"app '{name}'", app_config, APP_SCHEMA, APP_REQUIRED))
+            if app_config.get('package_mode') == 'delta' and app_config.get('compression') == 'zstd':
+                # Hosts rebuild delta packages with python3's standard library, which cannot read zstd
+                errors.append(f"app '{name}': 'package_mode' delta does not support 'compression' zstd")
+        for name, env_config in environments.items():
+            errors.extend(_check(f"environment '{name}'", env_config, ENV_SCHEMA, ENV_REQUIRED))
+        if errors:
+            raise ConfigError(f"Invalid configuration in {self.config_dir}:\n  " + "\n  ".join(errors))
+
+        logger.debug(f"Compiled {len(apps)} app(s) and {len(environments)} environment(s) from {len(stats)} path(s)")
+        return {'version': SNAPSHOT_VERSION, 'stats': stats, 'environments': environments, 'apps': apps}
+
+    def _load_tree(self, file_name, stats):
+        """Load a top-level file and the fragments its includes pattern list names"""
+        entries = {}
+        origins = {}
+        pending = [os.path.join(self.config_dir, file_name)]
+        seen = set()
+        while pending:
+            path = pending.pop(0)
+            if path in seen:
+                continue
+            seen.add(path)
+            data = _read_yaml(path, stats)
+
+            for pattern in data.pop(INCLUDES_KEY, None) or []:
+                pattern = os.path.join(os.path.dirname(path), pattern)
+                # A new fragment changes the mtime of the directory it appears in
+                for directory in _searched_dirs(pattern):
+                    stats[directory] = _stat(directory)
+                pending.extend(sorted(glob.glob(pattern)))
+
+            for name, value in data.items():
+                if name in entries:
+                    raise ConfigError(f"'{name}' is defined in both {origins[name]} and {path}")
+                if not isinstance(value, dict):
+                    raise ConfigError(f"'{name}' in {path} must be a mapping")
+                entries[name] = value
+                origins[name] = path
+        return entries
+
+    def _read_snapshot(self):
+        if self.snapshot_path is None:
+            return None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return None
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION or not _fresh(snapshot):
+            return None
+        return snapshot
+
+    def _write_snapshot(self, snapshot):
+        if self.snapshot_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            temp_path = f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Could not write config snapshot {self.snapshot_path}: {str(e)}")
+
+
+def _read_yaml(path, stats):
+    # Imported here so that loads served from the snapshot never import yaml
+    import yaml
+
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    try:
+        stats[path] = _stat(path)
+        with open(path, 'r') as f:
+            data = yaml.load(f, Loader=loader)
+    except OSError as e:
+        raise ConfigError(f"Cannot read {path}: {str(e)}")
+    except yaml.YAMLError as e:
+        raise ConfigError(f"Cannot parse {path}: {str(e)}")
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path} must contain a mapping at the top level")
+    return data
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _fresh(snapshot):
+    return all(_stat(path) == stat for path, stat in snapshot['stats'].items())
+
+
+def _searched_dirs(pattern):
+    """Return the directories a glob pattern lists, at every level below its first wildcard"""
+    parts = pattern.split(os.sep)
+    magic = [i for i, part in enumerate(parts) if glob.has_magic(part)]
+    if not magic:
+        return [os.path.dirname(pattern)]
+    directories = []
+    for i in range(magic[0], len(parts)):
+        directories.extend(path for path in glob.glob(os.sep.join(parts[:i]) or os.sep) if os.path.isdir(path))
+    return directories
+
+
+def _check(label, config, schema, required):
+    """Return the schema violations of one app or environment entry"""
+    errors = [f"{label}: missing required key '{key}'" for key in required if key not in config]
+    for key, value in config.items():
+        if key not in schema:
+            # Unknown keys are allowed for custom packagers and transports
+            logger.debug(f"{label}: unrecognised key '{key}'")
+            continue
+        types, choices = schema[key]
+        if value is None:
+            continue
+        if not isinstance(value, types) or (types is int and isinstance(value, bool)):
+            expected = ' or '.join(t.__name__ for t in (types if isinstance(types, tuple) else (types,)))
+            errors.append(f"{label}: '{key}' must be {expected}, got {type(value).__name__}")
+        elif choices is not None and value not in choices:
+            errors.append(f"{label}: '{key}' must be one of {', '.join(choices)}, got '{value}'")
+    return errors
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+connection_pool.py - Reusable host sessions shared across deployment steps
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from transports import TransportError
+
+logger = logging.getLogger("connection_pool")
+
+# Errors that may leave a session's connection broken; others come from the caller's own code
+TRANSPORT_ERRORS = (TransportError, OSError)
+
+
+class PoolStats:
+    """Counters describing how well the pool avoided new connections"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.connect_time = 0.0
+        self.evictions = 0
+        self.discarded = 0
+
+    def as_dict(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / requests if requests else 0.0,
+            'connect_time': self.connect_time,
+            'avg_connect_time': self.connect_time / self.misses if self.misses else 0.0,
+            'evictions': self.evictions,
+            'discarded': self.discarded,
+        }
+
+
+class ConnectionPool:
+    """Pool of transport sessions keyed by (host, user).
+
+    A session is checked out by one thread at a time and returned to the pool
+    afterwards. Idle sessions are closed after idle_timeout seconds, and at most
+    max_connections sessions are open at once; when the cap is reached the least
+    recently used idle session is closed, or the caller waits for one.
+    """
+
+    def __init__(self, transport, max_connections=64, idle_timeout=300):
+        self.transport = transport
+        self.max_connections = max(1, max_connections)
+        self.idle_timeout = idle_timeout
+        self.stats = PoolStats()
+        self._idle = {}
+        self._open = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def session(self, host, user):
+        """Check out a session for the duration of the block; sessions hit by transport errors are discarded"""
+        session = self.acquire(host, user)
+        discard = False
+        try:
+            yield session
+        except TRANSPORT_ERRORS:
+            discard = True
+            raise
+        finally:
+            self.release(session, discard=discard)
+
+    def acquire(self, host, user):
+        key = (host, user)
+        while True:
+            # Expired and evicted sessions are closed after the lock is released
+            closing = []
+            session = None
+            reserved = False
+            with self._condition:
+                self._expire_idle(closing)
+                idle = self._idle.get(key)
+                if idle:
+                    session, _ = idle.pop()
+                    self.stats.hits += 1
+                elif self._open < self.max_connections or self._evict_lru(closing):
+                    self._open += 1
+                    self.stats.misses += 1
+                    reserved = True
+                elif not closing:
+                    self._condition.wait()
+            for stale in closing:
+                self._close(stale)
+            if session is not None:
+                return session
+            if reserved:
+                break
+
+        start = time.monotonic()
+        try:
+            session = self.transport.connect(host, user)
+        except Exception:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        elapsed = time.monotonic() - start
+
+        with self._condition:
+            self.stats.connect_time += elapsed
+        logger.debug(f"Connected to {host} in {elapsed:.3f}s")
+        return session
+
+    def release(self, session, discard=False):
+        if discard:
+            self._close(session)
+            with self._condition:
+                self._open -= 1
+                self.stats.discarded += 1
+                self._condition.notify()
+            return
+
+        with self._condition:
+            self._idle.setdefault((session.host, session.user), []).append((session, time.monotonic()))
+            self._condition.notify()
+
+    def close_all(self):
+        """Close every idle session; sessions still checked out are closed when discarded"""
+        with self._condition:
+            sessions = [session for idle in self._idle.values() for session, _ in idle]
+            self._idle = {}
+            self._open -= len(sessions)
+            self._condition.notify_all()
+        for session in sessions:
+            self._close(session)
+
+    def _expire_idle(self, closing):
+        """Move sessions idle for idle_timeout to closing; called with the lock held"""
+        now = time.monotonic()
+        for key, idle in list(self._idle.items()):
+            fresh = [(session, since) for session, since in idle if now - since < self.idle_timeout]
+            for session, since in idle:
+                if now - since >= self.idle_timeout:
+                    closing.append(session)
+                    self._open -= 1
+                    self.stats.evictions += 1
+            if fresh:
+                self._idle[key] = fresh
+            else:
+                del self._idle[key]
+
+    def _evict_lru(self, closing):
+        """Move the least recently used idle session to closing; return False if none is idle"""
+        oldest = None
+        for key, idle in self._idle.items():
+            for index, (session, since) in enumerate(idle):
+                if oldest is None or since < oldest[2]:
+                    oldest = (key, index, since)
+        if oldest is None:
+            return False
+
+        key, index, _ = oldest
+        session, _ = self._idle[key].pop(index)
+        if not self._idle[key]:
+            del self._idle[key]
+        closing.append(session)
+        self._open -= 1
+        self.stats.evictions += 1
+        return True
+
+    def _close(self, session):
+        try:
+            session.close()
+        except Exception as e:
+            logger.warning(f"Error closing session to {session.host}: {str(e)}")
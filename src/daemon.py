@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+daemon.py - Long-running deploy daemon with an HTTP job API, and its thin client
+"""
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+import itertools
+import urllib.error
+import urllib.request
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config_loader import DEFAULT_CONFIG_DIR, load_configs
+
+logger = logging.getLogger("daemon")
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+
+class Job:
+    """One queued deployment and the log lines it produced"""
+
+    def __init__(self, job_id, app_name, env_name, version=None, test_mode=False):
+        self.id = job_id
+        self.app_name = app_name
+        self.env_name = env_name
+        self.version = version
+        self.test_mode = test_mode
+        self.status = 'queued'
+        self.error = None
+        self.created = datetime.now().isoformat()
+        self.started = None
+        self.finished = None
+        self.log = []
+        self.changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def append_log(self, line):
+        with self.changed:
+            self.log.append(line)
+            self.changed.notify_all()
+
+    def set_status(self, status, error=None):
+        with self.changed:
+            self.status = status
+            self.error = error
+            if status == 'running':
+                self.started = datetime.now().isoformat()
+            elif status in FINISHED:
+                self.finished = datetime.now().isoformat()
+            self.changed.notify_all()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'app': self.app_name,
+            'env': self.env_name,
+            'version': self.version,
+            'test': self.test_mode,
+            'status': self.status,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'log_lines': len(self.log),
+        }
+
+
+class _JobLogHandler(logging.Handler):
+    """Routes log records to the job running on the emitting thread.
+
+    Records from other threads, such as the per-host upload pool, go to the
+    running job when exactly one is running; with several concurrent jobs
+    they cannot be attributed and only reach the daemon's own log.
+    """
+
+    def __init__(self, daemon):
+        super().__init__(logging.INFO)
+        self.daemon = daemon
+        self.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    def emit(self, record):
+        # The daemon's own messages (queueing, API) only belong to a job logged from its thread
+        job = self.daemon.job_for_thread(fallback=record.name != logger.name)
+        if job is not None:
+            job.append_log(self.format(record))
+
+
+class DeployDaemon:
+    """Runs deploy jobs from a queue on a fixed number of worker threads.
+
+    Between jobs the daemon keeps the loaded configuration, one packager and
+    validator per app (with their package, validation and wheel caches) and
+    one EnvironmentManager per environment (with its pooled host
+    connections). Each is rebuilt only when its configuration changes.
+    Jobs for the same app run one at a time; different apps run in parallel
+    up to the worker count.
+    """
+
+    def __init__(self, config_dir=DEFAULT_CONFIG_DIR, workers=2, test_mode=False, max_jobs=1000):
+        self.config_dir = config_dir
+        self.workers = max(1, workers)
+        self.test_mode = test_mode
+        self.max_jobs = max_jobs
+        self.started = time.monotonic()
+
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._app_locks = {}
+        # Replaced, never mutated, so the log handler can read it without taking _lock
+        self._running = {}
+        self._packagers = {}
+        self._env_managers = {}
+        self._threads = []
+        self._log_handler = _JobLogHandler(self)
+
+    def start(self):
+        load_configs(self.config_dir)
+        root = logging.getLogger()
+        # Job logs carry INFO records even when the process logs less
+        if root.getEffectiveLevel() > logging.INFO:
+            root.setLevel(logging.INFO)
+        root.addHandler(self._log_handler)
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"deploy-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Deploy daemon started with {self.workers} worker(s)")
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        logging.getLogger().removeHandler(self._log_handler)
+        for _, env_manager in self._env_managers.values():
+            env_manager.close()
+        self._env_managers = {}
+
+    def submit(self, app_name, env_name, version=None, test_mode=None):
+        """Queue a deployment and return its Job.
+
+        Unknown apps or environments, and a test_mode that is neither a
+        boolean nor None, raise ValueError.
+        """
+        if test_mode is not None and not isinstance(test_mode, bool):
+            raise ValueError(f"'test' must be true or false, not {test_mode!r}")
+        environments, apps = load_configs(self.config_dir)
+        if app_name not in apps:
+            raise ValueError(f"Application '{app_name}' not found in configuration")
+        if env_name not in environments:
+            raise ValueError(f"Environment '{env_name}' not found in configuration")
+
+        with self._lock:
+            job = Job(str(next(self._ids)), app_name, env_name, version,
+                      self.test_mode if test_mode is None else test_mode)
+            self.jobs[job.id] = job
+            self._trim_jobs()
+        logger.info(f"Queued job {job.id}: {app_name} -> {env_name}")
+        self._queue.put(job)
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued job; returns False if it already started"""
+        job = self.jobs[job_id]
+        with job.changed:
+            if job.status != 'queued':
+                return False
+            job.set_status('cancelled')
+        return True
+
+    def job_for_thread(self, fallback=True):
+        # Called for every log record, so it must not take _lock: a thread holding it may be logging
+        running = self._running
+        job = running.get(threading.get_ident())
+        if job is None and fallback and len(running) == 1:
+            job = next(iter(running.values()))
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            'status': 'ok',
+            'uptime': round(time.monotonic() - self.started, 3),
+            'workers': self.workers,
+            'jobs': counts,
+            'warm_apps': sorted(self._packagers),
+            'warm_environments': sorted({env_name for env_name, _ in self._env_managers}),
+        }
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if job.status == 'queued':
+                self._run(job)
+
+    def _run(self, job):
+        with self._lock:
+            app_lock = self._app_locks.setdefault(job.app_name, threading.Lock())
+        with app_lock:
+            with job.changed:
+                # Cancelled while waiting for the app lock
+                if job.status != 'queued':
+                    return
+                job.set_status('running')
+            with self._lock:
+                self._running = {**self._running, threading.get_ident(): job}
+            try:
+                success = self._deploy(job)
+                job.set_status('succeeded' if success else 'failed',
+                               None if success else 'deployment failed, see log')
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {str(e)}", exc_info=True)
+                job.set_status('failed', str(e))
+            finally:
+                with self._lock:
+                    self._running = {ident: running for ident, running in self._running.items()
+                                     if ident != threading.get_ident()}
+
+    def _deploy(self, job):
+        from deployer import DeploymentManager
+
+        environments, apps = load_configs(self.config_dir)
+        app_config = apps[job.app_name]
+        env_config = environments[job.env_name]
+        packager, validator = self._warm_packager(job.app_name, app_config)
+        manager = DeploymentManager(job.app_name, job.env_name, job.version, test_mode=job.test_mode,
+                                    environments=environments, apps=apps,
+                                    packager=packager, validator=validator,
+                                    env_manager=self._warm_env_manager(job.env_name, env_config, job.test_mode))
+        job.version = manager.version
+        return manager.run_deployment()
+
+    def _warm_packager(self, app_name, app_config):
+        # The config snapshot hands out the same objects until a file changes
+        with self._lock:
+            cached = self._packagers.get(app_name)
+            if cached is None or cached[0] is not app_config:
+                from deployer import DeploymentManager
+                packager, validator = DeploymentManager.create_packager(app_config)
+                cached = (app_config, packager, validator)
+                self._packagers[app_name] = cached
+            return cached[1], cached[2]
+
+    def _warm_env_manager(self, env_name, env_config, test_mode):
+        from env_manager import EnvironmentManager
+
+        key = (env_name, test_mode)
+        stale = None
+        with self._lock:
+            cached = self._env_managers.get(key)
+            if cached is None or cached[0] is not env_config:
+                stale = cached
+                cached = (env_config, EnvironmentManager(env_config, test_mode=test_mode))
+                self._env_managers[key] = cached
+        # Closing logs and may wait on hosts, so it happens outside the lock
+        if stale is not None:
+            stale[1].close()
+        return cached[1]
+
+    def _trim_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """JSON job API; the log endpoint streams plain text"""
+
+    daemon_ref = None
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = parse_qs(url.query)
+        daemon = self.daemon_ref
+
+        if parts == ['health']:
+            return self._json(200, daemon.stats())
+        if parts == ['jobs']:
+            return self._json(200, [job.to_dict() for job in list(daemon.jobs.values())])
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            job = daemon.jobs.get(parts[1])
+            if job is None:
+                return self._json(404, {'error': f"Unknown job {parts[1]}"})
+            if len(parts) == 2:
+                return self._json(200, job.to_dict())
+            if parts[2:] == ['log']:
+                return self._stream_log(job, int(query.get('offset', ['0'])[0]),
+                                        query.get('follow', ['0'])[0] in ('1', 'true'))
+        return self._json(404, {'error': f"No route for GET {url.path}"})
+
+    def do_POST(self):
+        parts = [part for part in urlparse(self.path).path.split('/') if part]
+        daemon = self.daemon_ref
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._json(400, {'error': 'Request body must be JSON'})
+
+        if parts == ['jobs']:
+            try:
+                job = daemon.submit(body['app'], body['env'], body.get('version'), body.get('test'))
+            except (KeyError, ValueError) as e:
+                return self._json(400, {'error': str(e)})
+            return self._json(202, job.to_dict())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            if parts[1] not in daemon.jobs:
+                return self._json(404, {'error': f"Unknown job {parts[1]}"})
+            cancelled = daemon.cancel(parts[1])
+            return self._json(200 if cancelled else 409, daemon.jobs[parts[1]].to_dict())
+        return self._json(404, {'error': f"No route for POST {self.path}"})
+
+    def _json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_log(self, job, offset, follow):
+        """Write log lines from offset on; with follow, keep writing until the job finishes"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        while True:
+            with job.changed:
+                if follow and offset >= len(job.log) and not job.done:
+                    job.changed.wait(timeout=1.0)
+                lines = job.log[offset:]
+                done = job.done
+            offset += len(lines)
+            if lines:
+                self.wfile.write(''.join(f"{line}\n" for line in lines).encode('utf-8'))
+                self.wfile.flush()
+            if not follow or (done and offset >= len(job.log)):
+                return
+
+
+def serve(daemon, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Start daemon and return a running ThreadingHTTPServer for it (serving on a background thread)"""
+    handler = type('DaemonHandler', (_Handler,), {'daemon_ref': daemon})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    daemon.start()
+    thread = threading.Thread(target=server.serve_forever, name='daemon-http', daemon=True)
+    thread.start()
+    logger.info(f"Listening on http://{host}:{server.server_address[1]}")
+    return server
+
+
+class DaemonClient:
+    """Thin client for the daemon's HTTP API"""
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def submit(self, app_name, env_name, version=None, test_mode=None):
+        return self._request('POST', '/jobs', {'app': app_name, 'env': env_name,
+                                               'version': version, 'test': test_mode})
+
+    def job(self, job_id):
+        return self._request('GET', f"/jobs/{job_id}")
+
+    def jobs(self):
+        return self._request('GET', '/jobs')
+
+    def cancel(self, job_id):
+        return self._request('POST', f"/jobs/{job_id}/cancel", {})
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def stream_log(self, job_id, offset=0, follow=True):
+        """Yield log lines of a job, following it until it finishes when follow is set"""
+        url = f"{self.url}/jobs/{job_id}/log?offset={offset}&follow={1 if follow else 0}"
+        with urllib.request.urlopen(url, timeout=None if follow else self.timeout) as response:
+            for line in response:
+                yield line.decode('utf-8').rstrip('\n')
+
+    def wait(self, job_id, poll_interval=0.5):
+        """Block until the job finishes and return its final status"""
+        while True:
+            job = self.job(job_id)
+            if job['status'] in FINISHED:
+                return job
+            time.sleep(poll_interval)
+
+    def _request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(f"{self.url}{path}", data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            payload = json.loads(e.read() or b'{}')
+            if e.code == 409:
+                return payload
+            raise RuntimeError(payload.get('error', f"HTTP {e.code}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy daemon and client")
+    parser.add_argument("--url", default=os.environ.get('DEPLOY_DAEMON_URL', f"http://{DEFAULT_HOST}:{DEFAULT_PORT}"),
+                        help="Daemon URL for client commands")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help="Run the daemon in the foreground")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--workers", type=int, default=2, help="Deployments run concurrently")
+    serve_parser.add_argument("--config-dir", default=DEFAULT_CONFIG_DIR)
+    serve_parser.add_argument("--test", action="store_true", help="Run every job in test mode")
+
+    submit_parser = commands.add_parser('submit', help="Queue a deployment")
+    submit_parser.add_argument("app")
+    submit_parser.add_argument("environment")
+    submit_parser.add_argument("--version")
+    submit_parser.add_argument("--test", action="store_true")
+    submit_parser.add_argument("--follow", action="store_true", help="Stream the job log and wait for the result")
+
+    status_parser = commands.add_parser('status', help="Show one job, or all jobs")
+    status_parser.add_argument("job", nargs='?')
+
+    logs_parser = commands.add_parser('logs', help="Print a job's log")
+    logs_parser.add_argument("job")
+    logs_parser.add_argument("--follow", action="store_true")
+
+    cancel_parser = commands.add_parser('cancel', help="Cancel a queued job")
+    cancel_parser.add_argument("job")
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        daemon = DeployDaemon(args.config_dir, workers=args.workers, test_mode=args.test)
+        server = serve(daemon, args.host, args.port)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            daemon.stop()
+        return 0
+
+    client = DaemonClient(args.url)
+    try:
+        if args.command == 'submit':
+            job = client.submit(args.app, args.environment, args.version, args.test or None)
+            print(f"Job {job['id']} queued: {job['app']} -> {job['env']}")
+            if not args.follow:
+                return 0
+            for line in client.stream_log(job['id']):
+                print(line)
+            job = client.wait(job['id'])
+            print(f"Job {job['id']} {job['status']}")
+            return 0 if job['status'] == 'succeeded' else 1
+        if args.command == 'status':
+            print(json.dumps(client.job(args.job) if args.job else client.jobs(), indent=2))
+            return 0
+        if args.command == 'logs':
+            for line in client.stream_log(args.job, follow=args.follow):
+                print(line)
+            return 0
+        if args.command == 'cancel':
+            job = client.cancel(args.job)
+            print(f"Job {job['id']} is {job['status']}")
+            return 0 if job['status'] == 'cancelled' else 1
+    except (RuntimeError, urllib.error.URLError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+delta_apply.py - Rebuild a full package from a base package and a delta package on a host
+
+Uses only the standard library: remote sessions upload this file and run it
+with python3, as they do block_sync.py. The reconstruction matches
+package_delta.apply_delta() member for member, so content_digest() of the
+result equals that of the package reconstructed on the deploy host.
+"""
+import os
+import sys
+import json
+import hashlib
+import tarfile
+
+DELTA_METADATA_NAME = '.delta.json'
+COPY_BUFFER = 1024 * 1024
+WRITE_MODES = {'.tar': 'w', '.tar.gz': 'w:gz', '.tgz': 'w:gz', '.tar.bz2': 'w:bz2', '.tar.xz': 'w:xz'}
+
+
+def content_digest(archive_path):
+    """Return a sha256 over the name, type, mode, link target and content of every member.
+
+    Member order, owners, times and the compression are left out, so two
+    archives of the same tree written by different tools have the same digest.
+    """
+    members = []
+    with tarfile.open(archive_path, 'r:*') as tar:
+        for member in tar:
+            content = ''
+            if member.isfile():
+                digest = hashlib.sha256()
+                source = tar.extractfile(member)
+                for chunk in iter(lambda: source.read(COPY_BUFFER), b''):
+                    digest.update(chunk)
+                content = digest.hexdigest()
+            members.append([member.name, member.type.decode('ascii'), member.mode, member.linkname, content])
+    members.sort()
+    return hashlib.sha256(json.dumps(members).encode('utf-8')).hexdigest()
+
+
+def apply_delta(base_path, delta_path, output_path):
+    """Write output_path from base_path with the delta's changed and deleted paths replaced.
+
+    The archive is written next to output_path and renamed into place. Raises
+    ValueError for an output format the standard library cannot write.
+    """
+    mode = next((mode for suffix, mode in WRITE_MODES.items() if output_path.endswith(suffix)), None)
+    if mode is None:
+        raise ValueError(f"Cannot write {os.path.basename(output_path)} with the standard library")
+
+    partial_path = f"{output_path}.partial"
+    try:
+        with tarfile.open(delta_path, 'r:*') as delta, tarfile.open(partial_path, mode) as out:
+            metadata = None
+            for member in delta:
+                if member.name == DELTA_METADATA_NAME:
+                    metadata = json.loads(delta.extractfile(member).read().decode('utf-8'))
+                break
+            if metadata is None:
+                raise ValueError(f"{delta_path} is not a delta package")
+            root = metadata['root']
+            replaced = {f"{root}/{path}" for path in metadata['changed'] + metadata['deleted']}
+
+            with tarfile.open(base_path, 'r:*') as base:
+                for member in base:
+                    if member.name not in replaced:
+                        out.addfile(member, base.extractfile(member) if member.isfile() else None)
+            for member in delta:
+                if member.name != DELTA_METADATA_NAME:
+                    out.addfile(member, delta.extractfile(member) if member.isfile() else None)
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, output_path)
+
+
+def main(argv):
+    command = argv[0]
+    if command == 'apply':
+        apply_delta(argv[1], argv[2], argv[3])
+        json.dump({'digest': content_digest(argv[3])}, sys.stdout)
+    else:
+        raise SystemExit(f"Unknown command: {command}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -2,15 +2,13 @@
 
 import os
 import sys
-import yaml
 import logging
 import argparse
 from datetime import datetime
 
-from app_packager import PythonPackager, PerlPackager
-from env_manager import EnvironmentManager
-from validators.python_validator import PythonValidator
-from validators.perl_validator import PerlValidator
+from config_loader import load_configs
+from plugins import PACKAGERS, VALIDATORS
+from profiling import DEFAULT_TRACE_PATH, disable_profiling, enable_profiling, span
 
 # Configure logging
 logging.basicConfig(
@@ -20,18 +18,20 @@ logging.basicConfig(
 logger = logging.getLogger("deployer")
 
 class DeploymentManager:
-    def __init__(self, app_name, env_name, version=None, test_mode=False):
+    def __init__(self, app_name, env_name, version=None, test_mode=False,
+                 environments=None, apps=None, packager=None, validator=None, env_manager=None,
+                 build_pool=None):
         self.app_name = app_name
         self.env_name = env_name
         self.version = version or datetime.now().strftime('%Y%m%d.%H%M%S')
         self.test_mode = test_mode
         
 
-        with open('config/environments.yaml', 'r') as file:
-            self.environments = yaml.safe_load(file)
-        
-        with open('config/apps.yaml', 'r') as file:
-            self.apps = yaml.safe_load(file)
+        # Batch runs pass already loaded configuration to avoid re-reading YAML
+        if environments is None or apps is None:
+            environments, apps = load_configs()
+        self.environments = environments
+        self.apps = apps
             
 
         if app_name not in self.apps:
@@ -42,27 +42,61 @@ class DeploymentManager:
             
         self.app_config = self.apps[app_name]
         self.env_config = self.environments[env_name]
+        self.manifest = None
         
 
-        self.env_manager = EnvironmentManager(self.env_config)
+        # A shared environment manager keeps its host connections for the whole batch
+        self.owns_env_manager = env_manager is None
+        if env_manager is None:
+            from env_manager import EnvironmentManager
+            env_manager = EnvironmentManager(self.env_config, test_mode=test_mode)
+        self.env_manager = env_manager
 
-        if self.app_config['type'] == 'python':
-            self.packager = PythonPackager(self.app_config)
-            self.validator = PythonValidator(self.app_config)
-        elif self.app_config['type'] == 'perl':
-            self.packager = PerlPackager(self.app_config)
-            self.validator = PerlValidator(self.app_config)
+        if packager is not None and validator is not None:
+            self.packager = packager
+            self.validator = validator
         else:
-            raise ValueError(f"Unsupported application type: {self.app_config['type']}")
+            self.packager, self.validator = self.create_packager(self.app_config, build_pool)
+
+    @staticmethod
+    def create_packager(app_config, build_pool=None):
+        """Return (packager, validator) for the app's type, importing only that type's implementation.
+
+        With a build_pool, packaging runs on its build workers instead of locally.
+        """
+        app_type = app_config['type']
+        if app_type not in PACKAGERS or app_type not in VALIDATORS:
+            raise ValueError(f"Unsupported application type: {app_type}")
+        validator = VALIDATORS.load(app_type)(app_config)
+        if build_pool is not None:
+            from build_workers import RemotePackager
+            return RemotePackager(app_config, build_pool), validator
+        return PACKAGERS.load(app_type)(app_config), validator
     
+    def scan_sources(self):
+        """Scan the source tree once per deployment; validation and packaging share the result"""
+        source_dir = self.app_config['source_dir']
+        if self.manifest is None and os.path.isdir(source_dir):
+            from source_scanner import scan_app
+            with span('scan', app=self.app_name) as stage:
+                self.manifest = scan_app(self.app_config)
+                stage.args['files'] = len(self.manifest.files)
+                stage.args['total_bytes'] = self.manifest.total_bytes
+        return self.manifest
+
     def validate(self):
         logger.info(f"Validating {self.app_name} for deployment to {self.env_name}")
-        return self.validator.validate()
+        manifest = self.scan_sources()
+        with span('validate', app=self.app_name):
+            return self.validator.validate(manifest=manifest)
     
     def package(self):
 
         logger.info(f"Packaging {self.app_name} version {self.version}")
-        package_path = self.packager.package(self.version)
+        with span('package', app=self.app_name, version=self.version) as stage:
+            package_path = self.packager.package(self.version, manifest=self.scan_sources())
+            if os.path.isfile(package_path):
+                stage.args['artifact_bytes'] = os.path.getsize(package_path)
         logger.info(f"Package created at {package_path}")
 
         return package_path
@@ -70,9 +104,33 @@ class DeploymentManager:
     def deploy(self, package_path):
 
         logger.info(f"Deploying {self.app_name} version {self.version} to {self.env_name}")
-        self.env_manager.prepare()
-        logger.info(f"Would deploy {package_path} to {self.env_name}")
-        
+        with span('prepare', env=self.env_name):
+            self.env_manager.prepare()
+
+        if self.test_mode:
+            logger.info(f"Would deploy {package_path} to {self.env_name}")
+            return True
+
+        # A delta package is deployed with its reconstructed full package for hosts lacking the base
+        options = {}
+        deployable = getattr(self.packager, 'deployable', None)
+        if deployable is not None:
+            package_path, delta = deployable(self.version, package_path)
+            if delta is not None:
+                options['delta'] = delta
+
+        with span('deploy', app=self.app_name, env=self.env_name):
+            results = self.env_manager.deploy(package_path, self.app_name, self.version, **options)
+        failed = [result.host for result in results if not result.success]
+        if failed:
+            logger.error(f"Deployment to {self.env_name} failed on hosts: {', '.join(failed)}")
+            return False
+
+        logger.info(f"Deployed {package_path} to {len(results)} host(s) in {self.env_name}")
+        # Keep the deployed version pinned in the artifact store as this environment's current one
+        artifacts = getattr(self.packager, 'artifacts', None)
+        if artifacts is not None:
+            artifacts.mark_deployed(self.version, self.env_name)
         return True
     
     def run_deployment(self):
@@ -88,23 +146,88 @@ class DeploymentManager:
         except Exception as e:
             logger.error(f"Deployment failed: {str(e)}", exc_info=True)
             return False
+        finally:
+            if self.owns_env_manager:
+                self.env_manager.close()
 
 def main():
     parser = argparse.ArgumentParser(description="Deploy applications to environments")
-    parser.add_argument("app", help="Application name (defined in apps.yaml)")
-    parser.add_argument("environment", help="Target environment (defined in environments.yaml)")
+    parser.add_argument("app", nargs="?", help="Application name (defined in apps.yaml)")
+    parser.add_argument("environment", nargs="?", help="Target environment (defined in environments.yaml)")
+    parser.add_argument("--apps", help="Comma-separated applications to deploy as a batch, or 'all'")
+    parser.add_argument("--envs", help="Comma-separated target environments for a batch, or 'all'")
+    parser.add_argument("--jobs", type=int, default=4, help="Maximum applications processed concurrently in a batch")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="Overlap validate/package of later apps with deployment of earlier ones")
+    parser.add_argument("--deploy-jobs", type=int, default=1, help="Concurrent deployments in pipeline mode")
+    parser.add_argument("--queue-size", type=int, default=2,
+                        help="Packages allowed to wait for deployment in pipeline mode")
+    parser.add_argument("--build-workers", type=int, default=0,
+                        help="Package on this many build worker processes instead of in the deploy process")
     parser.add_argument("--version", help="Version tag (defaults to timestamp)")
     parser.add_argument("--test", action="store_true", help="Run in test mode (no actual deployments)")
+    parser.add_argument("--profile", nargs="?", const=DEFAULT_TRACE_PATH, metavar="TRACE_FILE",
+                        help=f"Time each stage, write trace events (default: {DEFAULT_TRACE_PATH}) and print a summary")
     args = parser.parse_args()
     
+    if args.apps or args.envs:
+        if not (args.apps and args.envs):
+            parser.error("--apps and --envs must be given together")
+        sys.exit(profiled(args.profile, lambda: with_build_pool(args, run_batch)))
+    if not (args.app and args.environment):
+        parser.error("an application and environment are required (or use --apps/--envs)")
+
+    sys.exit(profiled(args.profile, lambda: with_build_pool(args, run_single)))
+
+def with_build_pool(args, run):
+    """Call run(args, build_pool) with a started pool when --build-workers is set, else with None"""
+    if args.build_workers <= 0:
+        return run(args, None)
+
+    from build_workers import BuildPool
+    with BuildPool(args.build_workers) as pool:
+        return run(args, pool)
 
+def run_single(args, build_pool=None):
     try:
-        manager = DeploymentManager(args.app, args.environment, args.version, test_mode=args.test)
+        manager = DeploymentManager(args.app, args.environment, args.version, test_mode=args.test,
+                                    build_pool=build_pool)
         success = manager.run_deployment()
-        sys.exit(0 if success else 1)
+        return 0 if success else 1
     except Exception as e:
         logger.critical(f"Deployment error: {str(e)}", exc_info=True)
-        sys.exit(1)
+        return 1
+
+def profiled(trace_path, run):
+    """Call run(), recording stage timings to trace_path when it is set"""
+    if not trace_path:
+        return run()
+
+    profiler = enable_profiling()
+    try:
+        return run()
+    finally:
+        disable_profiling()
+        profiler.write_trace(trace_path)
+        print(f"\n=== Profile ({trace_path}) ===")
+        print(profiler.summary())
+
+def run_batch(args, build_pool=None):
+    from orchestrator import BatchDeployer, format_results
+
+    try:
+        environments, apps = load_configs()
+        batch = BatchDeployer(args.apps, args.envs, environments, apps, version=args.version,
+                              test_mode=args.test, jobs=args.jobs, manager_class=DeploymentManager,
+                              pipelined=args.pipeline, deploy_jobs=args.deploy_jobs, queue_size=args.queue_size,
+                              build_pool=build_pool)
+        results = batch.run()
+    except Exception as e:
+        logger.critical(f"Batch deployment error: {str(e)}", exc_info=True)
+        return 1
+
+    print(format_results(results))
+    return 0 if all(result.success for result in results) else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
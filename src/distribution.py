@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+distribution.py - Fan-out tree distribution of packages across host fleets
+"""
+import heapq
+import random
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from package_cache import file_digest
+
+logger = logging.getLogger("distribution")
+
+ORIGIN = None
+_NO_SOURCE = object()
+
+
+class TreeScheduler:
+    """Decides which holder sends the package to which host next.
+
+    The origin (the deploy box) sends to at most `seeds` hosts at once and
+    stops once that many seed hosts hold the package; every host that holds a
+    verified copy relays it to up to `fanout` hosts at once. A failed or
+    corrupt transfer is retried from another holder up to max_retries times.
+    With fanout=0 the origin sends to every host itself (direct mode).
+    """
+
+    def __init__(self, hosts, seeds=2, fanout=2, max_retries=2):
+        self.seeds = max(1, seeds)
+        self.fanout = max(0, fanout)
+        self.max_retries = max_retries
+        self.pending = deque(hosts)
+        self.holders = []
+        self.in_flight = {ORIGIN: 0}
+        self.attempts = {host: 0 for host in hosts}
+        self.failed = {}
+        self.parents = {}
+
+    def next_transfers(self):
+        """Return (source, target) pairs to start now, marking them in flight"""
+        transfers = []
+        while self.pending:
+            source = self._free_source()
+            if source is _NO_SOURCE:
+                break
+            target = self.pending.popleft()
+            self.in_flight[source] = self.in_flight.get(source, 0) + 1
+            self.attempts[target] += 1
+            transfers.append((source, target))
+        return transfers
+
+    def complete(self, source, target, ok, error=None):
+        """Record the outcome of a transfer"""
+        self.in_flight[source] -= 1
+        if ok:
+            self.holders.append(target)
+            self.in_flight.setdefault(target, 0)
+            self.parents[target] = source
+        elif self.attempts[target] > self.max_retries:
+            self.failed[target] = error or 'transfer failed'
+        else:
+            self.pending.append(target)
+
+    def done(self):
+        return not self.pending and not any(self.in_flight.values())
+
+    def _free_source(self):
+        # Relay from hosts first so the origin's uplink is only used for seeding
+        for holder in self.holders:
+            if self.in_flight[holder] < self.fanout:
+                return holder
+        if self.in_flight[ORIGIN] < self.seeds and self._origin_may_send():
+            return ORIGIN
+        return _NO_SOURCE
+
+    def _origin_may_send(self):
+        if self.fanout == 0:
+            return True
+        seeded = len(self.holders) + self.in_flight[ORIGIN]
+        # Keep seeding until enough hosts hold the package, or while no host holds it
+        return seeded < self.seeds or not self.holders
+
+
+class TreeDistributor:
+    """Distributes a package to hosts through a TreeScheduler over pooled sessions"""
+
+    def __init__(self, pool, user=None, seeds=2, fanout=2, max_retries=2):
+        self.pool = pool
+        self.user = user
+        self.seeds = seeds
+        self.fanout = fanout
+        self.max_retries = max_retries
+
+    def distribute(self, hosts, package_path, remote_path):
+        """Place package_path at remote_path on every host; return {host: error or None}"""
+        digest = file_digest(package_path)
+        scheduler = TreeScheduler(hosts, self.seeds, self.fanout, self.max_retries)
+        # Each relay holds two pooled sessions, so stay within the pool's connection cap
+        workers = min(self.seeds + self.fanout * len(hosts), len(hosts), self.pool.max_connections // 2)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            running = {}
+            while not scheduler.done():
+                for source, target in scheduler.next_transfers():
+                    future = executor.submit(self._transfer, source, target, package_path, remote_path, digest)
+                    running[future] = (source, target)
+
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    source, target = running.pop(future)
+                    error = future.result()
+                    if error:
+                        logger.warning(f"Transfer {source or 'origin'} -> {target} failed: {error}")
+                    scheduler.complete(source, target, error is None, error)
+
+        results = {host: scheduler.failed.get(host) for host in hosts}
+        logger.info(f"Distributed {package_path} to {sum(1 for e in results.values() if e is None)}"
+                    f"/{len(hosts)} host(s) via {self.seeds} seed(s), fanout {self.fanout}")
+        return results
+
+    def _transfer(self, source, target, package_path, remote_path, digest):
+        """Copy the package to target and verify its checksum; return an error string or None"""
+        try:
+            remote_dir = remote_path.rsplit('/', 1)[0]
+            with self.pool.session(target, self.user) as target_session:
+                target_session.makedirs(remote_dir)
+                if source is ORIGIN:
+                    target_session.put(package_path, remote_path)
+                else:
+                    with self.pool.session(source, self.user) as source_session:
+                        source_session.relay(remote_path, target_session, remote_path)
+
+                received = target_session.checksum(remote_path)
+            if received != digest:
+                return f"checksum mismatch on {target}: {received} != {digest}"
+            return None
+        except Exception as e:
+            return str(e)
+
+
+def simulate_distribution(host_count, size_bytes, bandwidth, latency=0.0, seeds=2, fanout=2,
+                          max_retries=2, failure_rate=0.0, rng_seed=0):
+    """Simulate distributing size_bytes to host_count hosts and return a summary with the completion time.
+
+    Every node has an uplink of `bandwidth` bytes/s shared equally between
+    its transfer slots (seeds for the origin, fanout for hosts). Transfers fail
+    checksum verification with probability failure_rate. Use fanout=0 and
+    seeds=<parallel uploads> to model pushing directly from the deploy box.
+    """
+    hosts = [f"sim-host-{i}" for i in range(host_count)]
+    scheduler = TreeScheduler(hosts, seeds, fanout, max_retries)
+    rng = random.Random(rng_seed)
+    clock = 0.0
+    events = []
+    counter = 0
+
+    while not scheduler.done():
+        for source, target in scheduler.next_transfers():
+            slots = scheduler.seeds if source is ORIGIN else scheduler.fanout
+            duration = latency + size_bytes * slots / float(bandwidth)
+            counter += 1
+            heapq.heappush(events, (clock + duration, counter, source, target))
+
+        if not events:
+            break
+        clock, _, source, target = heapq.heappop(events)
+        ok = rng.random() >= failure_rate
+        scheduler.complete(source, target, ok, None if ok else 'simulated checksum mismatch')
+
+    return {
+        'hosts': host_count,
+        'completion_time': clock,
+        'failed': sorted(scheduler.failed),
+        'depth': _tree_depth(scheduler.parents),
+    }
+
+
+def _tree_depth(parents):
+    depth = 0
+    for host in parents:
+        level, node = 0, host
+        while node is not ORIGIN:
+            level += 1
+            node = parents[node]
+        depth = max(depth, level)
+    return depth
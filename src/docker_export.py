@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+docker_export.py - Stream `docker save` output without an intermediate image file
+"""
+import os
+import io
+import json
+import tarfile
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+
+from archive_builder import read_archive, write_archive
+
+logger = logging.getLogger("docker_export")
+
+MANIFEST_NAME = 'manifest.json'
+OMITTED_NAME = '.omitted-layers.json'
+
+
+@contextmanager
+def docker_save_stream(image_name):
+    """Yield the stdout of `docker save image_name` as a binary stream.
+
+    Raises RuntimeError with docker's stderr if docker fails or the reader
+    fails on its output, e.g. with a tarfile.ReadError on an empty stream.
+    """
+    process = subprocess.Popen(['docker', 'save', image_name], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Drain stderr alongside stdout so a chatty docker cannot block on a full pipe
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_reader.start()
+    error = None
+    try:
+        yield process.stdout
+        # Drain anything the reader did not consume so docker can exit
+        for _ in iter(lambda: process.stdout.read(1024 * 1024), b''):
+            pass
+    except Exception as e:
+        error = e
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+        stderr_reader.join()
+        process.stderr.close()
+    if error is not None or returncode != 0:
+        stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace').strip()
+        cause = f" ({error})" if error is not None else ""
+        error_msg = f"Docker save failed{cause}: {stderr}"
+        logger.error(error_msg)
+        raise RuntimeError(error_msg) from error
+
+
+def export_image(image_name, output_path, compression='gzip', level=None, threads=1, previous_layers=None):
+    """Stream an image into an archive, leaving out layers listed in previous_layers.
+
+    Returns the list of layer paths from the image's manifest.json. Omitted
+    layers are recorded in an .omitted-layers.json entry so the full image can
+    be rebuilt with merge_layer_export().
+    """
+    previous_layers = set(previous_layers or [])
+    layers = []
+    omitted = []
+
+    with docker_save_stream(image_name) as stream, write_archive(output_path, compression, level, threads) as out:
+        with tarfile.open(fileobj=stream, mode='r|') as image:
+            for member in image:
+                if member.name in previous_layers:
+                    omitted.append(member.name)
+                    continue
+
+                data = image.extractfile(member) if member.isfile() else None
+                if member.name == MANIFEST_NAME:
+                    content = data.read()
+                    layers = [layer for entry in json.loads(content) for layer in entry.get('Layers', [])]
+                    data = io.BytesIO(content)
+                out.addfile(member, data)
+
+        if previous_layers:
+            content = json.dumps(sorted(omitted), indent=2).encode('utf-8')
+            info = tarfile.TarInfo(OMITTED_NAME)
+            info.size = len(content)
+            info.mode = 0o644
+            out.addfile(info, io.BytesIO(content))
+
+    logger.info(f"Exported {image_name} to {output_path}: {len(layers)} layer(s), {len(omitted)} omitted")
+    return layers
+
+
+def merge_layer_export(base_path, diff_path, output_path, compression='none', level=None, threads=1):
+    """Rebuild a loadable image archive from a previous export and a layer-diff export"""
+    omitted = None
+    with read_archive(diff_path) as diff:
+        for member in diff:
+            if member.name == OMITTED_NAME:
+                omitted = set(json.loads(diff.extractfile(member).read().decode('utf-8')))
+    if omitted is None:
+        raise ValueError(f"{diff_path} is not a layer-diff export")
+
+    with write_archive(output_path, compression, level, threads) as out:
+        with read_archive(diff_path) as diff:
+            for member in diff:
+                if member.name != OMITTED_NAME:
+                    out.addfile(member, diff.extractfile(member) if member.isfile() else None)
+
+        found = set()
+        with read_archive(base_path) as base:
+            for member in base:
+                if member.name in omitted:
+                    out.addfile(member, base.extractfile(member) if member.isfile() else None)
+                    found.add(member.name)
+
+    missing = omitted - found
+    if missing:
+        os.remove(output_path)
+        raise ValueError(f"Base export {base_path} lacks layer(s): {', '.join(sorted(missing))}")
+    return output_path
+
+
+class LayerIndex:
+    """Remembers the layers of an app's last complete image export.
+
+    Layer exports leave out only layers of that complete export, so any one
+    of them is rebuilt with a single merge_layer_export() call. depth counts
+    the layer exports made against it.
+    """
+
+    def __init__(self, docker_dir):
+        self.path = os.path.join(docker_dir, 'last-export.json')
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, version, layers, artifact, depth=0):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump({'version': version, 'layers': layers, 'artifact': artifact, 'depth': depth}, f, indent=2)
+
+    def record_diff(self, complete):
+        """Count one more layer export against the complete export record"""
+        self.save(complete['version'], complete['layers'], complete['artifact'], complete.get('depth', 0) + 1)
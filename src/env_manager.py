@@ -2,26 +2,341 @@
 """
 env_manager.py - Basic environment management
 """
+import os
+import math
+import time
 import logging
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from block_sync import DEFAULT_BLOCK_SIZE, TreeSyncer
+from chunked_transfer import CHUNK_DIR_NAME, DEFAULT_CHUNK_SIZE, ChunkManifest, ChunkedUploader
+from connection_pool import ConnectionPool
+from delta_apply import content_digest
+from distribution import TreeDistributor
+from package_cache import file_digest
+from plugins import ENVIRONMENT_TYPES
+from profiling import span
+from transports import TransportError, create_transport
 
 logger = logging.getLogger("env_manager")
 
+class HostResult:
+    """Outcome of an operation on a single host"""
+
+    def __init__(self, host, success, duration=0.0, error=None):
+        self.host = host
+        self.success = success
+        self.duration = duration
+        self.error = error
+
+    def __repr__(self):
+        return f"HostResult({self.host}: {'ok' if self.success else self.error})"
+
+class VMEnvironment:
+    """The built-in 'vm' environment type: hosts reached through the configured transport"""
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def prepare(self):
+        self.manager._prepare_vm()
+
+    def deploy(self, package_path, app_name, version, delta=None):
+        return self.manager._deploy_vm(package_path, app_name, version, delta)
+
 class EnvironmentManager:
-    def __init__(self, env_config):
+    def __init__(self, env_config, test_mode=False):
         self.env_config = env_config
         self.env_type = env_config['type']
-    
+        self.test_mode = test_mode
+        self.hosts = env_config.get('hosts', []) or []
+        self.user = env_config.get('user')
+        self.deploy_dir = env_config.get('deploy_dir', '/opt/deploy')
+        self.max_parallel = max(1, int(env_config.get('max_parallel', 10)))
+        self.batch_percent = env_config.get('batch_percent', 100)
+        self._transport = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._environment = None
+
+    @property
+    def environment(self):
+        """The implementation of this environment's type, from the ENVIRONMENT_TYPES registry"""
+        if self._environment is None:
+            self._environment = ENVIRONMENT_TYPES.load(self.env_type)(self)
+        return self._environment
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = create_transport(self.env_config)
+        return self._transport
+
+    @property
+    def pool(self):
+        """Sessions kept open across prepare, upload and activate steps and across apps"""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ConnectionPool(
+                    self.transport,
+                    max_connections=int(self.env_config.get('max_connections', 64)),
+                    idle_timeout=float(self.env_config.get('idle_timeout', 300)),
+                )
+            return self._pool
+
+    def pool_stats(self):
+        """Return connection pool statistics, or None if no host was contacted"""
+        return self._pool.stats.as_dict() if self._pool is not None else None
+
+    def close(self):
+        """Close all pooled host sessions"""
+        if self._pool is not None:
+            stats = self.pool_stats()
+            logger.info(f"Connection pool: {stats['hits']} hit(s), {stats['misses']} miss(es), "
+                        f"{stats['connect_time']:.3f}s spent connecting")
+            self._pool.close_all()
+
     def prepare(self):
         logger.info(f"Preparing {self.env_type} environment")
-        
-        # will expand later
-        if self.env_type == 'vm':
-            self._prepare_vm()
-        else:
+
+        if self.env_type not in ENVIRONMENT_TYPES:
             logger.info(f"Environment type {self.env_type} preparation not implemented yet")
-    
+            return
+        self.environment.prepare()
+
     def _prepare_vm(self):
-        hosts = self.env_config.get('hosts', [])
-        if hosts:
-            logger.info(f"Would prepare VM environment on hosts: {', '.join(hosts)}")
-           
\ No newline at end of file
+        if not self.hosts:
+            return
+        if self.test_mode:
+            logger.info(f"Would prepare VM environment on hosts: {', '.join(self.hosts)}")
+            return
+
+        results = self._run_on_hosts(self.hosts, self._prepare_host)
+        failed = [result.host for result in results if not result.success]
+        if failed:
+            raise RuntimeError(f"Preparation failed on hosts: {', '.join(failed)}")
+
+    def deploy(self, package_path, app_name, version, delta=None):
+        """Deploy package_path with the environment type's implementation and return a HostResult per host.
+
+        delta optionally describes a delta package of the same version, as
+        returned by BasePackager.deployable(); package_path is then the full
+        package, for hosts that cannot use the delta.
+        """
+        if self.env_type not in ENVIRONMENT_TYPES:
+            raise ValueError(f"Environment type {self.env_type} deployment not implemented yet")
+        # Only passed when set, so environment types without delta support keep working
+        options = {'delta': delta} if delta is not None else {}
+        return self.environment.deploy(package_path, app_name, version, **options)
+
+    def _deploy_vm(self, package_path, app_name, version, delta=None):
+        """Push package_path to every host in rolling batches and return a HostResult per host.
+
+        Each batch runs with at most max_parallel hosts at once. A failure in a
+        batch stops the rollout; hosts of later batches are reported as skipped.
+        With a delta, hosts holding the base version's package rebuild the
+        full package from it and the delta; the others get the full package.
+        """
+
+        release_dir = f"{self.deploy_dir.rstrip('/')}/{app_name}/releases/{version}"
+        remote_package = f"{release_dir}/{os.path.basename(package_path)}"
+
+        uploader = manifest = digest = syncer = None
+        if self.env_config.get('upload_mode') == 'sync':
+            syncer = self._tree_syncer(package_path)
+        elif self.env_config.get('upload_mode') == 'chunked':
+            uploader = ChunkedUploader(f"{self.deploy_dir.rstrip('/')}/{CHUNK_DIR_NAME}",
+                                       chunk_size=int(self.env_config.get('chunk_size', DEFAULT_CHUNK_SIZE)),
+                                       keep_chunks=self.env_config.get('keep_chunks', False))
+            # Hash the package once for all hosts
+            manifest = ChunkManifest(package_path, uploader.chunk_size)
+        elif self.env_config.get('upload_skip_existing', False):
+            # Hash the package once; hosts that already hold these bytes are not sent them again
+            digest = file_digest(package_path)
+        if delta is not None and (syncer is not None or uploader is not None
+                                  or self.env_config.get('distribution') == 'tree'):
+            delta = None
+        if delta is not None:
+            # What a rebuilt package must hold, whatever compressor the host used
+            delta = dict(delta, content_digest=content_digest(package_path))
+
+        try:
+            return self._deploy_batches(package_path, remote_package, app_name, version, release_dir,
+                                        uploader, manifest, digest, syncer, delta)
+        finally:
+            if syncer is not None:
+                syncer.close()
+
+    def _deploy_batches(self, package_path, remote_package, app_name, version, release_dir,
+                        uploader, manifest, digest, syncer, delta=None):
+        results = []
+        batches = self.rolling_batches()
+        for number, batch in enumerate(batches, 1):
+            logger.info(f"Deploying {app_name} {version} to batch {number}/{len(batches)}: {', '.join(batch)}")
+            if self.env_config.get('distribution') == 'tree':
+                batch_results = self._deploy_batch_tree(batch, package_path, remote_package,
+                                                        app_name, version, release_dir)
+            else:
+                batch_results = self._run_on_hosts(
+                    batch, lambda session: self._deploy_host(session, package_path, remote_package,
+                                                             app_name, version, release_dir,
+                                                             uploader, manifest, digest, syncer, delta))
+            results.extend(batch_results)
+
+            if not all(result.success for result in batch_results):
+                remaining = [host for later in batches[number:] for host in later]
+                if remaining:
+                    logger.error(f"Stopping rollout after failures in batch {number}; "
+                                 f"skipping {', '.join(remaining)}")
+                results.extend(HostResult(host, False, error='skipped after earlier batch failed')
+                               for host in remaining)
+                break
+
+        return results
+
+    def _deploy_batch_tree(self, hosts, package_path, remote_package, app_name, version, release_dir):
+        """Seed a few hosts from here and let hosts relay the package to each other"""
+        distributor = TreeDistributor(
+            self.pool, self.user,
+            seeds=int(self.env_config.get('distribution_seeds', 2)),
+            fanout=int(self.env_config.get('distribution_fanout', 2)),
+        )
+        with span('distribute', hosts=len(hosts)) as stage:
+            errors = distributor.distribute(hosts, package_path, remote_package)
+            stage.add_bytes(os.path.getsize(package_path) * len(hosts))
+
+        received = [host for host in hosts if errors[host] is None]
+        activated = self._run_on_hosts(
+            received, lambda session: self._activate(session, remote_package, app_name, version, release_dir)
+        ) if received else []
+
+        activated = {result.host: result for result in activated}
+        return [activated.get(host) or HostResult(host, False, error=errors[host]) for host in hosts]
+
+    def rolling_batches(self):
+        """Split hosts into batches of batch_percent of the fleet (at least one host each)"""
+        if not self.hosts:
+            return []
+        size = max(1, math.ceil(len(self.hosts) * float(self.batch_percent) / 100))
+        return [self.hosts[i:i + size] for i in range(0, len(self.hosts), size)]
+
+    def _run_on_hosts(self, hosts, action):
+        """Run action(session) on each host concurrently, at most max_parallel at a time"""
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(hosts))) as executor:
+            return list(executor.map(lambda host: self._run_on_host(host, action), hosts))
+
+    def _run_on_host(self, host, action):
+        start = time.monotonic()
+        try:
+            with self.pool.session(host, self.user) as session:
+                action(session)
+            return HostResult(host, True, time.monotonic() - start)
+        except Exception as e:
+            logger.error(f"{host}: {str(e)}")
+            return HostResult(host, False, time.monotonic() - start, str(e))
+
+    def _prepare_host(self, session):
+        with span('prepare_host', host=session.host):
+            session.makedirs(self.deploy_dir)
+            for command in self.env_config.get('prepare_commands', []):
+                session.run(command.format(**self._placeholders(session)))
+
+    def _tree_syncer(self, package_path):
+        """Unpack the package for block sync, or return None for packages that are not tar archives"""
+        try:
+            return TreeSyncer(package_path, int(self.env_config.get('sync_block_size', DEFAULT_BLOCK_SIZE)))
+        except (tarfile.TarError, RuntimeError) as e:
+            logger.warning(f"Cannot unpack {package_path} for block sync, uploading it whole: {str(e)}")
+            return None
+
+    def _deploy_host(self, session, package_path, remote_package, app_name, version, release_dir,
+                     uploader=None, manifest=None, digest=None, syncer=None, delta=None):
+        if syncer is not None:
+            # The release directory is rebuilt from the host's previous release and holds the unpacked tree
+            with span('upload', host=session.host, mode='sync') as stage:
+                stage.add_bytes(syncer.sync(session, f"{self.deploy_dir.rstrip('/')}/{app_name}", version))
+                logger.info(f"{session.host}: synced {release_dir}")
+            # No package file reaches the host in this mode; {package} names the synced tree instead
+            self._activate(session, release_dir, app_name, version, release_dir)
+            return
+
+        session.makedirs(release_dir)
+        with span('upload', host=session.host, mode='chunked' if uploader else 'full') as stage:
+            if digest is not None and self._remote_digest(session, remote_package) == digest:
+                stage.args['skipped'] = True
+                logger.info(f"{session.host}: {remote_package} already present, skipping upload")
+            elif delta is not None and self._upload_delta(session, delta, remote_package, app_name):
+                stage.args['delta'] = True
+                stage.add_bytes(os.path.getsize(delta['path']))
+                logger.info(f"{session.host}: rebuilt {remote_package} from version {delta['base_version']}")
+            else:
+                if uploader is None:
+                    session.put(package_path, remote_package)
+                else:
+                    self._upload_chunked(session, uploader, package_path, remote_package, manifest,
+                                         f"{app_name}-{version}")
+                stage.add_bytes(os.path.getsize(package_path))
+                logger.info(f"{session.host}: uploaded {remote_package}")
+        self._activate(session, remote_package, app_name, version, release_dir)
+
+    def _upload_delta(self, session, delta, remote_package, app_name):
+        """Rebuild remote_package on the host from the base version's package and the delta.
+
+        Returns False, leaving the full upload to the caller, when the host does
+        not hold the base package or the rebuilt package does not match.
+        """
+        app_dir = f"{self.deploy_dir.rstrip('/')}/{app_name}"
+        base_dir = f"{app_dir}/releases/{delta['base_version']}"
+        if delta['base_package'] not in session.list_dir(base_dir):
+            return False
+
+        remote_delta = f"{remote_package}.delta"
+        try:
+            session.put(delta['path'], remote_delta)
+            try:
+                rebuilt = session.apply_package_delta(app_dir, f"{base_dir}/{delta['base_package']}",
+                                                      remote_delta, remote_package)
+            finally:
+                session.remove(remote_delta)
+        except Exception as e:
+            logger.warning(f"{session.host}: cannot apply the delta, uploading the full package: {str(e)}")
+            return False
+        if rebuilt != delta['content_digest']:
+            logger.warning(f"{session.host}: package rebuilt from the delta does not match, "
+                           f"uploading the full package")
+            return False
+        return True
+
+    def _remote_digest(self, session, remote_path):
+        """Return the sha256 of a file on the host, or None if it cannot be read"""
+        try:
+            return session.checksum(remote_path)
+        except (TransportError, OSError, IndexError):
+            return None
+
+    def _upload_chunked(self, session, uploader, package_path, remote_package, manifest, name):
+        """Upload in chunks, resuming from the chunks already on the host after a failure"""
+        attempts = int(self.env_config.get('upload_retries', 2)) + 1
+        for attempt in range(1, attempts + 1):
+            try:
+                uploader.upload(session, package_path, remote_package, manifest, name)
+                return
+            except Exception as e:
+                if attempt == attempts:
+                    raise
+                logger.warning(f"{session.host}: upload attempt {attempt} failed, resuming: {str(e)}")
+
+    def _activate(self, session, remote_package, app_name, version, release_dir):
+        placeholders = self._placeholders(session, app=app_name, version=version,
+                                          package=session.host_path(remote_package),
+                                          release_dir=session.host_path(release_dir))
+        with span('activate', host=session.host):
+            for command in self.env_config.get('activate_commands', []):
+                session.run(command.format(**placeholders))
+
+    def _placeholders(self, session, **extra):
+        placeholders = {'host': session.host, 'user': self.user or '', 'deploy_dir': session.host_path(self.deploy_dir)}
+        placeholders.update(extra)
+        return placeholders
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+orchestrator.py - Concurrent deployment of many applications to many environments
+"""
+import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pipeline import Pipeline, Stage
+
+logger = logging.getLogger("orchestrator")
+
+
+class DeploymentResult:
+    """Outcome of deploying one application to one environment"""
+
+    def __init__(self, app_name, env_name, success, stage, duration=0.0, detail=''):
+        self.app_name = app_name
+        self.env_name = env_name
+        self.success = success
+        self.stage = stage
+        self.duration = duration
+        self.detail = detail
+
+    def __repr__(self):
+        status = 'ok' if self.success else f"failed at {self.stage}"
+        return f"DeploymentResult({self.app_name} -> {self.env_name}: {status})"
+
+
+def resolve_names(spec, available, kind):
+    """Expand a comma-separated name list (or 'all') against the configured names"""
+    if spec == 'all':
+        return list(available)
+
+    names = [name.strip() for name in spec.split(',') if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown {kind}(s): {', '.join(unknown)}")
+    return names
+
+
+def build_plan(app_names, apps):
+    """Order app_names so every app comes after the selected apps it depends_on.
+
+    Returns {app_name: [dependencies within the batch]} in a valid deployment
+    order. Dependencies outside the batch are assumed to be deployed already.
+    """
+    selected = set(app_names)
+    dependencies = {}
+    for app_name in app_names:
+        depends_on = apps[app_name].get('depends_on', []) or []
+        unknown = [dep for dep in depends_on if dep not in apps]
+        if unknown:
+            raise ValueError(f"Application '{app_name}' depends on unknown application(s): {', '.join(unknown)}")
+        dependencies[app_name] = [dep for dep in depends_on if dep in selected]
+
+    plan = {}
+    visiting = set()
+
+    def visit(app_name, path):
+        if app_name in plan:
+            return
+        if app_name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [app_name])}")
+        visiting.add(app_name)
+        for dep in dependencies[app_name]:
+            visit(dep, path + [app_name])
+        visiting.discard(app_name)
+        plan[app_name] = dependencies[app_name]
+
+    for app_name in app_names:
+        visit(app_name, [])
+    return plan
+
+
+class BatchDeployer:
+    """Validates, packages and deploys a batch of apps on a bounded thread pool.
+
+    Each app is validated and packaged once and the package is deployed to
+    every selected environment. Configuration and packagers are shared by all
+    deployments of the batch.
+    """
+
+    def __init__(self, app_spec, env_spec, environments, apps, version=None, test_mode=False,
+                 jobs=4, manager_class=None, pipelined=False, deploy_jobs=1, queue_size=2, build_pool=None):
+        if manager_class is None:
+            from deployer import DeploymentManager
+            manager_class = DeploymentManager
+
+        self.environments = environments
+        self.apps = apps
+        self.version = version or datetime.now().strftime('%Y%m%d.%H%M%S')
+        self.test_mode = test_mode
+        self.jobs = max(1, jobs)
+        self.manager_class = manager_class
+        self.pipelined = pipelined
+        self.deploy_jobs = max(1, deploy_jobs)
+        self.queue_size = queue_size
+        # Packages are built on these workers when set
+        self.build_pool = build_pool
+
+        self.app_names = resolve_names(app_spec, apps, 'application')
+        self.env_names = resolve_names(env_spec, environments, 'environment')
+        self.plan = build_plan(self.app_names, apps)
+        self.env_managers = {}
+
+    def run(self):
+        """Deploy the batch and return a list of DeploymentResult in plan order"""
+        from env_manager import EnvironmentManager
+
+        # One manager per environment so host connections are reused across apps
+        self.env_managers = {
+            env_name: EnvironmentManager(self.environments[env_name], test_mode=self.test_mode)
+            for env_name in self.env_names
+        }
+        try:
+            return self._run_pipelined() if self.pipelined else self._run_concurrent()
+        finally:
+            for env_manager in self.env_managers.values():
+                env_manager.close()
+
+    def _run_concurrent(self):
+        logger.info(f"Deploying {len(self.plan)} application(s) to {', '.join(self.env_names)} "
+                    f"with {self.jobs} worker(s)")
+
+        results = {}
+        pending = dict(self.plan)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                for app_name, deps in list(pending.items()):
+                    if any(dep not in results for dep in deps):
+                        continue
+                    del pending[app_name]
+
+                    failed = [dep for dep in deps if not all(r.success for r in results[dep])]
+                    if failed:
+                        results[app_name] = self._skipped(app_name, f"dependency {', '.join(failed)} failed")
+                        continue
+                    running[executor.submit(self._deploy_app, app_name)] = app_name
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+        return [result for app_name in self.plan for result in results[app_name]]
+
+    def _run_pipelined(self):
+        """Overlap stages across apps: one app deploys while the next ones validate and package"""
+        logger.info(f"Pipelining {len(self.plan)} application(s) to {', '.join(self.env_names)}: "
+                    f"{self.jobs} build worker(s), {self.deploy_jobs} deploy worker(s), queue size {self.queue_size}")
+
+        results = {}
+
+        def deps_deployed(item, done_keys):
+            return all(dep in done_keys for dep in self.plan[item.key])
+
+        def deploy(payload):
+            app_name, managers, package_path, start = payload
+            # A dependency without results failed in an earlier stage
+            failed = [dep for dep in self.plan[app_name]
+                      if dep not in results or not all(r.success for r in results[dep])]
+            if failed:
+                app_results = self._skipped(app_name, f"dependency {', '.join(failed)} failed")
+            else:
+                app_results = self._deploy_all(app_name, managers, package_path, time.monotonic() - start)
+            # Recorded before the stage marks the app done, so dependents see it when released
+            results[app_name] = app_results
+            return app_results
+
+        stages = [
+            Stage('validate', self._validate_stage, workers=self.jobs),
+            Stage('package', self._package_stage, workers=self.jobs),
+            Stage('deploy', deploy, workers=self.deploy_jobs, ready=deps_deployed),
+        ]
+
+        items = Pipeline(stages, queue_size=self.queue_size).run(
+            (app_name, (app_name, time.monotonic())) for app_name in self.plan
+        )
+        for item in items:
+            if not item.success:
+                duration = sum(item.timings.values())
+                results[item.key] = [
+                    DeploymentResult(item.key, env_name, False, item.failed_stage, duration, str(item.error))
+                    for env_name in self.env_names
+                ]
+
+        return [result for app_name in self.plan for result in results[app_name]]
+
+    def _validate_stage(self, payload):
+        app_name, start = payload
+        managers = self._create_managers(app_name)
+        if not managers[0].validate():
+            raise ValueError("Validation failed")
+        return app_name, managers, start
+
+    def _package_stage(self, payload):
+        app_name, managers, start = payload
+        return app_name, managers, managers[0].package(), start
+
+    def _deploy_app(self, app_name):
+        start = time.monotonic()
+        stage = 'setup'
+        try:
+            managers = self._create_managers(app_name)
+
+            stage = 'validate'
+            if not managers[0].validate():
+                raise ValueError("Validation failed")
+
+            stage = 'package'
+            package_path = managers[0].package()
+        except Exception as e:
+            logger.error(f"{app_name} failed at {stage}: {str(e)}", exc_info=True)
+            return [DeploymentResult(app_name, env_name, False, stage, time.monotonic() - start, str(e))
+                    for env_name in self.env_names]
+
+        return self._deploy_all(app_name, managers, package_path, time.monotonic() - start)
+
+    def _create_managers(self, app_name):
+        """Create one manager per environment sharing the first one's packager and validator"""
+        # Only passed when set, so manager classes without build pool support keep working
+        options = {'build_pool': self.build_pool} if self.build_pool is not None else {}
+        first = self.manager_class(app_name, self.env_names[0], self.version, test_mode=self.test_mode,
+                                   environments=self.environments, apps=self.apps,
+                                   env_manager=self.env_managers.get(self.env_names[0]), **options)
+        return [first] + [
+            self.manager_class(app_name, env_name, self.version, test_mode=self.test_mode,
+                               environments=self.environments, apps=self.apps,
+                               packager=first.packager, validator=first.validator,
+                               env_manager=self.env_managers.get(env_name))
+            for env_name in self.env_names[1:]
+        ]
+
+    def _deploy_all(self, app_name, managers, package_path, build_time):
+        results = []
+        for manager in managers:
+            deploy_start = time.monotonic()
+            try:
+                success = manager.deploy(package_path)
+                detail = package_path if success else 'deploy reported failure'
+            except Exception as e:
+                logger.error(f"{app_name} failed to deploy to {manager.env_name}: {str(e)}", exc_info=True)
+                success, detail = False, str(e)
+            duration = build_time + time.monotonic() - deploy_start
+            results.append(DeploymentResult(app_name, manager.env_name, success, 'deploy', duration, detail))
+        return results
+
+    def _skipped(self, app_name, reason):
+        logger.warning(f"Skipping {app_name}: {reason}")
+        return [DeploymentResult(app_name, env_name, False, 'skipped', 0.0, reason)
+                for env_name in self.env_names]
+
+
+def format_results(results):
+    """Render results as a plain-text table"""
+    headers = ('APP', 'ENVIRONMENT', 'STATUS', 'STAGE', 'TIME', 'DETAIL')
+    rows = [
+        (r.app_name, r.env_name, 'OK' if r.success else 'FAILED', r.stage, f"{r.duration:.2f}s", r.detail)
+        for r in results
+    ]
+    widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+
+    lines = ['  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip()
+             for row in [headers] + rows]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+
+    failed = sum(1 for r in results if not r.success)
+    lines.append(f"\n{len(results) - failed} succeeded, {failed} failed")
+    return '\n'.join(lines)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+package_cache.py - Content-addressed cache for built packages
+"""
+import os
+import re
+import json
+import shutil
+import hashlib
+import logging
+import threading
+
+from source_scanner import file_digest, scan_tree
+
+logger = logging.getLogger("package_cache")
+
+CACHE_DIR_NAME = '.cache'
+INDEX_NAME = 'index.json'
+# Cached artifacts are named <content fingerprint>-<recipe hash><extension>
+ARTIFACT_NAME_RE = re.compile(r'^[0-9a-f]{64}-[0-9a-f]{16}\.')
+
+
+def fingerprint_tree(source_dir, use_digests=False):
+    """Return a hex fingerprint of the source tree (see SourceManifest.fingerprint)"""
+    return scan_tree(source_dir).fingerprint(use_digests)
+
+
+class PackageCache:
+    """Cache of built artifacts under build/<app>/.cache keyed by source content"""
+
+    def __init__(self, build_dir):
+        self.cache_dir = os.path.join(build_dir, CACHE_DIR_NAME)
+        self.index_path = os.path.join(self.cache_dir, INDEX_NAME)
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def lookup(self, source_dir, recipe, extension, manifest=None):
+        """Return (key, cached_path) for the source tree; cached_path is None on a miss"""
+        index = self._load_index()
+        recipe_hash = hashlib.sha256(recipe.encode('utf-8')).hexdigest()[:16]
+        if manifest is None:
+            manifest = scan_tree(source_dir)
+
+        # Cheap stat-based fingerprint first, content digests only when it is unknown
+        stat_key = f"{manifest.fingerprint()}-{recipe_hash}"
+        key = index['stat'].get(stat_key)
+        if key is None:
+            key = f"{manifest.fingerprint(use_digests=True)}-{recipe_hash}"
+            with self._lock:
+                index = self._load_index()
+                index['stat'][stat_key] = key
+                self._save_index(index)
+
+        cached_path = self._artifact_path(key, extension)
+        if os.path.exists(cached_path):
+            logger.info(f"Package cache hit for {source_dir} ({key[:12]})")
+            return key, cached_path
+
+        logger.info(f"Package cache miss for {source_dir} ({key[:12]})")
+        return key, None
+
+    def store(self, key, extension, package_path):
+        """Record a freshly built package under its cache key"""
+        cached_path = self._artifact_path(key, extension)
+        _link_or_copy(package_path, cached_path)
+        return cached_path
+
+    def materialize(self, cached_path, target_path):
+        """Expose a cached artifact at target_path without rewriting its bytes"""
+        _link_or_copy(cached_path, target_path)
+        return target_path
+
+    def prune(self):
+        """Drop cached artifacts that no versioned package links to any more"""
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            # The directory also holds other build state, such as the validation cache
+            if not ARTIFACT_NAME_RE.match(name) or not os.path.isfile(path):
+                continue
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+                removed += 1
+        if removed:
+            logger.info(f"Pruned {removed} unreferenced artifact(s) from {self.cache_dir}")
+        return removed
+
+    def _artifact_path(self, key, extension):
+        return os.path.join(self.cache_dir, f"{key}{extension}")
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('stat', {})
+        return index
+
+    def _save_index(self, index):
+        temp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.index_path)
+
+
+def _link_or_copy(source_path, target_path):
+    """Hardlink source_path to target_path, falling back to a copy across filesystems"""
+    # rename() between two links to the same file is a no-op that would strand the temp link
+    if os.path.exists(target_path) and os.path.samefile(source_path, target_path):
+        return
+    temp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copy2(source_path, temp_path)
+    os.replace(temp_path, target_path)
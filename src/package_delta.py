@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+package_delta.py - Incremental packages between consecutive versions
+"""
+import os
+import io
+import json
+import stat
+import shutil
+import logging
+import threading
+import tempfile
+import time
+from datetime import datetime
+
+from archive_builder import add_entry, compression_for_path, read_archive, write_archive
+from source_scanner import scan_tree
+
+logger = logging.getLogger("package_delta")
+
+DELTA_METADATA_NAME = '.delta.json'
+MANIFEST_DIR_NAME = 'manifests'
+# Holds the version most recently saved to a ManifestStore
+LATEST_NAME = 'latest'
+# Files modified this recently may change again within the same mtime tick, so their digests are not reused
+RACY_WINDOW_NS = 2 * 1000000000
+
+
+def build_manifest(source_dir, scan=None, previous=None):
+    """Return {relative_path: entry} for every path of a source scan.
+
+    Files map to {size, mode, mtime_ns, digest}, directories to {type: 'dir',
+    mode} and symlinks to directories to {type: 'link', target}. Directory
+    mtimes are left out, so a directory only counts as changed when it is
+    added or its mode changes.
+
+    previous is the files of an earlier manifest; a file whose size, mode and
+    mtime match its entry there keeps that digest instead of being read again.
+    Files modified within RACY_WINDOW_NS of the scan get no mtime_ns, so they
+    are read again next time.
+    """
+    if scan is None:
+        scan = scan_tree(source_dir)
+    previous = previous or {}
+    settled_before = time.time_ns() - RACY_WINDOW_NS
+    manifest = {}
+    for entry in scan.entries:
+        if entry.kind == 'file':
+            mode = stat.S_IMODE(entry.mode)
+            known = previous.get(entry.rel_path)
+            if known and (known.get('size'), known.get('mode'), known.get('mtime_ns')) == (
+                    entry.size, mode, entry.mtime_ns):
+                digest = known['digest']
+            else:
+                digest = entry.digest
+            manifest[entry.rel_path] = {'size': entry.size, 'mode': mode, 'digest': digest}
+            if entry.mtime_ns < settled_before:
+                manifest[entry.rel_path]['mtime_ns'] = entry.mtime_ns
+        elif entry.kind == 'dir':
+            manifest[entry.rel_path] = {'type': 'dir', 'mode': stat.S_IMODE(entry.mode)}
+        else:
+            manifest[entry.rel_path] = {'type': 'link', 'target': entry.link_target}
+    return manifest
+
+
+def diff_manifests(old_files, new_files):
+    """Return (changed, deleted) relative paths going from old_files to new_files.
+
+    mtimes only serve to reuse digests; a touched but unmodified file is unchanged.
+    """
+    changed = sorted(path for path, entry in new_files.items()
+                     if _content(old_files.get(path)) != _content(entry))
+    deleted = sorted(path for path in old_files if path not in new_files)
+    return changed, deleted
+
+
+def _content(entry):
+    if entry is None or 'mtime_ns' not in entry:
+        return entry
+    return {key: value for key, value in entry.items() if key != 'mtime_ns'}
+
+
+class ManifestStore:
+    """Manifests of built versions kept under build/<app>/manifests.
+
+    Each manifest records the version built before it and, for a delta, its
+    depth: the number of deltas between it and the nearest full package. A
+    pointer file names the latest version, so finding it does not read every
+    manifest.
+    """
+
+    def __init__(self, build_dir):
+        self.manifest_dir = os.path.join(build_dir, MANIFEST_DIR_NAME)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def save(self, version, files, artifact, kind='full', base_version=None, previous=None, depth=0):
+        manifest = {
+            'version': version,
+            'kind': kind,
+            'base_version': base_version,
+            'previous': previous,
+            'depth': depth,
+            'artifact': os.path.basename(artifact),
+            'created': datetime.now().isoformat(),
+            'files': files,
+        }
+        _write_json(self._path(version), manifest)
+        _write_json(os.path.join(self.manifest_dir, LATEST_NAME), {'version': version})
+        return manifest
+
+    def load(self, version):
+        with open(self._path(version), 'r') as f:
+            return json.load(f)
+
+    def remove(self, version):
+        if os.path.exists(self._path(version)):
+            os.remove(self._path(version))
+
+    def latest(self, exclude_version=None):
+        """Return the most recently built manifest other than exclude_version, or None when there is none"""
+        try:
+            with open(os.path.join(self.manifest_dir, LATEST_NAME), 'r') as f:
+                version = json.load(f)['version']
+        except (OSError, ValueError, KeyError):
+            version = None
+        seen = set()
+        while version is not None and version not in seen:
+            seen.add(version)
+            try:
+                manifest = self.load(version)
+            except (OSError, ValueError):
+                break
+            if manifest['version'] != exclude_version:
+                return manifest
+            if 'previous' not in manifest:
+                # Saved before manifests recorded the previous version
+                break
+            version = manifest['previous']
+        if version is None and seen:
+            return None
+        return self._scan_latest(exclude_version)
+
+    def _scan_latest(self, exclude_version):
+        # Build directories from before the pointer file, or whose pointer is stale
+        manifests = []
+        for name in os.listdir(self.manifest_dir):
+            if not name.endswith('.json'):
+                continue
+            with open(os.path.join(self.manifest_dir, name), 'r') as f:
+                manifest = json.load(f)
+            if manifest['version'] != exclude_version:
+                manifests.append(manifest)
+
+        if not manifests:
+            return None
+        return max(manifests, key=lambda m: m['created'])
+
+    def chain(self, version):
+        """Return the manifests from the nearest full package up to version, oldest first"""
+        chain = [self.load(version)]
+        while chain[0]['kind'] == 'delta':
+            chain.insert(0, self.load(chain[0]['base_version']))
+        return chain
+
+    def _path(self, version):
+        return os.path.join(self.manifest_dir, f"{version}.json")
+
+
+def build_delta(source_dir, output_path, changed, deleted, base_version, version,
+                compression='gzip', level=None, threads=1, arcname=None, mtime=None, scan=None):
+    """Write a delta archive holding the changed paths and the list of deletions.
+
+    Entries are stored as a full package stores them: symlinks to files as
+    the file's content, and directories and directory symlinks as entries
+    of their own, not with their contents. scan is the source scan the
+    changed paths come from; the tree is scanned again when it is not given.
+
+    mtime makes the archive deterministic, as in write_archive.
+    """
+    source_dir = os.path.normpath(source_dir)
+    if arcname is None:
+        arcname = os.path.basename(os.path.abspath(source_dir))
+    if scan is None:
+        scan = scan_tree(source_dir)
+
+    metadata = {
+        'base_version': base_version,
+        'version': version,
+        'root': arcname,
+        'changed': changed,
+        'deleted': deleted,
+    }
+
+    logger.info(f"Writing delta {output_path}: {len(changed)} changed, {len(deleted)} deleted")
+
+    with write_archive(output_path, compression, level, threads, mtime=mtime) as tar:
+        # Metadata goes first so readers can learn the deletions without scanning the archive
+        _add_bytes(tar, DELTA_METADATA_NAME, json.dumps(metadata, indent=2).encode('utf-8'))
+        for rel_path in changed:
+            add_entry(tar, scan.by_path[rel_path], f"{arcname}/{rel_path}")
+
+    return output_path
+
+
+def read_delta_metadata(delta_path):
+    """Return the metadata stored at the front of a delta archive"""
+    with read_archive(delta_path) as tar:
+        for member in tar:
+            if member.name == DELTA_METADATA_NAME:
+                return json.loads(tar.extractfile(member).read().decode('utf-8'))
+            break
+    raise ValueError(f"{delta_path} is not a delta package")
+
+
+def apply_delta(base_path, delta_paths, output_path, compression=None, level=None, threads=1, mtime=None):
+    """Reconstruct a full package from a full base archive and one or more deltas applied in order"""
+    if isinstance(delta_paths, str):
+        delta_paths = [delta_paths]
+    if compression is None:
+        compression = compression_for_path(output_path)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        current = base_path
+        for index, delta_path in enumerate(delta_paths):
+            is_last = index == len(delta_paths) - 1
+            target = output_path if is_last else os.path.join(temp_dir, f"step-{index}.tar")
+            _apply_one(current, delta_path, target,
+                       compression if is_last else 'none', level, threads, mtime)
+            current = target
+
+        if not delta_paths:
+            shutil.copy2(base_path, output_path)
+
+    return output_path
+
+
+def _apply_one(base_path, delta_path, output_path, compression, level, threads, mtime=None):
+    metadata = read_delta_metadata(delta_path)
+    root = metadata['root']
+    replaced = {f"{root}/{path}" for path in metadata['changed'] + metadata['deleted']}
+
+    logger.info(f"Applying delta {metadata['base_version']} -> {metadata['version']} to {base_path}")
+
+    with write_archive(output_path, compression, level, threads, mtime=mtime) as out:
+        with read_archive(base_path) as base:
+            for member in base:
+                if member.name in replaced:
+                    continue
+                out.addfile(member, base.extractfile(member) if member.isfile() else None)
+
+        with read_archive(delta_path) as delta:
+            for member in delta:
+                if member.name == DELTA_METADATA_NAME:
+                    continue
+                out.addfile(member, delta.extractfile(member) if member.isfile() else None)
+
+
+def _write_json(path, data):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def _add_bytes(tar, name, data):
+    info = tar.tarinfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = int(datetime.now().timestamp())
+    tar.addfile(info, io.BytesIO(data))
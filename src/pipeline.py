@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+pipeline.py - Staged worker pipeline with bounded queues between stages
+"""
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger("pipeline")
+
+_END = object()
+
+
+class Stage:
+    """A pipeline stage: func(payload) -> payload run by a number of worker threads.
+
+    ready(item, done_keys) may hold an item back until the keys it needs have
+    passed through this stage; held items do not block the items behind them.
+    """
+
+    def __init__(self, name, func, workers=1, ready=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.ready = ready
+
+
+class PipelineItem:
+    """A unit of work flowing through the pipeline"""
+
+    def __init__(self, key, payload):
+        self.key = key
+        self.payload = payload
+        self.error = None
+        self.failed_stage = None
+        self.timings = {}
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+class Pipeline:
+    """Runs items through stages concurrently.
+
+    Stages are connected by queues of at most queue_size items, so a fast
+    stage blocks instead of running ahead of a slow one. Items that fail in a
+    stage skip the remaining stage functions but still flow to the end.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    def run(self, items):
+        """Run (key, payload) pairs through every stage and return PipelineItems in completion order"""
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        output = queue.Queue()
+        completed = []
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else output
+            runner = _StageRunner(stage, queues[index], outbox)
+            threads.extend(runner.start())
+
+        feeder = threading.Thread(target=self._feed, args=(items, queues[0]), name='pipeline-feed', daemon=True)
+        feeder.start()
+
+        while True:
+            item = output.get()
+            if item is _END:
+                break
+            completed.append(item)
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        return completed
+
+    def _feed(self, items, inbox):
+        for key, payload in items:
+            inbox.put(PipelineItem(key, payload))
+        inbox.put(_END)
+
+
+class _StageRunner:
+    """Worker threads of one stage plus the bookkeeping for held items"""
+
+    def __init__(self, stage, inbox, outbox):
+        self.stage = stage
+        self.inbox = inbox
+        self.outbox = outbox
+        self.done_keys = set()
+        self.held = []
+        self.active = stage.workers
+        self.lock = threading.Lock()
+
+    def start(self):
+        threads = []
+        for number in range(self.stage.workers):
+            thread = threading.Thread(target=self._work, name=f"pipeline-{self.stage.name}-{number}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is _END:
+                # Let sibling workers see the end marker too
+                self.inbox.put(_END)
+                break
+
+            if item.success and not self._hold_unless_ready(item):
+                continue
+
+            self._process(item)
+            self._release_held()
+
+        with self.lock:
+            self.active -= 1
+            last = self.active == 0
+        if last:
+            self._flush_held()
+            self.outbox.put(_END)
+
+    def _hold_unless_ready(self, item):
+        """Return True if item can run now, otherwise hold it back"""
+        if self.stage.ready is None:
+            return True
+        # Check and hold under one lock so a completing sibling cannot miss the item
+        with self.lock:
+            if self.stage.ready(item, set(self.done_keys)):
+                return True
+            self.held.append(item)
+            return False
+
+    def _process(self, item):
+        if item.success:
+            start = time.monotonic()
+            try:
+                item.payload = self.stage.func(item.payload)
+            except Exception as e:
+                logger.error(f"{item.key} failed in stage {self.stage.name}: {str(e)}", exc_info=True)
+                item.error = e
+                item.failed_stage = self.stage.name
+            item.timings[self.stage.name] = time.monotonic() - start
+
+        with self.lock:
+            self.done_keys.add(item.key)
+        self.outbox.put(item)
+
+    def _release_held(self):
+        while True:
+            with self.lock:
+                ready = [item for item in self.held if self.stage.ready(item, set(self.done_keys))]
+                if not ready:
+                    return
+                item = ready[0]
+                self.held.remove(item)
+            self._process(item)
+
+    def _flush_held(self):
+        self._release_held()
+        for item in list(self.held):
+            item.error = RuntimeError(f"unresolved dependencies in stage {self.stage.name}")
+            item.failed_stage = self.stage.name
+            self.outbox.put(item)
+        self.held = []
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+plugins.py - Lazy, entry-point based registries of packagers, validators, package formats and environment types
+"""
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger("plugins")
+
+ENTRY_POINT_PREFIX = 'deploy_automation'
+
+
+def import_target(spec):
+    """Import 'package.module:attr.path' and return the attribute"""
+    module_name, _, attr_path = spec.partition(':')
+    target = importlib.import_module(module_name)
+    for attr in filter(None, attr_path.split('.')):
+        target = getattr(target, attr)
+    return target
+
+
+def _entry_points(group):
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import importlib_metadata as metadata
+        except ImportError:
+            return []
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=group))
+    # Python < 3.10 returns {group: [EntryPoint, ...]}
+    return list(entry_points.get(group, []))
+
+
+class Registry:
+    """Name -> implementation map that imports an implementation only when it is first used.
+
+    Implementations come from, in order of precedence: register() calls,
+    the built-in table of 'module:attr' strings, and installed packages'
+    entry points in the '<ENTRY_POINT_PREFIX>.<kind>' group. Entry points are
+    only scanned when a name is not registered or built in, so resolving a
+    built-in type never reads package metadata.
+    """
+
+    def __init__(self, kind, builtins=None):
+        self.kind = kind
+        self.group = f"{ENTRY_POINT_PREFIX}.{kind}"
+        self._specs = dict(builtins or {})
+        self._loaded = {}
+        self._entry_points = None
+        self._lock = threading.Lock()
+
+    def register(self, name, target):
+        """Register an implementation object, or a 'module:attr' string to import on first use"""
+        with self._lock:
+            self._loaded.pop(name, None)
+            if isinstance(target, str):
+                self._specs[name] = target
+            else:
+                self._specs.pop(name, None)
+                self._loaded[name] = target
+
+    def load(self, name):
+        """Return the implementation registered as name, importing it if needed"""
+        with self._lock:
+            if name in self._loaded:
+                return self._loaded[name]
+            if name in self._specs:
+                target = import_target(self._specs[name])
+            else:
+                entry_point = self._discover().get(name)
+                if entry_point is None:
+                    raise ValueError(f"Unknown {self.kind} '{name}'; available: {', '.join(self.names())}")
+                logger.debug(f"Loading {self.kind} '{name}' from entry point {entry_point.value}")
+                target = entry_point.load()
+            self._loaded[name] = target
+            return target
+
+    def names(self):
+        return sorted(set(self._loaded) | set(self._specs) | set(self._discover()))
+
+    def __contains__(self, name):
+        return name in self._loaded or name in self._specs or name in self._discover()
+
+    def _discover(self):
+        if self._entry_points is None:
+            self._entry_points = {entry_point.name: entry_point for entry_point in _entry_points(self.group)}
+        return self._entry_points
+
+
+# App type -> packager class, constructed with the app config
+PACKAGERS = Registry('packagers', {
+    'python': 'app_packager:PythonPackager',
+    'perl': 'app_packager:PerlPackager',
+})
+
+# App type -> validator class, constructed with the app config
+VALIDATORS = Registry('validators', {
+    'python': 'validators.python_validator:PythonValidator',
+    'perl': 'validators.perl_validator:PerlValidator',
+})
+
+# Extra package_type values -> callable(packager, version) returning the package path.
+# tarball, wheel and docker are built into the packagers.
+PACKAGE_FORMATS = Registry('package_formats')
+
+# Environment type -> class constructed with the EnvironmentManager, providing
+# prepare() and deploy(package_path, app_name, version) -> [HostResult]
+ENVIRONMENT_TYPES = Registry('environments', {
+    'vm': 'env_manager:VMEnvironment',
+})
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+profiling.py - Timing spans for deployment stages, exported as trace events
+"""
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("profiling")
+
+DEFAULT_TRACE_PATH = os.path.join('build', 'profile.json')
+
+_active = None
+
+
+class Span:
+    """One timed stage; code inside the span may add bytes processed and extra args"""
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.bytes = None
+        self.start = 0.0
+        self.duration = 0.0
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+
+    def add_bytes(self, count):
+        self.bytes = (self.bytes or 0) + count
+
+    @property
+    def throughput(self):
+        """Bytes per second, or None if no bytes were recorded"""
+        if self.bytes is None or self.duration <= 0:
+            return None
+        return self.bytes / self.duration
+
+
+class Profiler:
+    """Collects finished spans from all threads"""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def trace_events(self):
+        """Return the spans in Chrome trace-event format (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in sorted(self.spans, key=lambda s: s.start):
+            threads.setdefault(span.thread_id, span.thread_name)
+            args = dict(span.args)
+            if span.bytes is not None:
+                args['bytes'] = span.bytes
+                if span.throughput is not None:
+                    args['throughput_mb_s'] = round(span.throughput / (1024 * 1024), 3)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': round((span.start - self.origin) * 1e6, 3),
+                'dur': round(span.duration * 1e6, 3),
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': args,
+            })
+        for thread_id, thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                           'args': {'name': thread_name}})
+        return events
+
+    def write_trace(self, path=DEFAULT_TRACE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+        logger.info(f"Wrote {len(self.spans)} span(s) to {path}")
+        return path
+
+    def summary(self):
+        """Render per-stage totals as a plain-text table, slowest stage first"""
+        stages = {}
+        for span in self.spans:
+            stage = stages.setdefault(span.name, {'count': 0, 'total': 0.0, 'max': 0.0, 'bytes': None})
+            stage['count'] += 1
+            stage['total'] += span.duration
+            stage['max'] = max(stage['max'], span.duration)
+            if span.bytes is not None:
+                stage['bytes'] = (stage['bytes'] or 0) + span.bytes
+
+        headers = ('STAGE', 'COUNT', 'TOTAL', 'MAX', 'BYTES', 'THROUGHPUT')
+        rows = []
+        for name, stage in sorted(stages.items(), key=lambda item: item[1]['total'], reverse=True):
+            size = throughput = '-'
+            if stage['bytes'] is not None:
+                size = _format_bytes(stage['bytes'])
+                if stage['total'] > 0:
+                    throughput = f"{_format_bytes(stage['bytes'] / stage['total'])}/s"
+            rows.append((name, stage['count'], f"{stage['total']:.3f}s", f"{stage['max']:.3f}s", size, throughput))
+
+        widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+        lines = ['  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip()
+                 for row in [headers] + rows]
+        lines.insert(1, '  '.join('-' * width for width in widths))
+        return '\n'.join(lines)
+
+
+def enable_profiling():
+    """Start collecting spans process-wide and return the Profiler"""
+    global _active
+    _active = Profiler()
+    return _active
+
+
+def disable_profiling():
+    """Stop collecting spans and return the Profiler that was active, if any"""
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def active_profiler():
+    return _active
+
+
+@contextmanager
+def span(name, category='deploy', **args):
+    """Time the enclosed block as a stage; a no-op unless profiling is enabled"""
+    record = Span(name, category, args)
+    profiler = _active
+    if profiler is None:
+        yield record
+        return
+
+    record.start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.args['error'] = type(e).__name__
+        raise
+    finally:
+        record.duration = time.perf_counter() - record.start
+        profiler.add(record)
+
+
+def _format_bytes(count):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if count < 1024 or unit == 'GiB':
+            return f"{count:.0f}{unit}" if unit == 'B' else f"{count:.1f}{unit}"
+        count /= 1024.0
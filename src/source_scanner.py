@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+source_scanner.py - Single-pass source tree scan shared by validation, caching and packaging
+"""
+import os
+import re
+import stat
+import hashlib
+import logging
+
+logger = logging.getLogger("source_scanner")
+
+IGNORE_FILE_NAME = '.deployignore'
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _translate(pattern):
+    """Translate a .dockerignore-style glob into a regex body"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+            continue
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append(f"[{body}]")
+                i = end
+        else:
+            parts.append(re.escape(char))
+        i += 1
+    return ''.join(parts)
+
+
+# Version control, bytecode and tool caches never belong in a package
+DEFAULT_EXCLUDES = (
+    '**/.git',
+    '**/.hg',
+    '**/.svn',
+    '**/__pycache__',
+    '**/*.py[cod]',
+    '**/.venv',
+    '**/.tox',
+    '**/.pytest_cache',
+    '**/.mypy_cache',
+    '**/.DS_Store',
+)
+
+
+def _parse_patterns(patterns):
+    """Yield (pattern, negated) for the meaningful lines of an ignore list"""
+    for pattern in patterns:
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith('#'):
+            continue
+        negated = pattern.startswith('!')
+        pattern = os.path.normpath(pattern.lstrip('!').strip().lstrip('/')).replace(os.sep, '/')
+        if pattern not in ('', '.'):
+            yield pattern, negated
+
+
+def _literal_prefix(pattern):
+    """Return the leading directories of a pattern that contain no wildcards"""
+    prefix = []
+    for part in pattern.split('/')[:-1]:
+        if any(char in part for char in '*?['):
+            break
+        prefix.append(part)
+    return '/'.join(prefix)
+
+
+class IgnoreRules:
+    """Exclusion patterns with .dockerignore semantics, plus optional include patterns.
+
+    Patterns are relative to the source root; `**` matches any number of
+    directories and a leading `!` re-includes paths excluded by an earlier
+    pattern. The last matching pattern wins. A pattern that matches a
+    directory also matches everything below it. When include patterns are
+    given, only paths matching one of them are kept.
+
+    All patterns are compiled into one alternation, so the common case of a
+    path that matches nothing costs a single regex match.
+    """
+
+    def __init__(self, patterns=(), include=()):
+        self.rules = [(re.compile(f"^{_translate(pattern)}(?:/.*)?$"), negated)
+                      for pattern, negated in _parse_patterns(patterns)]
+        self.has_negations = any(negated for _, negated in self.rules)
+        self._any = _alternation([regex for regex, _ in self.rules])
+
+        include = [pattern for pattern, negated in _parse_patterns(include) if not negated]
+        self._include = _alternation([re.compile(f"^{_translate(pattern)}(?:/.*)?$") for pattern in include])
+        self._include_prefixes = [_literal_prefix(pattern) for pattern in include]
+
+    @classmethod
+    def from_file(cls, path):
+        """Load the rules of an ignore file; a missing file yields no rules"""
+        return cls(_read_lines(path))
+
+    @classmethod
+    def for_app(cls, app_config):
+        """Combine the default excludes, apps.yaml exclude/include lists and the app's .deployignore"""
+        patterns = list(DEFAULT_EXCLUDES) if app_config.get('default_excludes', True) else []
+        patterns.extend(app_config.get('exclude', []) or [])
+        patterns.extend(_read_lines(os.path.join(app_config['source_dir'], IGNORE_FILE_NAME)))
+        return cls(patterns, app_config.get('include', []) or [])
+
+    def __bool__(self):
+        return bool(self.rules) or self._include is not None
+
+    def ignored(self, rel_path):
+        if self._include is not None and not self._include.match(rel_path):
+            return True
+        return self._excluded(rel_path)
+
+    def _excluded(self, rel_path):
+        if self._any is None or not self._any.match(rel_path):
+            return False
+        for regex, negated in reversed(self.rules):
+            if regex.match(rel_path):
+                return not negated
+        return False
+
+    def prunes(self, rel_dir):
+        """True if nothing below rel_dir can be included, so the scan may skip it"""
+        if self._include is not None and not self._include.match(rel_dir):
+            below = f"{rel_dir}/"
+            if not any(prefix == '' or f"{prefix}/".startswith(below) or below.startswith(f"{prefix}/")
+                       for prefix in self._include_prefixes):
+                return True
+        return not self.has_negations and self._excluded(rel_dir)
+
+
+def _alternation(regexes):
+    if not regexes:
+        return None
+    return re.compile('|'.join(f"(?:{regex.pattern})" for regex in regexes))
+
+
+def _read_lines(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+class FileEntry:
+    """One scanned path with the stat fields the stages need"""
+
+    __slots__ = ('rel_path', 'path', 'kind', 'size', 'mode', 'mtime_ns', 'uid', 'gid', 'link_target', '_digest')
+
+    def __init__(self, rel_path, path, kind, st, link_target=None):
+        self.rel_path = rel_path
+        self.path = path
+        self.kind = kind
+        self.size = st.st_size if kind == 'file' else 0
+        self.mode = st.st_mode
+        self.mtime_ns = st.st_mtime_ns
+        self.uid = st.st_uid
+        self.gid = st.st_gid
+        self.link_target = link_target
+        self._digest = None
+
+    @property
+    def is_dir(self):
+        return self.kind == 'dir'
+
+    @property
+    def digest(self):
+        """The content sha256, computed on first use"""
+        if self._digest is None and self.kind == 'file':
+            self._digest = file_digest(self.path)
+        return self._digest
+
+    def __repr__(self):
+        return f"FileEntry({self.rel_path!r}, {self.kind}, {self.size})"
+
+
+class SourceManifest:
+    """In-memory listing of a source tree produced by one scan.
+
+    entries are in depth-first order with each directory before its
+    contents, matching `tar -C <parent> <name>`. Symlinks to files are
+    treated as the files they point to; symlinks to directories are kept as
+    'link' entries and not followed.
+    """
+
+    def __init__(self, source_dir, entries, ignore_rules):
+        self.source_dir = source_dir
+        self.entries = entries
+        self.ignore_rules = ignore_rules
+        self.files = sorted((entry for entry in entries if entry.kind == 'file'), key=lambda e: e.rel_path)
+        self.by_path = {entry.rel_path: entry for entry in entries}
+
+    @property
+    def total_bytes(self):
+        return sum(entry.size for entry in self.files)
+
+    def rebased(self, source_dir):
+        """Return a copy of this manifest for a mirror of the tree at source_dir.
+
+        The copy keeps the stat fields and any computed digests, which the
+        mirror shares when it was synced with sync_directory().
+        """
+        entries = []
+        for entry in self.entries:
+            copy = FileEntry.__new__(FileEntry)
+            for slot in FileEntry.__slots__:
+                setattr(copy, slot, getattr(entry, slot))
+            copy.path = os.path.join(source_dir, *entry.rel_path.split('/'))
+            entries.append(copy)
+        return SourceManifest(source_dir, entries, self.ignore_rules)
+
+    def fingerprint(self, use_digests=False):
+        """Return a hex fingerprint of the tree.
+
+        Every entry is hashed with its kind, permission bits and link target,
+        so directories, directory symlinks and mode changes count as well as
+        file contents. By default files add their size and mtime, which is
+        cheap. With use_digests they add their content digest instead, so a
+        tree whose files were touched but not modified keeps its fingerprint.
+        """
+        tree_hash = hashlib.sha256()
+        for entry in sorted(self.entries, key=lambda e: e.rel_path):
+            value = ''
+            if entry.kind == 'file':
+                value = entry.digest if use_digests else entry.mtime_ns
+            tree_hash.update(f"{entry.rel_path}\0{entry.kind}\0{stat.S_IMODE(entry.mode):o}\0"
+                             f"{entry.link_target or ''}\0{entry.size}\0{value}\n".encode('utf-8'))
+        return tree_hash.hexdigest()
+
+
+def scan_app(app_config):
+    """Scan an app's source directory with the app's ignore rules"""
+    return scan_tree(app_config['source_dir'], IgnoreRules.for_app(app_config))
+
+
+def scan_tree(source_dir, ignore_rules=None):
+    """Scan source_dir once with os.scandir and return a SourceManifest.
+
+    Paths matched by ignore_rules, or by the tree's .deployignore file when
+    ignore_rules is None, are left out.
+    """
+    if ignore_rules is None:
+        ignore_rules = IgnoreRules.from_file(os.path.join(source_dir, IGNORE_FILE_NAME))
+
+    entries = []
+    _scan_dir(source_dir, '', ignore_rules, entries)
+    manifest = SourceManifest(source_dir, entries, ignore_rules)
+    logger.debug(f"Scanned {source_dir}: {len(manifest.files)} file(s), {manifest.total_bytes} byte(s)")
+    return manifest
+
+
+def _scan_dir(directory, rel_dir, ignore_rules, entries):
+    with os.scandir(directory) as it:
+        children = sorted(it, key=lambda child: child.name)
+
+    for child in children:
+        rel_path = f"{rel_dir}{child.name}"
+        if ignore_rules and ignore_rules.ignored(rel_path):
+            if child.is_dir(follow_symlinks=False) and not ignore_rules.prunes(rel_path):
+                # A later `!pattern` may re-include something below this directory
+                included = []
+                _scan_dir(child.path, f"{rel_path}/", ignore_rules, included)
+                if included:
+                    entries.append(FileEntry(rel_path, child.path, 'dir', child.stat(follow_symlinks=False)))
+                    entries.extend(included)
+            continue
+
+        if child.is_dir(follow_symlinks=False):
+            entries.append(FileEntry(rel_path, child.path, 'dir', child.stat(follow_symlinks=False)))
+            _scan_dir(child.path, f"{rel_path}/", ignore_rules, entries)
+        elif child.is_symlink() and child.is_dir():
+            entries.append(FileEntry(rel_path, child.path, 'link', child.stat(follow_symlinks=False),
+                                     link_target=os.readlink(child.path)))
+        else:
+            try:
+                st = child.stat()
+            except FileNotFoundError:
+                # Dangling symlink
+                entries.append(FileEntry(rel_path, child.path, 'link', child.stat(follow_symlinks=False),
+                                         link_target=os.readlink(child.path)))
+                continue
+            if stat.S_ISREG(st.st_mode):
+                entries.append(FileEntry(rel_path, child.path, 'file', st))
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+transports.py - Host transports used to push packages and run commands on hosts
+"""
+import os
+import json
+import shlex
+import shutil
+import logging
+import tempfile
+import subprocess
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+import block_sync
+import delta_apply
+from package_cache import file_digest
+
+logger = logging.getLogger("transports")
+
+# Host-side helper scripts are uploaded here, below the directory they work on
+HELPER_DIR_NAME = '.deploy-helpers'
+
+
+class TransportError(RuntimeError):
+    """Raised when a transfer or remote command fails"""
+
+
+class Session(ABC):
+    """An open connection to a single host"""
+
+    def __init__(self, host, user):
+        self.host = host
+        self.user = user
+        # Helper scripts known to be on the host
+        self._helpers = set()
+
+    @abstractmethod
+    def put(self, local_path, remote_path):
+        """Copy a local file to remote_path on the host"""
+        pass
+
+    @abstractmethod
+    def run(self, command):
+        """Run a shell command on the host and return its output, raising TransportError on failure"""
+        pass
+
+    def host_path(self, remote_path):
+        """Return remote_path as commands passed to run() see it"""
+        return remote_path
+
+    def makedirs(self, remote_dir):
+        self.run(f"mkdir -p {shlex.quote(remote_dir)}")
+
+    def checksum(self, remote_path):
+        """Return the sha256 hex digest of a file on the host"""
+        return self.run(f"sha256sum {shlex.quote(remote_path)}").split()[0]
+
+    def list_dir(self, remote_dir):
+        """Return the names in a directory on the host, or [] if it does not exist"""
+        output = self.run(f"ls -1 {shlex.quote(remote_dir)} 2>/dev/null || true")
+        return [name for name in output.splitlines() if name]
+
+    def rename(self, remote_path, new_path):
+        self.run(f"mv -f {shlex.quote(remote_path)} {shlex.quote(new_path)}")
+
+    def remove(self, remote_path):
+        self.run(f"rm -f {shlex.quote(remote_path)}")
+
+    def remove_dir(self, remote_dir):
+        """Remove an empty directory on the host; a missing or non-empty one is left alone"""
+        self.run(f"rmdir {shlex.quote(remote_dir)} 2>/dev/null || true")
+
+    def concat(self, remote_parts, remote_path):
+        """Concatenate files on the host into remote_path"""
+        if not remote_parts:
+            self.run(f": > {shlex.quote(remote_path)}")
+            return
+        parts = ' '.join(shlex.quote(part) for part in remote_parts)
+        self.run(f"cat {parts} > {shlex.quote(remote_path)}")
+
+    def relay(self, remote_path, target_session, target_path):
+        """Copy a file from this host directly to another host"""
+        raise TransportError(f"{type(self).__name__} does not support host-to-host relay")
+
+    def tree_signatures(self, app_dir, block_size, paths=None):
+        """Return block_sync.tree_signatures() of app_dir, computed on the host"""
+        if not paths:
+            return json.loads(self.run_helper(block_sync, app_dir, ['signatures', app_dir, str(block_size)]))
+
+        # The path list is uploaded, as it can exceed the host's command line limit
+        remote_paths = f"{app_dir.rstrip('/')}/{block_sync.PATHS_PREFIX}{os.getpid()}.{id(self)}.json"
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump(paths, f)
+        try:
+            self.put(f.name, remote_paths)
+            try:
+                output = self.run_helper(block_sync, app_dir, ['signatures', app_dir, str(block_size), remote_paths])
+            finally:
+                self.remove(remote_paths)
+        finally:
+            os.remove(f.name)
+        return json.loads(output)
+
+    def apply_tree_delta(self, app_dir, version, remote_delta):
+        """Build the release version under app_dir on the host from an uploaded block_sync delta"""
+        self.run_helper(block_sync, app_dir, ['apply', app_dir, version, remote_delta])
+
+    def apply_package_delta(self, app_dir, base_package, remote_delta, remote_package):
+        """Rebuild remote_package on the host from base_package and a delta package.
+
+        Returns the delta_apply.content_digest() of the rebuilt package.
+        """
+        output = self.run_helper(delta_apply, app_dir, ['apply', base_package, remote_delta, remote_package])
+        return json.loads(output)['digest']
+
+    def run_helper(self, module, remote_dir, args):
+        """Run a stdlib-only module on the host with python3 and return its output.
+
+        The module's source is uploaded to <remote_dir>/.deploy-helpers once,
+        under a name holding its digest, so hosts need nothing installed but
+        python3 and an upgraded module is uploaded again.
+        """
+        name = os.path.splitext(os.path.basename(module.__file__))[0]
+        helper_dir = f"{remote_dir.rstrip('/')}/{HELPER_DIR_NAME}"
+        helper = f"{helper_dir}/{name}-{_source_digest(module.__file__)[:16]}.py"
+        if helper not in self._helpers:
+            if os.path.basename(helper) not in self.list_dir(helper_dir):
+                self.makedirs(helper_dir)
+                # Another session to the same host may be uploading it too
+                partial = f"{helper}.{os.getpid()}.{id(self)}.part"
+                self.put(module.__file__, partial)
+                self.rename(partial, helper)
+            self._helpers.add(helper)
+        return self.run(' '.join(shlex.quote(arg) for arg in ['python3', helper] + list(args)))
+
+    def close(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def _source_digest(path):
+    return file_digest(path)
+
+
+class Transport(ABC):
+    """Creates sessions to the hosts of an environment"""
+
+    def __init__(self, env_config):
+        self.env_config = env_config
+
+    @abstractmethod
+    def connect(self, host, user):
+        """Open and return a Session to host"""
+        pass
+
+
+class LocalDirectorySession(Session):
+    """A "host" that is a directory on the local machine; remote paths are relative to it"""
+
+    def __init__(self, host, user, root):
+        super().__init__(host, user)
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, remote_path):
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def host_path(self, remote_path):
+        # Commands run on this machine, so absolute remote paths must not escape the host root
+        return os.path.abspath(self.local_path(remote_path))
+
+    def put(self, local_path, remote_path):
+        target = self.local_path(remote_path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(local_path, target)
+
+    def run(self, command):
+        result = subprocess.run(command, shell=True, cwd=self.root, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            raise TransportError(f"{self.host}: '{command}' exited with {result.returncode}: {result.stdout.strip()}")
+        return result.stdout
+
+    def makedirs(self, remote_dir):
+        os.makedirs(self.local_path(remote_dir), exist_ok=True)
+
+    def checksum(self, remote_path):
+        return file_digest(self.local_path(remote_path))
+
+    def list_dir(self, remote_dir):
+        path = self.local_path(remote_dir)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def rename(self, remote_path, new_path):
+        os.replace(self.local_path(remote_path), self.local_path(new_path))
+
+    def remove(self, remote_path):
+        if os.path.exists(self.local_path(remote_path)):
+            os.remove(self.local_path(remote_path))
+
+    def remove_dir(self, remote_dir):
+        try:
+            os.rmdir(self.local_path(remote_dir))
+        except OSError:
+            pass
+
+    def concat(self, remote_parts, remote_path):
+        with open(self.local_path(remote_path), 'wb') as target:
+            for part in remote_parts:
+                with open(self.local_path(part), 'rb') as source:
+                    shutil.copyfileobj(source, target)
+
+    def tree_signatures(self, app_dir, block_size, paths=None):
+        return block_sync.tree_signatures(self.local_path(app_dir), block_size, paths)
+
+    def apply_tree_delta(self, app_dir, version, remote_delta):
+        block_sync.apply_delta(self.local_path(app_dir), version, self.local_path(remote_delta))
+
+    def apply_package_delta(self, app_dir, base_package, remote_delta, remote_package):
+        delta_apply.apply_delta(self.local_path(base_package), self.local_path(remote_delta),
+                                self.local_path(remote_package))
+        return delta_apply.content_digest(self.local_path(remote_package))
+
+    def relay(self, remote_path, target_session, target_path):
+        if not isinstance(target_session, LocalDirectorySession):
+            raise TransportError(f"Cannot relay from local host {self.host} to {target_session.host}")
+        target_session.put(self.local_path(remote_path), target_path)
+
+
+class LocalDirectoryTransport(Transport):
+    """Stand-in transport mapping each host to <transport_root>/<host>"""
+
+    def __init__(self, env_config):
+        super().__init__(env_config)
+        self.root = env_config.get('transport_root', os.path.join('build', 'hosts'))
+
+    def connect(self, host, user):
+        return LocalDirectorySession(host, user, os.path.join(self.root, host))
+
+
+class SubprocessSession(Session):
+    """Runs ssh/scp-like commands for every operation"""
+
+    def __init__(self, host, user, run_command, copy_command, close_command=None, relay_command=None):
+        super().__init__(host, user)
+        self.run_command = run_command
+        self.copy_command = copy_command
+        self.close_command = close_command
+        self.relay_command = relay_command
+        self.target = f"{user}@{host}" if user else host
+
+    def relay(self, remote_path, target_session, target_path):
+        # Runs on this host, so the hosts need ssh trust between each other
+        argv = [part.format(remote=remote_path, target=target_session.target, target_path=target_path)
+                for part in self.relay_command]
+        self.run(' '.join(shlex.quote(part) for part in argv))
+
+    def put(self, local_path, remote_path):
+        self._check(self._expand(self.copy_command, local=local_path, remote=remote_path))
+
+    def run(self, command):
+        return self._check(self._expand(self.run_command) + [command])
+
+    def close(self):
+        # Tear down the multiplexed master connection, if any
+        if self.close_command:
+            subprocess.run(self._expand(self.close_command), stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+
+    def _expand(self, template, **extra):
+        return [part.format(target=self.target, host=self.host, user=self.user or '', **extra)
+                for part in template]
+
+    def _check(self, argv):
+        result = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if result.returncode != 0:
+            raise TransportError(f"{self.host}: {' '.join(argv)} exited with {result.returncode}: "
+                                 f"{result.stdout.strip()}")
+        return result.stdout
+
+
+class SubprocessTransport(Transport):
+    """SSH transport; the commands can be overridden to use any ssh-like tool.
+
+    With the default commands, ssh connection multiplexing keeps one master
+    connection per session so that every later command and copy reuses it.
+    """
+
+    def __init__(self, env_config):
+        super().__init__(env_config)
+        control_path = os.path.join(tempfile.gettempdir(), 'deploy-ssh-%C')
+        multiplex = ['-o', 'ControlMaster=auto', '-o', f"ControlPath={control_path}", '-o', 'ControlPersist=yes']
+
+        self.run_command = _argv(env_config.get(
+            'ssh_command', ['ssh', '-o', 'BatchMode=yes'] + multiplex + ['{target}']))
+        self.copy_command = _argv(env_config.get(
+            'copy_command', ['scp', '-q', '-o', 'BatchMode=yes'] + multiplex + ['{local}', '{target}:{remote}']))
+        self.close_command = _argv(env_config.get(
+            'close_command', None if 'ssh_command' in env_config
+            else ['ssh', '-o', f"ControlPath={control_path}", '-O', 'exit', '{target}']))
+        self.relay_command = _argv(env_config.get(
+            'relay_command', 'scp -q -o BatchMode=yes {remote} {target}:{target_path}'))
+
+    def connect(self, host, user):
+        session = SubprocessSession(host, user, self.run_command, self.copy_command, self.close_command,
+                                    self.relay_command)
+        # Open the connection now so that connect time is paid once per pooled session
+        session.run('true')
+        return session
+
+
+def _argv(command):
+    """Commands may be configured as an argv list or as a shell-style string"""
+    if command is None:
+        return None
+    return shlex.split(command) if isinstance(command, str) else list(command)
+
+
+TRANSPORTS = {
+    'local': LocalDirectoryTransport,
+    'ssh': SubprocessTransport,
+}
+
+
+def create_transport(env_config):
+    """Create the transport named by the environment's 'transport' setting (default: local)"""
+    name = env_config.get('transport', 'local')
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unsupported transport: {name}")
+    return TRANSPORTS[name](env_config)
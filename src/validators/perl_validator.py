@@ -5,20 +5,34 @@ perl_validator.py - Basic Perl application validator
 import os
 import logging
 
+from source_scanner import scan_app
+from validators.source_checks import SourceChecker, report, validation_settings
+
 logger = logging.getLogger("perl_validator")
 
 class PerlValidator:
     def __init__(self, app_config):
         self.app_config = app_config
         self.source_dir = app_config['source_dir']
+        self.build_dir = os.path.join('build', app_config['name'])
     
-    def validate(self):
+    def validate(self, manifest=None):
+        """Check the sources; manifest is an optional scan of the tree shared with later stages"""
         logger.info(f"Validating Perl application: {self.app_config['name']}")
-        print(f"DEBUG: Checking for source directory at: {self.source_dir}")
-        print(f"DEBUG: Directory exists: {os.path.isdir(self.source_dir)}")
         
         if not os.path.isdir(self.source_dir):
             logger.error(f"Source directory not found: {self.source_dir}")
             return False
-        
-        return True
\ No newline at end of file
+
+        # `perl -c` every script and module, skipping unchanged files
+        include_dirs = [os.path.abspath(os.path.join(self.source_dir, path))
+                        for path in self.app_config.get('perl_include_dirs', ['lib'])]
+        if manifest is None:
+            manifest = scan_app(self.app_config)
+        cache_path, workers = validation_settings(self.app_config, self.build_dir)
+        checker = SourceChecker(self.source_dir, cache_path, workers)
+        tasks = checker.select({
+            '.pl': ('perl', (include_dirs,)),
+            '.pm': ('perl', (include_dirs,)),
+        }, manifest)
+        return report(self.app_config['name'], checker, checker.run(tasks))
@@ -5,20 +5,32 @@ python_validator.py - Basic Python application validator
 import os
 import logging
 
+from source_scanner import scan_app
+from validators.source_checks import SourceChecker, report, validation_settings
+
 logger = logging.getLogger("python_validator")
 
 class PythonValidator:
     def __init__(self, app_config):
         self.app_config = app_config
         self.source_dir = app_config['source_dir']
+        self.build_dir = os.path.join('build', app_config['name'])
     
-    def validate(self):
+    def validate(self, manifest=None):
+        """Check the sources; manifest is an optional scan of the tree shared with later stages"""
         logger.info(f"Validating Python application: {self.app_config['name']}")
         
-        print(f"DEBUG: Checking for source directory at: {self.source_dir}")
-        print(f"DEBUG: Directory exists: {os.path.isdir(self.source_dir)}")
         if not os.path.isdir(self.source_dir):
             logger.error(f"Source directory not found: {self.source_dir}")
             return False
-        
-        return True
\ No newline at end of file
+
+        # Syntax-check every module and parse requirements files, skipping unchanged files
+        if manifest is None:
+            manifest = scan_app(self.app_config)
+        cache_path, workers = validation_settings(self.app_config, self.build_dir)
+        checker = SourceChecker(self.source_dir, cache_path, workers)
+        tasks = checker.select({
+            '.py': ('python', ()),
+            'requirements.txt': ('requirements', ()),
+        }, manifest)
+        return report(self.app_config['name'], checker, checker.run(tasks))
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+source_checks.py - Parallel, content-cached syntax checks for application sources
+"""
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import threading
+import subprocess
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from source_scanner import scan_tree
+
+logger = logging.getLogger("source_checks")
+
+# Below this many files a thread pool costs more than it saves
+PARALLEL_THRESHOLD = 8
+# Spawned worker processes start slowly, so in-process checks need more files to pay for them
+PROCESS_THRESHOLD = 64
+
+REQUIREMENT_RE = re.compile(
+    r"^[A-Za-z0-9][A-Za-z0-9._-]*"                  # project name
+    r"(\[[A-Za-z0-9._,\s-]*\])?\s*"                 # extras
+    r"(\(?\s*(===|==|!=|~=|<=|>=|<|>)\s*[^,;\s)]+"  # first version clause
+    r"(\s*,\s*(===|==|!=|~=|<=|>=|<|>)\s*[^,;\s)]+)*\s*\)?)?"
+    r"\s*(;.*)?$"                                   # environment marker
+)
+
+
+def check_python_source(path):
+    """Return a syntax error message for a Python file, or None if it compiles"""
+    try:
+        with open(path, 'rb') as f:
+            compile(f.read(), path, 'exec', dont_inherit=True)
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def check_perl_source(path, include_dirs=()):
+    """Return the `perl -c` error output for a Perl file, or None if it compiles"""
+    command = ['perl', '-c']
+    for include_dir in include_dirs:
+        command.extend(['-I', include_dir])
+    command.append(path)
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        return result.stdout.strip()
+    return None
+
+
+def check_requirements(path):
+    """Return a message listing unparseable lines of a pip requirements file, or None"""
+    errors = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.split(' #', 1)[0].strip()
+            if not line or line.startswith('#') or line.startswith('-'):
+                # Blank, comment or pip option line (-r, -e, --index-url, ...)
+                continue
+            if '://' in line or line.startswith('.') or line.startswith('/'):
+                # URL or local path requirement
+                continue
+            if not _valid_requirement(line):
+                errors.append(f"line {number}: invalid requirement '{line}'")
+    return '; '.join(errors) or None
+
+
+def _valid_requirement(line):
+    try:
+        from packaging.requirements import InvalidRequirement, Requirement
+    except ImportError:
+        return REQUIREMENT_RE.match(line) is not None
+    try:
+        Requirement(line)
+    except InvalidRequirement:
+        return False
+    return True
+
+
+CHECKERS = {
+    'python': check_python_source,
+    'perl': check_perl_source,
+    'requirements': check_requirements,
+}
+# Checkers that wait on a subprocess and run on threads; the others are CPU-bound and use processes
+SUBPROCESS_CHECKERS = {'perl'}
+
+
+@lru_cache(maxsize=None)
+def checker_version(checker):
+    """Identify the tool behind a checker so a tool upgrade invalidates cached results"""
+    if checker == 'perl':
+        try:
+            result = subprocess.run(['perl', '-e', 'print $^V'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True)
+            return f"perl-{result.stdout.strip()}"
+        except OSError:
+            return 'perl-missing'
+    return f"python-{sys.version_info[0]}.{sys.version_info[1]}"
+
+
+def _run_check(checker, path, args):
+    """Process pool entry point"""
+    try:
+        return CHECKERS[checker](path, *args)
+    except OSError as e:
+        return str(e)
+
+
+class ValidationCache:
+    """Per-file check passes keyed by content digest, stored as JSON.
+
+    Failures are not cached: they may come from the environment (a missing
+    Perl module, say) rather than the file, and are re-checked every run.
+
+    A stat memo (path, size, mtime) maps each file to its digest so that an
+    untouched file is not even re-read. Only the entries used by the latest
+    run are saved, so the cache does not grow with deleted or old files.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        try:
+            with open(cache_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        self.digests = data.get('digests', {})
+        self.results = data.get('results', {})
+        self._used_digests = set()
+        self._used_results = set()
+
+    def digest(self, entry):
+        stat_key = f"{os.path.abspath(entry.path)}\0{entry.size}\0{entry.mtime_ns}"
+        digest = self.digests.get(stat_key)
+        if digest is None:
+            digest = entry.digest
+            self.digests[stat_key] = digest
+        self._used_digests.add(stat_key)
+        return digest
+
+    def passed(self, key):
+        """Return True if the check identified by key passed before"""
+        self._used_results.add(key)
+        return key in self.results
+
+    def record_pass(self, key):
+        self.results[key] = True
+
+    def save(self):
+        with self._lock:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            data = {
+                'digests': {key: value for key, value in self.digests.items() if key in self._used_digests},
+                'results': {key: value for key, value in self.results.items() if key in self._used_results},
+            }
+            with open(temp_path, 'w') as f:
+                json.dump(data, f, sort_keys=True)
+            os.replace(temp_path, self.cache_path)
+
+
+class SourceChecker:
+    """Runs per-file checks over a source tree in parallel, skipping cached results.
+
+    Subprocess-bound checks run on threads and CPU-bound ones on a pool of
+    spawned processes; forking is avoided because the daemon and the build
+    worker pool call this from multithreaded processes.
+    """
+
+    def __init__(self, source_dir, cache_path=None, workers=None):
+        self.source_dir = source_dir
+        self.cache = ValidationCache(cache_path) if cache_path else None
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = {'files': 0, 'checked': 0, 'cached': 0, 'failed': 0}
+
+    def select(self, checkers, manifest=None):
+        """Return (entry, checker, args) tasks for files matching {suffix_or_name: (checker, args)}.
+
+        args is a tuple of extra positional arguments for the checker function.
+        Files come from manifest, or from a fresh scan of the source tree.
+        """
+        if manifest is None:
+            manifest = scan_tree(self.source_dir)
+        tasks = []
+        for entry in manifest.files:
+            name = os.path.basename(entry.rel_path)
+            match = checkers.get(name) or checkers.get(os.path.splitext(name)[1])
+            if match:
+                checker, args = match
+                tasks.append((entry, checker, tuple(args)))
+        return tasks
+
+    def run(self, tasks):
+        """Run the tasks and return {rel_path: error} for every file that failed"""
+        self.stats = {'files': len(tasks), 'checked': 0, 'cached': 0, 'failed': 0}
+        errors = {}
+        pending = []
+        include_digests = {}
+        for entry, checker, args in tasks:
+            key = None
+            if self.cache is not None:
+                key = f"{checker}:{checker_version(checker)}:{json.dumps(args)}:{self.cache.digest(entry)}"
+                if checker == 'perl' and args:
+                    # `perl -c` also compiles the modules a file uses, so their contents are part of the key
+                    include_dirs = tuple(args[0])
+                    if include_dirs not in include_digests:
+                        include_digests[include_dirs] = self._include_digest(include_dirs)
+                    key = f"{key}:{include_digests[include_dirs]}"
+                if self.cache.passed(key):
+                    self.stats['cached'] += 1
+                    continue
+            pending.append((entry.rel_path, entry.path, checker, args, key))
+
+        outcomes = {}
+        for subprocess_bound, make_pool, threshold in ((True, ThreadPoolExecutor, PARALLEL_THRESHOLD),
+                                                        (False, _spawn_pool, PROCESS_THRESHOLD)):
+            group = [i for i, task in enumerate(pending) if (task[2] in SUBPROCESS_CHECKERS) == subprocess_bound]
+            outcomes.update(zip(group, self._check_all([pending[i][1:4] for i in group], make_pool, threshold)))
+
+        for i, (rel_path, _, _, _, key) in enumerate(pending):
+            error = outcomes[i]
+            self.stats['checked'] += 1
+            if error:
+                errors[rel_path] = error
+            elif key is not None:
+                self.cache.record_pass(key)
+
+        if self.cache is not None:
+            self.cache.save()
+        self.stats['failed'] = len(errors)
+        return errors
+
+    def _check_all(self, tasks, make_pool, threshold):
+        """Run (path, checker, args) tasks, on a make_pool(max_workers) pool when there are more than threshold"""
+        if len(tasks) <= threshold or self.workers <= 1:
+            return [_run_check(checker, path, args) for path, checker, args in tasks]
+        workers = min(self.workers, len(tasks))
+        with make_pool(max_workers=workers) as executor:
+            return list(executor.map(_run_check, *zip(*[(c, p, a) for p, c, a in tasks]),
+                                     chunksize=max(1, len(tasks) // (workers * 4))))
+
+    def _include_digest(self, include_dirs):
+        """Return a digest of every file under include_dirs"""
+        digest = hashlib.sha256()
+        for include_dir in include_dirs:
+            if not os.path.isdir(include_dir):
+                continue
+            for entry in scan_tree(include_dir).files:
+                digest.update(f"{include_dir}\0{entry.rel_path}\0{self.cache.digest(entry)}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+
+def _spawn_pool(max_workers):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def validation_settings(app_config, build_dir):
+    """Return (cache_path or None, workers) for an app from apps.yaml settings"""
+    workers = app_config.get('validation_workers', 'auto')
+    workers = (os.cpu_count() or 1) if workers in ('auto', 0) else max(1, int(workers))
+    cache_path = None
+    if app_config.get('validation_cache', True):
+        cache_path = os.path.join(build_dir, '.cache', 'validation.json')
+    return cache_path, workers
+
+
+def report(app_name, checker, errors):
+    """Log the outcome of a SourceChecker run and return True if nothing failed"""
+    for rel_path, error in sorted(errors.items()):
+        logger.error(f"{app_name}: {rel_path}: {error}")
+    stats = checker.stats
+    logger.info(f"{app_name}: validated {stats['files']} file(s): {stats['checked']} checked, "
+                f"{stats['cached']} cached, {stats['failed']} failed")
+    return not errors
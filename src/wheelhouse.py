@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+wheelhouse.py - Shared cache of built application and dependency wheels
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+from archive_builder import write_archive
+from command_runner import run_command
+from source_scanner import scan_tree
+from profiling import span
+
+logger = logging.getLogger("wheelhouse")
+
+DEFAULT_WHEELHOUSE = os.path.join('build', 'wheelhouse')
+INDEX_NAME = 'index.json'
+
+# Every app's packager has its own Wheelhouse, but they share the index file, so they share its lock
+_index_locks = {}
+_index_locks_guard = threading.Lock()
+
+
+def interpreter_tag():
+    """Identify the interpreter and platform that built wheels are valid for"""
+    return f"cp{sys.version_info[0]}{sys.version_info[1]}-{sys.platform}"
+
+
+class Wheelhouse:
+    """Persistent wheel store shared by all apps.
+
+    App wheels live under apps/<app>/<key>/ where key is the content hash of
+    the source tree, so an unchanged tree is never rebuilt. Dependency wheels
+    live together under deps/ and each requirements file is indexed by the
+    hash of its contents and the interpreter, so a known requirements file
+    resolves to its wheels without running pip at all.
+    """
+
+    def __init__(self, root=DEFAULT_WHEELHOUSE, pip_command=None, timeout=None):
+        self.root = root
+        self.apps_dir = os.path.join(root, 'apps')
+        self.deps_dir = os.path.join(root, 'deps')
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.pip_command = pip_command or [sys.executable, '-m', 'pip']
+        # Seconds a pip run may take before it is stopped; None waits forever
+        self.timeout = timeout
+        self._lock = _index_lock(self.index_path)
+
+        os.makedirs(self.apps_dir, exist_ok=True)
+        os.makedirs(self.deps_dir, exist_ok=True)
+
+    def app_wheel(self, app_name, source_dir, build, manifest=None):
+        """Return the cached wheel of source_dir, calling build(dist_dir) to produce it on a miss"""
+        key = self._source_key(manifest if manifest is not None else scan_tree(source_dir))
+        wheel_dir = os.path.join(self.apps_dir, app_name, key[:32])
+        wheel = _find_wheel(wheel_dir)
+        if wheel:
+            logger.info(f"Wheelhouse hit for {app_name} ({key[:12]})")
+            return wheel
+
+        logger.info(f"Wheelhouse miss for {app_name} ({key[:12]}), building wheel")
+        with tempfile.TemporaryDirectory(dir=self.root) as dist_dir:
+            build(dist_dir)
+            built = _find_wheel(dist_dir)
+            if not built:
+                raise RuntimeError(f"Failed to build wheel package for {app_name}")
+            os.makedirs(wheel_dir, exist_ok=True)
+            target = os.path.join(wheel_dir, os.path.basename(built))
+            os.replace(built, target)
+        return target
+
+    def dependency_wheels(self, requirements_path):
+        """Return the wheel paths satisfying requirements_path, building only wheels not yet present"""
+        with open(requirements_path, 'rb') as f:
+            req_hash = hashlib.sha256(f.read() + interpreter_tag().encode('utf-8')).hexdigest()
+
+        names = self._load_index()['requirements'].get(req_hash)
+        if names is not None and all(os.path.exists(os.path.join(self.deps_dir, name)) for name in names):
+            logger.info(f"Wheelhouse has all {len(names)} dependency wheel(s) for {requirements_path}")
+            return [os.path.join(self.deps_dir, name) for name in names]
+
+        with tempfile.TemporaryDirectory(dir=self.root) as wheel_dir, span('dependency_wheels'):
+            # Wheels already in deps/ are copied instead of rebuilt via --find-links
+            run_command(
+                self.pip_command + ['wheel', '-r', requirements_path, '--wheel-dir', wheel_dir,
+                                    '--find-links', self.deps_dir],
+                timeout=self.timeout,
+                label='pip wheel',
+                log=logger,
+                check=True,
+                message="Building dependency wheels"
+            )
+
+            names = sorted(name for name in os.listdir(wheel_dir) if name.endswith('.whl'))
+            for name in names:
+                target = os.path.join(self.deps_dir, name)
+                if not os.path.exists(target):
+                    os.replace(os.path.join(wheel_dir, name), target)
+
+        with self._lock:
+            index = self._load_index()
+            index['requirements'][req_hash] = names
+            self._save_index(index)
+        logger.info(f"Cached {len(names)} dependency wheel(s) for {requirements_path}")
+        return [os.path.join(self.deps_dir, name) for name in names]
+
+    def bundle(self, output_path, wheels, requirements_path=None, compression='gzip', level=None, threads=1,
+               mtime=None):
+        """Write an archive of wheels installable with `pip install --no-index --find-links wheels/`"""
+        with write_archive(output_path, compression, level, threads, mtime=mtime) as tar:
+            for wheel in wheels:
+                tar.add(wheel, arcname=f"wheels/{os.path.basename(wheel)}")
+            if requirements_path:
+                tar.add(requirements_path, arcname='requirements.txt')
+        logger.info(f"Wrote offline bundle of {len(wheels)} wheel(s) to {output_path}")
+        return output_path
+
+    def _source_key(self, manifest):
+        # Cheap stat-based fingerprint first, content digests only when it is unknown
+        stat_key = manifest.fingerprint()
+        key = self._load_index()['stat'].get(stat_key)
+        if key is None:
+            key = manifest.fingerprint(use_digests=True)
+            with self._lock:
+                index = self._load_index()
+                index['stat'][stat_key] = key
+                self._save_index(index)
+        return key
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault('stat', {})
+        index.setdefault('requirements', {})
+        return index
+
+    def _save_index(self, index):
+        temp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(temp_path, self.index_path)
+
+
+def _index_lock(index_path):
+    with _index_locks_guard:
+        return _index_locks.setdefault(os.path.abspath(index_path), threading.Lock())
+
+
+def _find_wheel(directory):
+    if not os.path.isdir(directory):
+        return None
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.whl'):
+            return os.path.join(directory, name)
+    return None
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+test_archive_builder.py - Test in-process tarball building and compression
+"""
+import os
+import sys
+import gzip
+import hashlib
+import shutil
+import logging
+import tarfile
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.app_packager import PythonPackager
+from src.archive_builder import ParallelGzipWriter, build_tarball, compression_settings, deterministic_mtime
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_archive")
+
+def _make_source(root):
+    source_dir = os.path.join(root, 'archive-app')
+    os.makedirs(os.path.join(source_dir, 'data'))
+    with open(os.path.join(source_dir, 'app.py'), 'w') as f:
+        f.write("print('hello')\n")
+    with open(os.path.join(source_dir, 'data', 'blob.bin'), 'wb') as f:
+        f.write(os.urandom(300 * 1024) * 8)
+    return source_dir
+
+def _archive_names(path):
+    with tarfile.open(path, 'r:*') as tar:
+        return sorted(tar.getnames())
+
+def test_compressions_round_trip():
+    """Every built-in compression produces a readable archive with the same entries"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir)
+        expected = ['archive-app', 'archive-app/app.py', 'archive-app/data', 'archive-app/data/blob.bin']
+
+        for compression in ('gzip', 'xz', 'none'):
+            output = os.path.join(temp_dir, f"out-{compression}")
+            build_tarball(source_dir, output, compression=compression)
+            assert _archive_names(output) == expected, compression
+
+def test_parallel_gzip_is_valid_gzip():
+    """Blocks compressed on several threads decompress to the original stream"""
+    payload = os.urandom(64 * 1024) * 50
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, 'parallel.gz')
+        with open(output, 'wb') as raw:
+            writer = ParallelGzipWriter(raw, level=1, threads=4, block_size=256 * 1024)
+            writer.write(payload)
+            writer.close()
+        with gzip.open(output, 'rb') as f:
+            assert f.read() == payload
+
+def test_parallel_tarball_matches_entries():
+    """A multi-threaded tarball contains the same files as a single-threaded one"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir)
+        single = build_tarball(source_dir, os.path.join(temp_dir, 'single.tar.gz'))
+        parallel = build_tarball(source_dir, os.path.join(temp_dir, 'parallel.tar.gz'), threads=4)
+        assert _archive_names(single) == _archive_names(parallel)
+
+def test_compression_settings_from_config():
+    """apps.yaml settings select compression, level and thread count"""
+    assert compression_settings({}) == ('gzip', 6, 1)
+    compression, level, threads = compression_settings({'compression': 'xz', 'compression_level': 9,
+                                                        'compression_threads': 'auto'})
+    assert (compression, level) == ('xz', 9)
+    assert threads >= 1
+
+def test_packager_uses_configured_compression():
+    """The packager names the artifact after the configured compression"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir)
+        shutil.rmtree('build/python-xz-test', ignore_errors=True)
+        packager = PythonPackager({'name': 'python-xz-test', 'type': 'python',
+                                   'source_dir': source_dir, 'compression': 'xz'})
+        package_path = packager.package('1')
+        assert package_path.endswith('.tar.xz')
+        assert 'archive-app/app.py' in _archive_names(package_path)
+
+def _sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def test_deterministic_tarball_depends_only_on_content():
+    """Copies of a tree with other mtimes and modes produce byte-identical archives"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir)
+        copy_dir = os.path.join(temp_dir, 'copy', 'archive-app')
+        shutil.copytree(source_dir, copy_dir)
+        os.utime(os.path.join(copy_dir, 'app.py'), (1000000000, 1000000000))
+        os.chmod(os.path.join(copy_dir, 'data', 'blob.bin'), 0o600)
+
+        for compression, threads in (('gzip', 1), ('gzip', 4), ('xz', 1), ('none', 1)):
+            first = build_tarball(source_dir, os.path.join(temp_dir, 'first'), compression=compression,
+                                  threads=threads, mtime=deterministic_mtime())
+            second = build_tarball(copy_dir, os.path.join(temp_dir, 'second'), compression=compression,
+                                   threads=threads, mtime=deterministic_mtime())
+            assert _sha256(first) == _sha256(second), compression
+
+        with tarfile.open(first) as tar:
+            member = tar.getmember('archive-app/data/blob.bin')
+        assert (member.mtime, member.mode, member.uid, member.uname) == (315532800, 0o644, 0, '')
+
+        plain = build_tarball(copy_dir, os.path.join(temp_dir, 'plain'), compression='none')
+        with tarfile.open(plain) as tar:
+            assert tar.getmember('archive-app/app.py').mtime == 1000000000
+
+def test_deterministic_archives_setting():
+    """deterministic_archives enables the mode; SOURCE_DATE_EPOCH picks the mtime"""
+    assert deterministic_mtime({}) is None
+    assert deterministic_mtime({'deterministic_archives': True}) == 315532800
+    os.environ['SOURCE_DATE_EPOCH'] = '1700000000'
+    try:
+        assert deterministic_mtime({'deterministic_archives': True}) == 1700000000
+    finally:
+        del os.environ['SOURCE_DATE_EPOCH']
+
+def main():
+    tests = [
+        test_compressions_round_trip,
+        test_parallel_gzip_is_valid_gzip,
+        test_parallel_tarball_matches_entries,
+        test_compression_settings_from_config,
+        test_packager_uses_configured_compression,
+        test_deterministic_tarball_depends_only_on_content,
+        test_deterministic_archives_setting,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Archive Builder Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+test_artifact_store.py - Test artifact retention, eviction, pinning and storage backends
+"""
+import os
+import sys
+import shutil
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.app_packager import PythonPackager
+from src.artifact_store import ArtifactStore, LocalS3Client, S3Backend
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_artifact_store")
+
+def _artifact(build_dir, version, size=100):
+    path = os.path.join(build_dir, f"app-{version}.tar.gz")
+    with open(path, 'wb') as f:
+        f.write(version.encode('utf-8') * size)
+    return path
+
+def test_count_limit_evicts_least_recently_used():
+    """Beyond max_versions the oldest unused versions and their files are removed"""
+    with tempfile.TemporaryDirectory() as build_dir:
+        store = ArtifactStore(build_dir, max_versions=3)
+        for version in ('1', '2', '3'):
+            store.add(version, _artifact(build_dir, version))
+        store.mark_deployed('1', 'production')
+        store.add('4', _artifact(build_dir, '4'))
+        store.add('5', _artifact(build_dir, '5'))
+
+        assert [record['version'] for record in store.versions()] == ['1', '4', '5']
+        assert not os.path.exists(os.path.join(build_dir, 'app-2.tar.gz'))
+        assert os.path.exists(os.path.join(build_dir, 'app-1.tar.gz'))
+        assert store.pinned() == {'env:production': '1'}
+        assert store.get('5')['size'] == 100 and len(store.get('5')['digest']) == 64
+
+def test_size_limit_pins_and_delta_bases():
+    """max_bytes evicts until the store fits; pinned versions and delta bases stay"""
+    with tempfile.TemporaryDirectory() as build_dir:
+        store = ArtifactStore(build_dir, max_versions=None, max_bytes=250)
+        store.add('1', _artifact(build_dir, '1'))
+        store.add('2', _artifact(build_dir, '2'), depends_on='1')
+        store.pin('2')
+        store.add('3', _artifact(build_dir, '3'))
+        assert sorted(record['version'] for record in store.versions()) == ['1', '2', '3']
+
+        store.unpin()
+        store.add('4', _artifact(build_dir, '4'))
+        assert sorted(record['version'] for record in store.versions()) == ['3', '4']
+
+def test_retained_deltas_keep_their_bases():
+    """No retained delta loses its base, so a chain is evicted from its newest delta down"""
+    with tempfile.TemporaryDirectory() as build_dir:
+        store = ArtifactStore(build_dir, max_versions=2)
+        store.add('1', _artifact(build_dir, '1'))
+        store.add('2', _artifact(build_dir, '2'), depends_on='1')
+        store.add('3', _artifact(build_dir, '3'))
+        assert sorted(record['version'] for record in store.versions()) == ['1', '3']
+
+def test_s3_backend_round_trip():
+    """The S3 backend stores, fetches and deletes objects through an S3-compatible client"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        build_dir = os.path.join(temp_dir, 'build')
+        os.makedirs(build_dir)
+        backend = S3Backend(LocalS3Client(os.path.join(temp_dir, 's3')), 'artifacts', prefix='app/')
+        store = ArtifactStore(build_dir, backend=backend, max_versions=1)
+
+        store.add('1', _artifact(build_dir, '1'))
+        assert backend.exists('app-1.tar.gz')
+        os.remove(os.path.join(build_dir, 'app-1.tar.gz'))
+        assert open(store.fetch('1'), 'rb').read() == b'1' * 100
+
+        store.add('2', _artifact(build_dir, '2'))
+        assert not backend.exists('app-1.tar.gz') and backend.exists('app-2.tar.gz')
+        assert not os.path.exists(os.path.join(build_dir, 'app-1.tar.gz'))
+        assert os.path.exists(os.path.join(temp_dir, 's3', 'artifacts', 'app', 'app-2.tar.gz'))
+
+def test_packager_records_and_evicts_versions():
+    """Packaging goes through the store; evicted versions leave no files or cache entries"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'store-app')
+        os.makedirs(source_dir)
+        shutil.rmtree('build/python-store-test', ignore_errors=True)
+        packager = PythonPackager({'name': 'python-store-test', 'type': 'python', 'source_dir': source_dir,
+                                   'artifact_store': {'max_versions': 2}})
+        for version in ('1', '2', '3'):
+            with open(os.path.join(source_dir, 'app.py'), 'w') as f:
+                f.write(f"VERSION = {version}\n")
+            packager.package(version)
+
+        assert [record['version'] for record in packager.artifacts.versions()] == ['2', '3']
+        packages = sorted(name for name in os.listdir('build/python-store-test') if name.endswith('.tar.gz'))
+        assert packages == ['python-store-test-2.tar.gz', 'python-store-test-3.tar.gz']
+        cached = [name for name in os.listdir('build/python-store-test/.cache') if name.endswith('.tar.gz')]
+        assert len(cached) == 2
+
+def test_delta_packages_respect_max_versions():
+    """With periodic full packages, old delta chains are evicted down to max_versions"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'chain-app')
+        os.makedirs(source_dir)
+        shutil.rmtree('build/python-store-chain-test', ignore_errors=True)
+        packager = PythonPackager({'name': 'python-store-chain-test', 'type': 'python', 'source_dir': source_dir,
+                                   'package_mode': 'delta', 'full_package_every': 3,
+                                   'artifact_store': {'max_versions': 3}})
+        for version in range(1, 9):
+            with open(os.path.join(source_dir, 'app.py'), 'w') as f:
+                f.write(f"VERSION = {version}\n")
+            packager.package(str(version))
+
+        records = packager.artifacts.versions()
+        retained = {record['version'] for record in records}
+        assert retained == {'4', '7', '8'}
+        assert all(record['depends_on'] in retained for record in records if record['depends_on'])
+        assert sorted(os.listdir('build/python-store-chain-test/manifests')) == ['4.json', '7.json', '8.json', 'latest']
+
+def main():
+    tests = [
+        test_count_limit_evicts_least_recently_used,
+        test_size_limit_pins_and_delta_bases,
+        test_retained_deltas_keep_their_bases,
+        test_s3_backend_round_trip,
+        test_packager_records_and_evicts_versions,
+        test_delta_packages_respect_max_versions,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Artifact Store Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,8 @@ import yaml
 
 # Add the source directory to the path
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+# Packager modules import their siblings by name, as deployer.py does
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
 from src.app_packager import PythonPackager, PerlPackager
 
 logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+test_benchmarks.py - Test the benchmark harness on tiny synthetic trees
+"""
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+sys.path.insert(2, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'benchmarks'))
+from run_benchmarks import bench_packaging, compare_results
+from synthetic import generate_tree
+from src.package_cache import fingerprint_tree
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_benchmarks")
+
+def test_synthetic_trees_are_deterministic():
+    """The same profile, scale and seed always produce the same tree"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        first = os.path.join(temp_dir, 'first')
+        second = os.path.join(temp_dir, 'second')
+        assert generate_tree(first, 'deep_nesting', scale=0.05) == generate_tree(second, 'deep_nesting', scale=0.05)
+        assert fingerprint_tree(first, use_digests=True) == fingerprint_tree(second, use_digests=True)
+
+        other = os.path.join(temp_dir, 'other')
+        generate_tree(other, 'deep_nesting', scale=0.05, seed=1)
+        assert fingerprint_tree(other, use_digests=True) != fingerprint_tree(first, use_digests=True)
+
+def test_packaging_benchmark_records():
+    """A packaging benchmark reports time, throughput, memory and artifact size"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cwd = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            results = bench_packaging(temp_dir, 0.01, 1, profiles=['many_small'],
+                                      modes=['python-gzip', 'python-delta'])
+        finally:
+            os.chdir(cwd)
+
+        assert [r['name'] for r in results] == ['many_small/python-gzip', 'many_small/python-delta']
+        for record in results:
+            assert record['seconds'] > 0
+            assert record['peak_memory_bytes'] > 0
+            assert record['artifact_bytes'] > 0
+        # A delta of a few changed files is smaller than the full tarball
+        assert results[1]['artifact_bytes'] < results[0]['artifact_bytes']
+
+def test_compare_flags_regressions():
+    """Only slowdowns above the threshold count as regressions"""
+    baseline = {'results': [
+        {'suite': 'packaging', 'name': 'a', 'seconds': 1.0},
+        {'suite': 'packaging', 'name': 'b', 'seconds': 1.0},
+        {'suite': 'packaging', 'name': 'gone', 'seconds': 1.0},
+    ]}
+    current = {'results': [
+        {'suite': 'packaging', 'name': 'a', 'seconds': 1.5},
+        {'suite': 'packaging', 'name': 'b', 'seconds': 1.05},
+        {'suite': 'packaging', 'name': 'new', 'seconds': 1.0},
+    ]}
+    lines, regressions = compare_results(baseline, current, threshold=0.10)
+    assert regressions == [('packaging', 'a')]
+    assert len(lines) == 2
+
+def main():
+    tests = [
+        test_synthetic_trees_are_deterministic,
+        test_packaging_benchmark_records,
+        test_compare_flags_regressions,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Benchmark Harness Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+test_block_sync.py - Test rolling-checksum deltas and block sync of releases to hosts
+"""
+import os
+import sys
+import random
+import logging
+import tempfile
+import threading
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+import transports
+from archive_builder import build_tarball
+from block_sync import DEFAULT_BLOCK_SIZE, block_signatures, match_aligned_blocks, match_blocks
+from env_manager import EnvironmentManager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_block_sync")
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _rebuild(ops, base):
+    out = b''
+    for op in ops:
+        out += base[op[1]:op[1] + op[2]] if op[0] == 'copy' else op[1]
+    return out
+
+def test_shifted_blocks_are_found():
+    """Blocks are matched after an insertion shifts them; only new bytes become literals"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base = random.Random(1).randbytes(100000)
+        base_path = os.path.join(temp_dir, 'base')
+        _write(base_path, base)
+        new = base[:30000] + b'inserted bytes' + base[30000:70000] + base[70100:]
+
+        ops = match_blocks(new, block_signatures(base_path, 4096), 4096, len(base))
+        assert _rebuild(ops, base) == new
+        literal = sum(len(op[1]) for op in ops if op[0] == 'data')
+        assert literal < 3 * 4096, f"{literal} literal bytes for a 14-byte insert and 100-byte delete"
+
+def test_aligned_match_streams_large_files():
+    """The aligned matcher finds in-place changes block by block and rebuilds the file exactly"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base = random.Random(3).randbytes(50000)
+        base_path = os.path.join(temp_dir, 'base')
+        _write(base_path, base)
+        new = base[:20000] + b'X' * 100 + base[20100:] + b'appended'
+        new_path = os.path.join(temp_dir, 'new')
+        _write(new_path, new)
+
+        with open(new_path, 'rb') as f:
+            ops = list(match_aligned_blocks(f, block_signatures(base_path, 4096), 4096, len(base)))
+        assert _rebuild(ops, base) == new
+        literal = sum(len(op[1]) for op in ops if op[0] == 'data')
+        assert literal <= 2 * 4096, f"{literal} literal bytes for a 100-byte edit and an append"
+
+def _env(temp_dir, hosts):
+    return {
+        'type': 'vm', 'hosts': hosts, 'transport': 'local',
+        'transport_root': os.path.join(temp_dir, 'hosts'), 'deploy_dir': '/srv/apps',
+        'upload_mode': 'sync', 'activate_commands': ['ln -sfn {version} srv/apps/{app}/current'],
+    }
+
+def _record_puts(sent):
+    original = transports.LocalDirectorySession.put
+
+    def put(session, local_path, remote_path):
+        sent.append((session.host, os.path.getsize(local_path)))
+        return original(session, local_path, remote_path)
+
+    transports.LocalDirectorySession.put = put
+    return original
+
+def test_sync_sends_only_changed_blocks():
+    """The second release is rebuilt on each host from the first plus a small delta"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        data = bytearray(random.Random(2).randbytes(300000))
+        _write(os.path.join(source_dir, 'data.bin'), bytes(data))
+        _write(os.path.join(source_dir, 'app.py'), b"print('v1')\n")
+        _write(os.path.join(source_dir, 'old.py'), b"removed in v2\n")
+        _write(os.path.join(source_dir, 'static', 'index.html'), b"<html></html>\n")
+        # Symlinks to directories are archived as links
+        os.symlink('static', os.path.join(source_dir, 'assets'))
+        build_tarball(source_dir, os.path.join(temp_dir, 'app-1.tar.gz'))
+
+        data[150000] ^= 0xff
+        _write(os.path.join(source_dir, 'data.bin'), bytes(data))
+        os.remove(os.path.join(source_dir, 'old.py'))
+        _write(os.path.join(source_dir, 'lib', 'new.py'), b"added in v2\n")
+        build_tarball(source_dir, os.path.join(temp_dir, 'app-2.tar.gz'))
+
+        env_config = _env(temp_dir, ['web1', 'web2'])
+        # {package} names the synced release directory in this mode
+        env_config['activate_commands'].append('test -f {package}/app/app.py')
+        manager = EnvironmentManager(env_config)
+        sent = []
+        original = _record_puts(sent)
+        try:
+            assert all(result.success for result in manager.deploy(os.path.join(temp_dir, 'app-1.tar.gz'),
+                                                                     'app', '1'))
+            first = [size for _, size in sent]
+            sent.clear()
+            assert all(result.success for result in manager.deploy(os.path.join(temp_dir, 'app-2.tar.gz'),
+                                                                     'app', '2'))
+            second = [size for _, size in sent]
+        finally:
+            transports.LocalDirectorySession.put = original
+
+        assert all(size > 300000 for size in first)
+        assert all(size < 2 * DEFAULT_BLOCK_SIZE for size in second), f"deltas of {second} bytes"
+        for host in ('web1', 'web2'):
+            app_dir = os.path.join(temp_dir, 'hosts', host, 'srv', 'apps', 'app')
+            release = os.path.join(app_dir, 'releases', '2', 'app')
+            assert _read(os.path.join(release, 'data.bin')) == bytes(data)
+            assert _read(os.path.join(release, 'lib', 'new.py')) == b"added in v2\n"
+            assert not os.path.exists(os.path.join(release, 'old.py'))
+            assert os.readlink(os.path.join(release, 'assets')) == 'static'
+            # Unchanged files are shared with the previous release
+            assert os.path.samefile(os.path.join(release, 'app.py'),
+                                    os.path.join(app_dir, 'releases', '1', 'app', 'app.py'))
+            assert os.readlink(os.path.join(app_dir, 'current')) == '2'
+            assert not any(name.startswith('.sync-delta-') for name in os.listdir(app_dir))
+
+def test_hosts_build_deltas_in_parallel():
+    """Hosts with different previous releases fetch signatures at the same time"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        for version in ('0', '1', '2'):
+            _write(os.path.join(source_dir, 'app.py'), f"print('v{version}')\n".encode() * 1000)
+            build_tarball(source_dir, os.path.join(temp_dir, f"app-{version}.tar.gz"))
+        for host, version in (('web1', '0'), ('web2', '1')):
+            manager = EnvironmentManager(_env(temp_dir, [host]))
+            assert all(result.success for result in manager.deploy(os.path.join(temp_dir, f"app-{version}.tar.gz"),
+                                                                     'app', version))
+
+        barrier = threading.Barrier(2, timeout=10)
+        original = transports.LocalDirectorySession.tree_signatures
+
+        def tree_signatures(session, app_dir, block_size, paths=None):
+            if paths:
+                # Fails with BrokenBarrierError if the other host cannot get here meanwhile
+                barrier.wait()
+            return original(session, app_dir, block_size, paths)
+
+        transports.LocalDirectorySession.tree_signatures = tree_signatures
+        try:
+            manager = EnvironmentManager(_env(temp_dir, ['web1', 'web2']))
+            results = manager.deploy(os.path.join(temp_dir, 'app-2.tar.gz'), 'app', '2')
+        finally:
+            transports.LocalDirectorySession.tree_signatures = original
+        assert all(result.success for result in results), [result.error for result in results]
+
+def test_remote_helper_uploaded_once():
+    """Sessions without direct file access upload block_sync to the host once and run it with python3"""
+    puts = []
+
+    class ShellSession(transports.Session):
+        def put(self, local_path, remote_path):
+            puts.append(remote_path)
+            os.makedirs(os.path.dirname(remote_path), exist_ok=True)
+            with open(local_path, 'rb') as source, open(remote_path, 'wb') as target:
+                target.write(source.read())
+
+        def run(self, command):
+            result = subprocess.run(command.replace('python3 ', f"{sys.executable} ", 1), shell=True,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                raise transports.TransportError(result.stderr)
+            return result.stdout
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        _write(os.path.join(source_dir, 'app.py'), b"print('v1')\n" * 5000)
+        build_tarball(source_dir, os.path.join(temp_dir, 'app-1.tar.gz'))
+
+        env_config = _env(temp_dir, ['remote'])
+        env_config['deploy_dir'] = os.path.join(temp_dir, 'remote')
+        env_config['activate_commands'] = []
+        manager = EnvironmentManager(env_config)
+        syncer = manager._tree_syncer(os.path.join(temp_dir, 'app-1.tar.gz'))
+        try:
+            manager._deploy_host(ShellSession('remote', None), os.path.join(temp_dir, 'app-1.tar.gz'), '', 'app',
+                                 '1', f"{env_config['deploy_dir']}/app/releases/1", syncer=syncer)
+        finally:
+            syncer.close()
+
+        release = os.path.join(temp_dir, 'remote', 'app', 'releases', '1', 'app', 'app.py')
+        assert _read(release) == b"print('v1')\n" * 5000
+        signatures = ShellSession('remote', None).tree_signatures(os.path.join(temp_dir, 'remote', 'app'),
+                                                                  DEFAULT_BLOCK_SIZE, ['app/app.py'])
+        assert signatures['base'] == '1' and len(signatures['files']['app/app.py']['blocks']) == 8
+        # One helper upload, one delta and one path list; the second session found the helper already there
+        helpers = [path for path in puts if transports.HELPER_DIR_NAME in path]
+        path_lists = [path for path in puts if os.path.basename(path).startswith('.sync-paths-')]
+        assert len(helpers) == 1 and len(path_lists) == 1 and len(puts) == 3, puts
+        assert not os.path.exists(path_lists[0])
+
+def test_non_tar_packages_upload_whole():
+    """Packages that are not tar archives fall back to a full upload"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = os.path.join(temp_dir, 'app-1.whl')
+        _write(package_path, b'not a tar archive')
+        manager = EnvironmentManager(_env(temp_dir, ['web1']))
+        assert all(result.success for result in manager.deploy(package_path, 'app', '1'))
+        assert os.path.exists(os.path.join(temp_dir, 'hosts', 'web1', 'srv/apps/app/releases/1/app-1.whl'))
+
+def main():
+    tests = [
+        test_shifted_blocks_are_found,
+        test_sync_sends_only_changed_blocks,
+        test_aligned_match_streams_large_files,
+        test_hosts_build_deltas_in_parallel,
+        test_remote_helper_uploaded_once,
+        test_non_tar_packages_upload_whole,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Block Sync Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
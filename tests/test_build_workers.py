@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+test_build_workers.py - Test packaging on build worker processes with locality-aware scheduling
+"""
+import os
+import sys
+import logging
+import tarfile
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from build_workers import OUTBOX_DIR, BuildPool, RemotePackager
+from source_scanner import file_digest, scan_app
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_build_workers")
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def _app(root, name):
+    source_dir = os.path.join(root, name)
+    _write(os.path.join(source_dir, 'app.py'), f"print('{name}')\n")
+    _write(os.path.join(source_dir, 'lib', 'util.py'), "VALUE = 1\n" * 1000)
+    return {'name': name, 'type': 'python', 'source_dir': source_dir}
+
+def test_builds_stay_on_warm_workers():
+    """Each app's rebuild goes back to the worker holding its sources and only syncs the change"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        alpha = _app(temp_dir, 'bw-alpha')
+        beta = _app(temp_dir, 'bw-beta')
+        with BuildPool(workers=2, root=os.path.join(temp_dir, 'workers')) as pool:
+            first = [pool.submit(alpha, '1.0'), pool.submit(beta, '1.0')]
+            first = [future.result(timeout=120) for future in first]
+            assert first[0].worker != first[1].worker
+
+            _write(os.path.join(alpha['source_dir'], 'app.py'), "print('alpha v2')\n")
+            second = [pool.submit(alpha, '2.0'), pool.submit(beta, '2.0')]
+            second = [future.result(timeout=120) for future in second]
+            assert [result.worker for result in second] == [result.worker for result in first]
+            # Only the edited file is copied to the warm worker's source mirror
+            assert first[0].synced_bytes > 10000
+            assert 0 < second[0].synced_bytes < 100 and second[1].synced_bytes == 0
+
+            target_dir = os.path.join(temp_dir, 'fetched')
+            package_path = pool.fetch(second[0], target_dir)
+            assert file_digest(package_path) == second[0].digest
+            assert os.path.basename(package_path) == 'bw-alpha-2.0.tar.gz'
+            with tarfile.open(package_path) as tar:
+                app_py = tar.extractfile('bw-alpha/app.py').read()
+            assert app_py == b"print('alpha v2')\n"
+
+def test_fetch_rejects_corrupt_artifacts():
+    """An outbox file that no longer matches its digest is not handed out"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = _app(temp_dir, 'bw-corrupt')
+        with BuildPool(workers=1, root=os.path.join(temp_dir, 'workers')) as pool:
+            result = pool.submit(app, '1.0').result(timeout=120)
+            outbox_path = os.path.join(temp_dir, 'workers', str(result.worker), OUTBOX_DIR, result.digest)
+            # Break the hardlink to the worker's build output before corrupting the file
+            with open(outbox_path, 'rb') as f:
+                data = f.read()
+            os.remove(outbox_path)
+            with open(outbox_path, 'wb') as f:
+                f.write(data[:-1] + bytes([data[-1] ^ 1]))
+
+            try:
+                pool.fetch(result, os.path.join(temp_dir, 'fetched'))
+            except RuntimeError as e:
+                assert 'does not match digest' in str(e)
+            else:
+                raise AssertionError("Expected RuntimeError for a corrupt artifact")
+            assert not os.path.exists(os.path.join(temp_dir, 'fetched', result.name))
+
+def test_failures_and_remote_packager():
+    """A failing build raises from its future, and the pool keeps serving RemotePackager builds"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = _app(temp_dir, 'bw-remote')
+        with BuildPool(workers=1, root=os.path.join(temp_dir, 'workers')) as pool:
+            missing = dict(app, name='bw-missing', source_dir=os.path.join(temp_dir, 'missing'))
+            try:
+                pool.submit(missing, '1.0').result(timeout=120)
+            except RuntimeError as e:
+                assert 'Build worker 0' in str(e)
+            else:
+                raise AssertionError("Expected RuntimeError for a missing source directory")
+
+            packager = RemotePackager(app, pool)
+            package_path = packager.package('1.0')
+            assert package_path == os.path.join('build', 'bw-remote', 'bw-remote-1.0.tar.gz')
+            assert packager.artifacts.get('1.0')['digest'] == file_digest(package_path)
+
+def test_pool_builds_full_packages():
+    """Delta mode is turned off on the pool, so every version is a full package built from the job's manifest"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app = dict(_app(temp_dir, 'bw-delta'), package_mode='delta')
+        with BuildPool(workers=2, root=os.path.join(temp_dir, 'workers')) as pool:
+            packager = RemotePackager(app, pool)
+            first = packager.package('1.0', manifest=scan_app(app))
+            _write(os.path.join(app['source_dir'], 'app.py'), "print('changed')\n")
+            second = packager.package('1.1', manifest=scan_app(app))
+
+        assert packager.artifact_base is None
+        assert second == os.path.join('build', 'bw-delta', 'bw-delta-1.1.tar.gz')
+        for package_path in (first, second):
+            with tarfile.open(package_path) as tar:
+                assert 'bw-delta/lib/util.py' in tar.getnames()
+
+def main():
+    tests = [
+        test_builds_stay_on_warm_workers,
+        test_fetch_rejects_corrupt_artifacts,
+        test_failures_and_remote_packager,
+        test_pool_builds_full_packages,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Build Workers Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+test_chunked_transfer.py - Test chunked, resumable package uploads
+"""
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from chunked_transfer import ChunkManifest, ChunkedUploader
+from env_manager import EnvironmentManager
+from transports import LocalDirectorySession, TransportError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_chunked")
+
+CHUNK = 64 * 1024
+
+class FlakySession(LocalDirectorySession):
+    """Fails every put after the first `allowed` ones"""
+
+    def __init__(self, host, user, root, allowed):
+        super().__init__(host, user, root)
+        self.allowed = allowed
+        self.puts = 0
+
+    def put(self, local_path, remote_path):
+        if self.puts >= self.allowed:
+            raise TransportError("connection reset")
+        self.puts += 1
+        super().put(local_path, remote_path)
+
+def _package(temp_dir, name='pkg.tar', size=10 * CHUNK + 123):
+    path = os.path.join(temp_dir, name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_manifest_covers_file():
+    """Chunks cover the file exactly"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manifest = ChunkManifest(_package(temp_dir), CHUNK)
+        assert len(manifest.chunks) == 11
+        assert sum(length for _, length, _ in manifest.chunks) == manifest.size
+
+def test_interrupted_upload_resumes():
+    """A retry only sends chunks that did not arrive the first time"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        host_root = os.path.join(temp_dir, 'host')
+        uploader = ChunkedUploader('/chunks', chunk_size=CHUNK)
+
+        try:
+            uploader.upload(FlakySession('h', None, host_root, allowed=4), package_path, '/app/pkg.tar')
+        except TransportError:
+            pass
+        else:
+            raise AssertionError("upload should have been interrupted")
+        assert not os.path.exists(os.path.join(host_root, 'app', 'pkg.tar'))
+        upload_dirs = os.listdir(os.path.join(host_root, 'chunks'))
+        assert len(upload_dirs) == 1 and upload_dirs[0].startswith('pkg.tar-')
+        assert not any(name.endswith('.part') for name in os.listdir(os.path.join(host_root, 'chunks', upload_dirs[0])))
+
+        resumed = FlakySession('h', None, host_root, allowed=100)
+        sent, skipped = uploader.upload(resumed, package_path, '/app/pkg.tar')
+        assert (sent, skipped) == (7, 4)
+        assert _read(os.path.join(host_root, 'app', 'pkg.tar')) == _read(package_path)
+
+def test_corrupt_chunk_is_detected_and_resent():
+    """A chunk whose content does not match its digest fails verification and is resent"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        session = LocalDirectorySession('h', None, os.path.join(temp_dir, 'host'))
+        uploader = ChunkedUploader('/chunks', chunk_size=CHUNK, keep_chunks=True)
+        uploader.upload(session, package_path, '/app/v1.tar')
+
+        digest = ChunkManifest(package_path, CHUNK).chunks[3][2]
+        with open(session.local_path(f"/chunks/{digest}"), 'wb') as f:
+            f.write(b'bitrot')
+
+        try:
+            uploader.upload(session, package_path, '/app/v2.tar')
+        except TransportError as e:
+            assert 'digest mismatch' in str(e)
+        else:
+            raise AssertionError("corruption not detected")
+
+        assert uploader.upload(session, package_path, '/app/v2.tar') == (1, 10)
+        assert _read(session.local_path('/app/v2.tar')) == _read(package_path)
+
+def test_concurrent_uploads_keep_their_chunks():
+    """Uploads of other versions sharing chunks neither reuse nor delete an interrupted upload's chunks"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        other_path = os.path.join(temp_dir, 'other.tar')
+        with open(other_path, 'wb') as f:
+            f.write(_read(package_path)[:4 * CHUNK] + os.urandom(CHUNK))
+        host_root = os.path.join(temp_dir, 'host')
+        uploader = ChunkedUploader('/chunks', chunk_size=CHUNK)
+
+        try:
+            uploader.upload(FlakySession('h', None, host_root, allowed=4), package_path, '/app/1/pkg.tar',
+                            name='app-1')
+        except TransportError:
+            pass
+        session = LocalDirectorySession('h', None, host_root)
+        assert uploader.upload(session, other_path, '/app/2/pkg.tar', name='app-2') == (5, 0)
+
+        assert uploader.upload(session, package_path, '/app/1/pkg.tar', name='app-1') == (7, 4)
+        assert _read(session.local_path('/app/1/pkg.tar')) == _read(package_path)
+        assert os.listdir(session.local_path('/chunks')) == []
+
+def test_missing_chunk_counts_as_absent():
+    """A chunk that vanished before the corruption check is skipped there and resent by the retry"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        session = LocalDirectorySession('h', None, os.path.join(temp_dir, 'host'))
+        uploader = ChunkedUploader('/chunks', chunk_size=CHUNK, keep_chunks=True)
+        uploader.upload(session, package_path, '/app/v1.tar')
+
+        digests = [digest for _, _, digest in ChunkManifest(package_path, CHUNK).chunks]
+        os.remove(session.local_path(f"/chunks/{digests[2]}"))
+        uploader._drop_corrupt_chunks(session, {digest: f"/chunks/{digest}" for digest in digests})
+
+        assert uploader.upload(session, package_path, '/app/v2.tar') == (1, 10)
+        assert _read(session.local_path('/app/v2.tar')) == _read(package_path)
+
+class CorruptingSession(LocalDirectorySession):
+    """Garbles the first `corrupt` chunks put on the host"""
+
+    def __init__(self, host, user, root, corrupt):
+        super().__init__(host, user, root)
+        self.corrupt = corrupt
+
+    def put(self, local_path, remote_path):
+        super().put(local_path, remote_path)
+        if self.corrupt:
+            self.corrupt -= 1
+            with open(self.local_path(remote_path), 'r+b') as f:
+                f.write(b'bitrot')
+
+def test_corrupt_transfer_resends_chunk():
+    """A chunk garbled in transit is resent before assembly, and chunks are removed afterwards"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        session = CorruptingSession('h', None, os.path.join(temp_dir, 'host'), corrupt=2)
+        uploader = ChunkedUploader('/chunks', chunk_size=CHUNK)
+
+        assert uploader.upload(session, package_path, '/app/pkg.tar') == (11, 0)
+        assert _read(session.local_path('/app/pkg.tar')) == _read(package_path)
+        assert os.listdir(session.local_path('/chunks')) == []
+
+def test_environment_chunked_mode():
+    """upload_mode: chunked delivers the package to every host"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        manager = EnvironmentManager({'type': 'vm', 'hosts': ['a', 'b'], 'transport_root': temp_dir,
+                                      'upload_mode': 'chunked', 'chunk_size': CHUNK})
+        assert all(result.success for result in manager.deploy(package_path, 'app', '1'))
+        for host in ('a', 'b'):
+            assert _read(os.path.join(temp_dir, host, 'opt/deploy/app/releases/1/pkg.tar')) == _read(package_path)
+
+def main():
+    tests = [
+        test_manifest_covers_file,
+        test_interrupted_upload_resumes,
+        test_corrupt_chunk_is_detected_and_resent,
+        test_corrupt_transfer_resends_chunk,
+        test_concurrent_uploads_keep_their_chunks,
+        test_missing_chunk_counts_as_absent,
+        test_environment_chunked_mode,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Chunked Transfer Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
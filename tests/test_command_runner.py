@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+test_command_runner.py - Test streamed command output, the error tail, timeouts and cancellation
+"""
+import os
+import sys
+import time
+import logging
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.command_runner import MAX_LINE_BYTES, Command, CommandError, run_command, run_commands
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_command_runner")
+
+class _Collector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+def _python(code):
+    return [sys.executable, '-c', code]
+
+def test_lines_are_logged_as_they_arrive():
+    """Every line reaches the log; only the last tail_lines are kept in memory"""
+    log = logging.getLogger("test_command_runner.stream")
+    log.setLevel(logging.INFO)
+    collector = _Collector()
+    log.addHandler(collector)
+    try:
+        code = ("import sys\n"
+                "for i in range(1000):\n"
+                "    print(f'out {i}')\n"
+                "print('warning on stderr', file=sys.stderr)\n")
+        result = run_command(_python(code), label='printer', log=log, tail_lines=10)
+    finally:
+        log.removeHandler(collector)
+
+    assert result.success and result.returncode == 0
+    assert len(collector.lines) == 1001
+    assert collector.lines[0] == '[printer] out 0'
+    assert '[printer] warning on stderr' in collector.lines
+    assert len(result.tail) == 10 and 'out 999' in result.tail
+
+def test_failure_raises_with_tail():
+    """check=True raises CommandError carrying the end of the output"""
+    code = "import sys\nprint('compiling')\nprint('error: missing header', file=sys.stderr)\nsys.exit(3)\n"
+    try:
+        run_command(_python(code), check=True, message="Build")
+    except CommandError as e:
+        assert e.result.returncode == 3
+        assert str(e).startswith("Build exited with 3")
+        assert 'error: missing header' in str(e)
+    else:
+        raise AssertionError("Expected CommandError for a failing command")
+
+def test_long_lines_are_cut():
+    """A line without newlines for megabytes is logged cut to MAX_LINE_BYTES"""
+    code = "import sys\nsys.stdout.write('x' * (4 * 1024 * 1024))\nprint()\nprint('done')\n"
+    result = run_command(_python(code), level=logging.DEBUG)
+    assert result.success
+    assert result.tail[0].endswith(' [truncated]') and len(result.tail[0]) < MAX_LINE_BYTES + 32
+    assert result.tail[1:] == ['done']
+
+def test_timeout_and_cancel_stop_the_command():
+    """A timeout or a set cancel event stops the command well before it would finish"""
+    started = time.monotonic()
+    result = run_command(_python("import time\ntime.sleep(30)\n"), timeout=0.5)
+    assert result.timed_out and not result.success
+    assert time.monotonic() - started < 10
+
+    cancel = threading.Event()
+    threading.Timer(0.3, cancel.set).start()
+    started = time.monotonic()
+    result = run_command(_python("import time\ntime.sleep(30)\n"), cancel=cancel)
+    assert result.cancelled and not result.success
+    assert time.monotonic() - started < 10
+    try:
+        result.check()
+    except CommandError as e:
+        assert 'was cancelled' in str(e)
+    else:
+        raise AssertionError("Expected CommandError for a cancelled command")
+
+def test_commands_run_concurrently():
+    """run_commands overlaps commands on one event loop and keeps result order"""
+    commands = [Command(_python(f"import time\ntime.sleep(0.5)\nprint({i})\n"), label=f"sleep-{i}")
+                for i in range(4)]
+    started = time.monotonic()
+    results = run_commands(commands)
+    elapsed = time.monotonic() - started
+
+    assert [result.tail for result in results] == [['0'], ['1'], ['2'], ['3']]
+    assert elapsed < 1.8, f"4 x 0.5s commands took {elapsed:.2f}s"
+
+def main():
+    tests = [
+        test_lines_are_logged_as_they_arrive,
+        test_failure_raises_with_tail,
+        test_long_lines_are_cut,
+        test_timeout_and_cancel_stop_the_command,
+        test_commands_run_concurrently,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Command Runner Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
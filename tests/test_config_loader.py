@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+test_config_loader.py - Test config includes, schema checks and the cached snapshot
+"""
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.config_loader import ConfigError, ConfigLoader
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_config_loader")
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def _make_config(root):
+    config_dir = os.path.join(root, 'config')
+    _write(os.path.join(config_dir, 'environments.yaml'),
+           "production:\n  type: vm\n  hosts: [web1, web2]\n  upload_mode: chunked\n")
+    _write(os.path.join(config_dir, 'apps.yaml'),
+           "includes: ['teams/*/apps.yaml']\n"
+           "core-app:\n  type: python\n  source_dir: ./apps/core\n")
+    _write(os.path.join(config_dir, 'teams', 'payments', 'apps.yaml'),
+           "billing:\n  type: perl\n  source_dir: ./apps/billing\n  compression: xz\n")
+    return config_dir
+
+def test_includes_merge_team_fragments():
+    """Fragments named by includes are merged; app names default to their key"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_dir = _make_config(temp_dir)
+        environments, apps = ConfigLoader(config_dir, snapshot_dir=None).load()
+
+        assert sorted(apps) == ['billing', 'core-app']
+        assert apps['billing']['name'] == 'billing' and apps['billing']['compression'] == 'xz'
+        assert environments['production']['hosts'] == ['web1', 'web2']
+
+        _write(os.path.join(config_dir, 'teams', 'search', 'apps.yaml'),
+               "billing:\n  type: python\n  source_dir: ./other\n")
+        try:
+            ConfigLoader(config_dir, snapshot_dir=None).load()
+            assert False, "duplicate app name accepted"
+        except ConfigError as e:
+            assert "'billing' is defined in both" in str(e)
+
+def test_schema_errors_are_reported_together():
+    """Missing keys, wrong types and unknown choices are all listed"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_dir = _make_config(temp_dir)
+        _write(os.path.join(config_dir, 'environments.yaml'),
+               "staging:\n  hosts: web1\n  upload_mode: fast\n  custom_setting: 1\n")
+        try:
+            ConfigLoader(config_dir, snapshot_dir=None).load()
+            assert False, "invalid config accepted"
+        except ConfigError as e:
+            message = str(e)
+        assert "environment 'staging': missing required key 'type'" in message
+        assert "'hosts' must be list, got str" in message
+        assert "'upload_mode' must be one of full, chunked, sync, got 'fast'" in message
+        assert 'custom_setting' not in message
+
+def test_delta_mode_rejects_zstd():
+    """Hosts cannot rebuild zstd delta packages, so the combination is refused up front"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_dir = _make_config(temp_dir)
+        _write(os.path.join(config_dir, 'apps.yaml'),
+               "core-app:\n  type: python\n  source_dir: ./apps/core\n  package_mode: delta\n  compression: zstd\n")
+        try:
+            ConfigLoader(config_dir, snapshot_dir=None).load()
+            assert False, "delta mode with zstd accepted"
+        except ConfigError as e:
+            assert "app 'core-app': 'package_mode' delta does not support 'compression' zstd" in str(e)
+
+def test_snapshot_reused_until_a_file_changes():
+    """A pickled snapshot serves later loads and is rebuilt when a file or include directory changes"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_dir = _make_config(temp_dir)
+        snapshot_dir = os.path.join(temp_dir, 'snapshots')
+
+        def load():
+            ConfigLoader._memory.clear()
+            loader = ConfigLoader(config_dir, snapshot_dir)
+            environments, apps = loader.load()
+            return loader.source, apps
+
+        assert load()[0] == 'yaml'
+        assert load()[0] == 'snapshot'
+        loader = ConfigLoader(config_dir, snapshot_dir)
+        loader.load()
+        assert loader.source == 'memory'
+
+        _write(os.path.join(config_dir, 'teams', 'search', 'apps.yaml'),
+               "indexer:\n  type: python\n  source_dir: ./apps/indexer\n")
+        source, apps = load()
+        assert source == 'yaml' and 'indexer' in apps
+
+        path = os.path.join(config_dir, 'apps.yaml')
+        _write(path, "includes: ['teams/*/apps.yaml']\ncore-app:\n  type: python\n  source_dir: ./apps/core2\n")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        source, apps = load()
+        assert source == 'yaml' and apps['core-app']['source_dir'] == './apps/core2'
+
+def main():
+    tests = [
+        test_includes_merge_team_fragments,
+        test_schema_errors_are_reported_together,
+        test_delta_mode_rejects_zstd,
+        test_snapshot_reused_until_a_file_changes,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Config Loader Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+test_connection_pool.py - Test host session pooling
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from connection_pool import ConnectionPool
+from env_manager import EnvironmentManager
+from transports import TransportError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_connection_pool")
+
+class FakeSession:
+    def __init__(self, host, user):
+        self.host = host
+        self.user = user
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class FakeTransport:
+    def __init__(self):
+        self.connects = 0
+        self.lock = threading.Lock()
+
+    def connect(self, host, user):
+        with self.lock:
+            self.connects += 1
+        return FakeSession(host, user)
+
+def test_sessions_are_reused():
+    """Releasing a session makes the next acquire for the same host a hit"""
+    transport = FakeTransport()
+    pool = ConnectionPool(transport)
+    for _ in range(3):
+        with pool.session('web1', 'deploy'):
+            pass
+    with pool.session('web1', 'other'):
+        pass
+
+    stats = pool.stats.as_dict()
+    assert transport.connects == 2
+    assert (stats['hits'], stats['misses']) == (2, 2)
+
+def test_idle_sessions_expire():
+    """Sessions idle longer than idle_timeout are closed instead of reused"""
+    pool = ConnectionPool(FakeTransport(), idle_timeout=0.01)
+    with pool.session('web1', None) as first:
+        pass
+    time.sleep(0.02)
+    with pool.session('web1', None) as second:
+        pass
+
+    assert first is not second and first.closed
+    assert pool.stats.evictions == 1
+
+def test_cap_evicts_least_recently_used():
+    """At the connection cap the oldest idle session makes room for a new host"""
+    pool = ConnectionPool(FakeTransport(), max_connections=2)
+    with pool.session('a', None) as a:
+        pass
+    with pool.session('b', None):
+        pass
+    with pool.session('c', None):
+        pass
+
+    assert a.closed
+    assert pool._open == 2
+
+def test_failed_session_is_discarded():
+    """A session that hit a transport error is closed rather than handed out again"""
+    pool = ConnectionPool(FakeTransport())
+    try:
+        with pool.session('a', None) as broken:
+            raise TransportError("connection reset")
+    except TransportError:
+        pass
+    with pool.session('a', None) as fresh:
+        pass
+
+    assert broken.closed and fresh is not broken
+    assert pool.stats.discarded == 1
+
+def test_caller_errors_keep_session():
+    """An error from the caller's own code returns the healthy session to the pool"""
+    pool = ConnectionPool(FakeTransport())
+    try:
+        with pool.session('a', None) as first:
+            raise ValueError("bad placeholder")
+    except ValueError:
+        pass
+    with pool.session('a', None) as second:
+        pass
+
+    assert second is first and not first.closed
+    assert pool.stats.discarded == 0
+
+def test_sessions_close_outside_the_lock():
+    """Closing an evicted session does not hold up other threads using the pool"""
+    pool = ConnectionPool(FakeTransport(), max_connections=1)
+    with pool.session('a', None) as slow:
+        pass
+    closing = threading.Event()
+    proceed = threading.Event()
+
+    def slow_close():
+        closing.set()
+        proceed.wait(5)
+    slow.close = slow_close
+
+    evicting = threading.Thread(target=pool.acquire, args=('b', None))
+    evicting.start()
+    assert closing.wait(5)
+    # The pool lock is free while the evicted session closes
+    acquired = pool._condition.acquire(timeout=1)
+    if acquired:
+        pool._condition.release()
+    proceed.set()
+    evicting.join()
+    assert acquired
+
+def test_environment_reuses_sessions_across_steps_and_apps():
+    """prepare and deploy of two apps open one session per host"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = os.path.join(temp_dir, 'pkg.tar.gz')
+        with open(package_path, 'wb') as f:
+            f.write(b'data')
+
+        manager = EnvironmentManager({'type': 'vm', 'hosts': ['h1', 'h2'], 'transport_root': temp_dir})
+        manager.prepare()
+        manager.deploy(package_path, 'app-one', '1')
+        manager.deploy(package_path, 'app-two', '1')
+
+        stats = manager.pool_stats()
+        assert stats['misses'] == 2
+        assert stats['hits'] == 4
+        manager.close()
+
+def main():
+    tests = [
+        test_sessions_are_reused,
+        test_idle_sessions_expire,
+        test_cap_evicts_least_recently_used,
+        test_failed_session_is_discarded,
+        test_caller_errors_keep_session,
+        test_sessions_close_outside_the_lock,
+        test_environment_reuses_sessions_across_steps_and_apps,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Connection Pool Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+test_daemon.py - Test the deploy daemon's job queue, HTTP API and client
+"""
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from daemon import DaemonClient, DeployDaemon, serve
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_daemon")
+
+MOCK_APP = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'mock', 'python-app')
+
+def _make_config(root):
+    config_dir = os.path.join(root, 'config')
+    os.makedirs(config_dir)
+    with open(os.path.join(config_dir, 'apps.yaml'), 'w') as f:
+        f.write(f"daemon-app:\n  type: python\n  source_dir: {MOCK_APP}\n")
+    with open(os.path.join(config_dir, 'environments.yaml'), 'w') as f:
+        f.write(f"staging:\n  type: vm\n  hosts: [web1]\n  transport_root: {os.path.join(root, 'hosts')}\n")
+    return config_dir
+
+def test_jobs_run_through_http_api():
+    """Submitted jobs run on the warm daemon; status and logs are served over HTTP"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        shutil.rmtree('build/daemon-app', ignore_errors=True)
+        daemon = DeployDaemon(_make_config(temp_dir), workers=2, test_mode=True)
+        server = serve(daemon, port=0)
+        try:
+            client = DaemonClient(f"http://127.0.0.1:{server.server_address[1]}")
+            first = client.submit('daemon-app', 'staging', version='1')
+            assert first['status'] in ('queued', 'running', 'succeeded')
+
+            lines = list(client.stream_log(first['id']))
+            assert client.wait(first['id'])['status'] == 'succeeded'
+            assert any('Would deploy' in line for line in lines)
+            packager = daemon._packagers['daemon-app'][1]
+
+            second = client.submit('daemon-app', 'staging', version='2')
+            assert client.wait(second['id'], poll_interval=0.05)['status'] == 'succeeded'
+            assert daemon._packagers['daemon-app'][1] is packager
+
+            health = client.health()
+            assert health['jobs'] == {'succeeded': 2}
+            assert health['warm_apps'] == ['daemon-app'] and health['warm_environments'] == ['staging']
+            assert [job['id'] for job in client.jobs()] == [first['id'], second['id']]
+
+            try:
+                client.submit('missing-app', 'staging')
+                assert False, "unknown app accepted"
+            except RuntimeError as e:
+                assert 'missing-app' in str(e)
+            try:
+                client.submit('daemon-app', 'staging', test_mode='false')
+                assert False, "string test flag accepted"
+            except RuntimeError as e:
+                assert 'true or false' in str(e)
+        finally:
+            server.shutdown()
+            daemon.stop()
+
+def test_queued_jobs_can_be_cancelled():
+    """A job cancelled before a worker picks it up never runs"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        daemon = DeployDaemon(_make_config(temp_dir), workers=1, test_mode=True)
+        job = daemon.submit('daemon-app', 'staging', version='1')
+        assert daemon.cancel(job.id)
+        assert not daemon.cancel(job.id)
+
+        daemon.start()
+        try:
+            follow_up = daemon.submit('daemon-app', 'staging', version='2')
+            with follow_up.changed:
+                follow_up.changed.wait_for(lambda: follow_up.done, timeout=30)
+            assert job.status == 'cancelled' and job.started is None
+            assert follow_up.status == 'succeeded'
+        finally:
+            daemon.stop()
+
+def test_logging_does_not_take_daemon_lock():
+    """Log records are routed while another thread holds the daemon lock, so the two cannot deadlock"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        daemon = DeployDaemon(_make_config(temp_dir), workers=1, test_mode=True)
+        record = logging.LogRecord('deployer', logging.INFO, __file__, 0, 'busy', None, None)
+        with daemon._lock:
+            worker = threading.Thread(target=daemon._log_handler.handle, args=(record,))
+            worker.start()
+            worker.join(timeout=5)
+            assert not worker.is_alive(), "log handler waited for the daemon lock"
+
+def main():
+    tests = [
+        test_jobs_run_through_http_api,
+        test_queued_jobs_can_be_cancelled,
+        test_logging_does_not_take_daemon_lock,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Daemon Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+test_distribution.py - Test fan-out tree distribution to host fleets
+"""
+import os
+import sys
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+import transports
+from connection_pool import ConnectionPool
+from distribution import ORIGIN, TreeDistributor, TreeScheduler, simulate_distribution
+from env_manager import EnvironmentManager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_distribution")
+
+class CorruptingSession(transports.LocalDirectorySession):
+    """Corrupts the first relay to one host"""
+    corrupted = set()
+
+    def relay(self, remote_path, target_session, target_path):
+        super().relay(remote_path, target_session, target_path)
+        if target_session.host == 'h5' and 'h5' not in self.corrupted:
+            self.corrupted.add('h5')
+            with open(target_session.local_path(target_path), 'ab') as f:
+                f.write(b'garbage')
+
+class CorruptingTransport(transports.LocalDirectoryTransport):
+    def connect(self, host, user):
+        return CorruptingSession(host, user, os.path.join(self.root, host))
+
+def _package(temp_dir):
+    package_path = os.path.join(temp_dir, 'pkg.tar.gz')
+    with open(package_path, 'wb') as f:
+        f.write(os.urandom(4096))
+    return package_path
+
+def test_origin_only_seeds():
+    """The origin sends to at most `seeds` hosts while relays can do the rest"""
+    scheduler = TreeScheduler([f"h{i}" for i in range(10)], seeds=2, fanout=3)
+    first = scheduler.next_transfers()
+    assert first == [(ORIGIN, 'h0'), (ORIGIN, 'h1')]
+
+    scheduler.complete(ORIGIN, 'h0', True)
+    second = scheduler.next_transfers()
+    assert [source for source, _ in second] == ['h0', 'h0', 'h0']
+
+def test_tree_beats_direct_push_for_large_fleets():
+    """Tree completion time grows with log(N) while direct push grows with N"""
+    size, bandwidth = 100 * 1024 * 1024, 100 * 1024 * 1024
+    direct = simulate_distribution(256, size, bandwidth, seeds=8, fanout=0)
+    tree = simulate_distribution(256, size, bandwidth, seeds=2, fanout=2)
+    small_tree = simulate_distribution(16, size, bandwidth, seeds=2, fanout=2)
+
+    assert tree['completion_time'] < direct['completion_time'] / 5
+    assert tree['completion_time'] < small_tree['completion_time'] * 3
+    assert direct['depth'] == 1 and tree['depth'] > 2
+
+def test_simulated_failures_are_retried():
+    """Corrupt transfers are retried from other holders"""
+    result = simulate_distribution(64, 1024, 1024, seeds=2, fanout=2, failure_rate=0.2, max_retries=10)
+    assert result['failed'] == []
+
+def test_local_tree_distribution_verifies_checksums():
+    """Hosts relay to each other and a corrupted copy is detected and resent"""
+    transports.TRANSPORTS['corrupting'] = CorruptingTransport
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            package_path = _package(temp_dir)
+            hosts = [f"h{i}" for i in range(8)]
+            transport = transports.create_transport({'transport': 'corrupting', 'transport_root': temp_dir})
+            errors = TreeDistributor(ConnectionPool(transport), seeds=1, fanout=2).distribute(
+                hosts, package_path, '/srv/pkg.tar.gz')
+
+            assert all(error is None for error in errors.values())
+            with open(package_path, 'rb') as f:
+                expected = f.read()
+            for host in hosts:
+                with open(os.path.join(temp_dir, host, 'srv', 'pkg.tar.gz'), 'rb') as f:
+                    assert f.read() == expected
+            assert CorruptingSession.corrupted == {'h5'}
+    finally:
+        del transports.TRANSPORTS['corrupting']
+
+def test_environment_tree_mode():
+    """distribution: tree deploys and activates on every host"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = EnvironmentManager({
+            'type': 'vm', 'hosts': [f"h{i}" for i in range(5)], 'transport_root': temp_dir,
+            'distribution': 'tree', 'distribution_seeds': 1, 'distribution_fanout': 2,
+            'activate_commands': ['touch activated'],
+        })
+        results = manager.deploy(_package(temp_dir), 'app', '7')
+
+        assert all(result.success for result in results)
+        for i in range(5):
+            assert os.path.exists(os.path.join(temp_dir, f"h{i}", 'activated'))
+            assert os.path.exists(os.path.join(temp_dir, f"h{i}", 'opt/deploy/app/releases/7/pkg.tar.gz'))
+
+def main():
+    tests = [
+        test_origin_only_seeds,
+        test_tree_beats_direct_push_for_large_fleets,
+        test_simulated_failures_are_retried,
+        test_local_tree_distribution_verifies_checksums,
+        test_environment_tree_mode,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Distribution Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
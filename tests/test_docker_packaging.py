@@ -6,10 +6,18 @@ import os
 import sys
 import subprocess
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+# Packager modules import their siblings by name, as deployer.py does
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+import io
+import json
+import shutil
 import logging
+import tarfile
+import tempfile
 
 
-from src.app_packager import PythonPackager, PerlPackager
+from src.app_packager import PythonPackager, PerlPackager, sync_directory
+from src.docker_export import docker_save_stream, merge_layer_export
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("test_docker")
@@ -78,6 +86,227 @@ def test_perl_docker_packaging():
         logger.error(f"ERROR: Docker packaging failed: {str(e)}")
         return False
 
+FAKE_DOCKER = """#!/bin/sh
+echo "$@" >> "$FAKE_DOCKER_LOG"
+if [ "$1" = "save" ]; then
+    if [ "$2" = "-o" ]; then
+        echo image > "$3"
+    else
+        cat "$FAKE_DOCKER_IMAGE"
+    fi
+fi
+"""
+
+def _with_fake_docker(test):
+    """Run test(log_path) with a stub docker executable first on PATH"""
+    with tempfile.TemporaryDirectory() as bin_dir:
+        docker = os.path.join(bin_dir, 'docker')
+        with open(docker, 'w') as f:
+            f.write(FAKE_DOCKER)
+        os.chmod(docker, 0o755)
+
+        log_path = os.path.join(bin_dir, 'calls.log')
+        saved = dict(os.environ)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+        os.environ['FAKE_DOCKER_LOG'] = log_path
+        try:
+            return test(log_path)
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+
+def test_dockerfile_installs_dependencies_before_sources():
+    """requirements.txt is copied and installed before COPY . so code changes keep the layer"""
+    with tempfile.TemporaryDirectory() as source_dir:
+        with open(os.path.join(source_dir, 'requirements.txt'), 'w') as f:
+            f.write("pyyaml\n")
+        with open(os.path.join(source_dir, 'app.py'), 'w') as f:
+            f.write("print('hi')\n")
+
+        app_config = {
+            'name': 'python-dockerfile-test',
+            'type': 'python',
+            'source_dir': source_dir,
+            'package_type': 'docker',
+            'docker_cache': {'cache_from': ['registry/app:cache']},
+        }
+        shutil.rmtree('build/python-dockerfile-test', ignore_errors=True)
+
+        def run(log_path):
+            package_path = PythonPackager(app_config).package('2')
+            with open(log_path) as f:
+                return package_path, f.read()
+
+        package_path, calls = _with_fake_docker(run)
+        with open('build/python-dockerfile-test/docker/Dockerfile') as f:
+            dockerfile = f.read().splitlines()
+
+        assert package_path.endswith('python-dockerfile-test-2.tar')
+        assert dockerfile[0] == '# syntax=docker/dockerfile:1'
+        assert dockerfile.index('COPY requirements.txt /app/requirements.txt') < dockerfile.index('COPY . /app/')
+        assert any('--mount=type=cache' in line for line in dockerfile)
+        assert dockerfile[-1] == 'LABEL version=2'
+        assert '--cache-from registry/app:cache' in calls
+        assert os.path.exists('build/python-dockerfile-test/docker/context/app.py')
+
+def test_excluded_requirements_not_installed():
+    """An excluded requirements.txt is left out of both the context and the Dockerfile"""
+    with tempfile.TemporaryDirectory() as source_dir:
+        with open(os.path.join(source_dir, 'requirements.txt'), 'w') as f:
+            f.write("pyyaml\n")
+        with open(os.path.join(source_dir, 'app.py'), 'w') as f:
+            f.write("print('hi')\n")
+
+        app_config = {
+            'name': 'python-dockerfile-exclude-test',
+            'type': 'python',
+            'source_dir': source_dir,
+            'package_type': 'docker',
+            'exclude': ['requirements.txt'],
+        }
+        shutil.rmtree('build/python-dockerfile-exclude-test', ignore_errors=True)
+
+        _with_fake_docker(lambda log_path: PythonPackager(app_config).package('1'))
+        with open('build/python-dockerfile-exclude-test/docker/Dockerfile') as f:
+            dockerfile = f.read()
+
+        assert 'requirements.txt' not in dockerfile
+        assert not os.path.exists('build/python-dockerfile-exclude-test/docker/context/requirements.txt')
+
+def test_sync_directory_is_incremental():
+    """Only changed files are copied and removed files are deleted from the context"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source, target = os.path.join(temp_dir, 'src'), os.path.join(temp_dir, 'ctx')
+        os.makedirs(os.path.join(source, 'lib'))
+        for name in ('a.py', 'b.py', 'lib/c.py'):
+            with open(os.path.join(source, name), 'w') as f:
+                f.write(name)
+        sync_directory(source, target)
+
+        untouched_inode = os.stat(os.path.join(target, 'a.py')).st_ino
+        os.remove(os.path.join(source, 'lib', 'c.py'))
+        with open(os.path.join(source, 'b.py'), 'w') as f:
+            f.write('changed')
+        sync_directory(source, target)
+
+        assert os.stat(os.path.join(target, 'a.py')).st_ino == untouched_inode
+        with open(os.path.join(target, 'b.py')) as f:
+            assert f.read() == 'changed'
+        assert not os.path.exists(os.path.join(target, 'lib', 'c.py'))
+
+def _write_fake_image(path, layers):
+    """Write a docker-save style archive with the given {layer_path: content}"""
+    with tarfile.open(path, 'w') as tar:
+        entries = dict(layers)
+        entries['manifest.json'] = json.dumps([{'Config': 'config.json', 'Layers': list(layers)}]).encode()
+        for name, content in entries.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+def _archive_files(path):
+    with tarfile.open(path, 'r:*') as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()}
+
+def test_save_failure_reports_docker_error():
+    """A docker save that fails before streaming raises with docker's stderr, not a tarfile error"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['FAKE_DOCKER_IMAGE'] = os.path.join(temp_dir, 'missing.tar')
+
+        def save(log_path):
+            with docker_save_stream('app:1') as stream:
+                with tarfile.open(fileobj=stream, mode='r|') as image:
+                    list(image)
+
+        try:
+            _with_fake_docker(save)
+        except RuntimeError as e:
+            assert 'missing.tar' in str(e)
+            assert isinstance(e.__cause__, tarfile.ReadError)
+        else:
+            raise AssertionError("Expected RuntimeError for a failed docker save")
+        finally:
+            del os.environ['FAKE_DOCKER_IMAGE']
+
+def test_layer_export_skips_known_layers():
+    """Streamed exports leave out layers of the previous version and can be merged back"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'src')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'app.pl'), 'w') as f:
+            f.write("print 1;\n")
+        image_path = os.path.join(temp_dir, 'image.tar')
+
+        app_config = {
+            'name': 'perl-layers-test',
+            'type': 'perl',
+            'source_dir': source_dir,
+            'package_type': 'docker',
+            'docker_export': 'layers',
+        }
+        shutil.rmtree('build/perl-layers-test', ignore_errors=True)
+        packager = PerlPackager(app_config)
+
+        def package(version, layers):
+            _write_fake_image(image_path, layers)
+            os.environ['FAKE_DOCKER_IMAGE'] = image_path
+            return _with_fake_docker(lambda log_path: packager.package(version))
+
+        first = package('1', {'base/layer.tar': b'base' * 1000, 'code1/layer.tar': b'v1'})
+        second = package('2', {'base/layer.tar': b'base' * 1000, 'code2/layer.tar': b'v2'})
+
+        assert first.endswith('perl-layers-test-1.tar.gz')
+        assert second.endswith('perl-layers-test-2.layers.tar.gz')
+        assert 'base/layer.tar' not in _archive_files(second)
+
+        merged = merge_layer_export(first, second, os.path.join(temp_dir, 'merged.tar'))
+        files = _archive_files(merged)
+        assert files['base/layer.tar'] == b'base' * 1000
+        assert files['code2/layer.tar'] == b'v2'
+        assert 'code1/layer.tar' not in files
+
+def test_layer_exports_deploy_as_full_images():
+    """Every layer export is against the last complete export and deploys as a loadable image"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'src')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'app.pl'), 'w') as f:
+            f.write("print 1;\n")
+        image_path = os.path.join(temp_dir, 'image.tar')
+
+        app_config = {
+            'name': 'perl-layer-chain-test',
+            'type': 'perl',
+            'source_dir': source_dir,
+            'package_type': 'docker',
+            'docker_export': 'layers',
+            'full_package_every': 3,
+        }
+        shutil.rmtree('build/perl-layer-chain-test', ignore_errors=True)
+        packager = PerlPackager(app_config)
+
+        def package(version, layers):
+            _write_fake_image(image_path, layers)
+            os.environ['FAKE_DOCKER_IMAGE'] = image_path
+            return _with_fake_docker(lambda log_path: packager.package(version))
+
+        base = {'base/layer.tar': b'base' * 1000}
+        paths = [package(str(version), dict(base, **{f"code{version}/layer.tar": f"v{version}".encode()}))
+                 for version in range(1, 5)]
+
+        assert [path.endswith('.layers.tar.gz') for path in paths] == [False, True, True, False]
+        assert packager.artifacts.get('3')['depends_on'] == '1'
+
+        full_path, delta = packager.deployable('3', paths[2])
+        assert delta is None and full_path != paths[2]
+        files = _archive_files(full_path)
+        assert files['base/layer.tar'] == b'base' * 1000
+        assert files['code3/layer.tar'] == b'v3'
+        assert '.omitted-layers.json' not in files
+        assert json.loads(files['manifest.json'])[0]['Layers'] == ['base/layer.tar', 'code3/layer.tar']
+
+        assert packager.deployable('4', paths[3]) == (paths[3], None)
+
 def check_docker_available():
     try:
         subprocess.run(
@@ -91,6 +320,12 @@ def check_docker_available():
         return False
 
 def main():
+    # These use a stub docker executable and run everywhere
+    for test in (test_dockerfile_installs_dependencies_before_sources, test_excluded_requirements_not_installed,
+                 test_sync_directory_is_incremental, test_save_failure_reports_docker_error,
+                 test_layer_export_skips_known_layers, test_layer_exports_deploy_as_full_images):
+        test()
+
     if not check_docker_available():
         logger.error("Docker is not available. Please install Docker to run this test.")
         return 1
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+test_env_manager.py - Test host fan-out and rolling deployments
+"""
+import os
+import sys
+import time
+import logging
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+import transports
+from env_manager import EnvironmentManager
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_env_manager")
+
+class CountingTransport(transports.LocalDirectoryTransport):
+    """Local transport that records how many hosts are busy at once"""
+    lock = threading.Lock()
+    active = 0
+    peak = 0
+
+    def connect(self, host, user):
+        session = super().connect(host, user)
+        put = session.put
+
+        def slow_put(local_path, remote_path):
+            cls = CountingTransport
+            with cls.lock:
+                cls.active += 1
+                cls.peak = max(cls.peak, cls.active)
+            time.sleep(0.02)
+            try:
+                put(local_path, remote_path)
+            finally:
+                with cls.lock:
+                    cls.active -= 1
+
+        session.put = slow_put
+        return session
+
+def _package(temp_dir):
+    package_path = os.path.join(temp_dir, 'app-1.tar.gz')
+    with open(package_path, 'wb') as f:
+        f.write(b'package')
+    return package_path
+
+def test_local_transport_deploys_to_every_host():
+    """Every host directory receives the package and runs activate commands"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env_config = {
+            'type': 'vm',
+            'hosts': ['web1', 'web2', 'web3'],
+            'transport': 'local',
+            'transport_root': os.path.join(temp_dir, 'hosts'),
+            'deploy_dir': '/srv/apps',
+            'prepare_commands': ['touch prepared-{host}'],
+            'activate_commands': ['ln -sfn {version} srv/apps/{app}/current', 'touch {release_dir}/activated'],
+        }
+        manager = EnvironmentManager(env_config)
+        manager.prepare()
+        results = manager.deploy(_package(temp_dir), 'app', '1')
+
+        assert all(result.success for result in results)
+        for host in env_config['hosts']:
+            host_root = os.path.join(temp_dir, 'hosts', host)
+            assert os.path.exists(os.path.join(host_root, f"prepared-{host}"))
+            assert os.path.exists(os.path.join(host_root, 'srv/apps/app/releases/1/app-1.tar.gz'))
+            assert os.readlink(os.path.join(host_root, 'srv/apps/app/current')) == '1'
+            # Absolute placeholders are mapped under the host directory
+            assert os.path.exists(os.path.join(host_root, 'srv/apps/app/releases/1/activated'))
+
+def test_rolling_batches_and_parallel_cap():
+    """Hosts are split by batch_percent and never exceed max_parallel at once"""
+    transports.TRANSPORTS['counting'] = CountingTransport
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hosts = [f"host{i}" for i in range(10)]
+            manager = EnvironmentManager({
+                'type': 'vm', 'hosts': hosts, 'transport': 'counting',
+                'transport_root': temp_dir, 'batch_percent': 50, 'max_parallel': 3,
+            })
+            assert [len(batch) for batch in manager.rolling_batches()] == [5, 5]
+
+            results = manager.deploy(_package(temp_dir), 'app', '1')
+            assert len(results) == 10 and all(result.success for result in results)
+            assert 1 < CountingTransport.peak <= 3
+    finally:
+        del transports.TRANSPORTS['counting']
+
+def test_failed_batch_stops_rollout():
+    """A failure in one batch skips the hosts of later batches"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = EnvironmentManager({
+            'type': 'vm', 'hosts': ['a', 'b', 'c', 'd'], 'transport': 'local',
+            'transport_root': temp_dir, 'batch_percent': 25,
+            'activate_commands': ['test {host} != b'],
+        })
+        results = {result.host: result for result in manager.deploy(_package(temp_dir), 'app', '1')}
+
+        assert results['a'].success
+        assert not results['b'].success
+        assert results['c'].error == 'skipped after earlier batch failed'
+        assert not os.path.exists(os.path.join(temp_dir, 'd'))
+
+def test_upload_skipped_when_host_has_package():
+    """With upload_skip_existing, hosts already holding identical bytes are not sent them again"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        package_path = _package(temp_dir)
+        env_config = {'type': 'vm', 'hosts': ['a', 'b'], 'transport': 'local',
+                      'transport_root': os.path.join(temp_dir, 'hosts'), 'upload_skip_existing': True}
+        assert all(result.success for result in EnvironmentManager(env_config).deploy(package_path, 'app', '1'))
+
+        remote = os.path.join(temp_dir, 'hosts', 'b', 'opt/deploy/app/releases/1/app-1.tar.gz')
+        with open(remote, 'wb') as f:
+            f.write(b'stale')
+        sent = []
+        manager = EnvironmentManager(env_config)
+        original = transports.LocalDirectorySession.put
+        transports.LocalDirectorySession.put = lambda session, *args: (sent.append(session.host),
+                                                                       original(session, *args))
+        try:
+            assert all(result.success for result in manager.deploy(package_path, 'app', '1'))
+        finally:
+            transports.LocalDirectorySession.put = original
+        assert sent == ['b']
+
+def test_test_mode_touches_nothing():
+    """Test mode only logs what it would prepare"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = EnvironmentManager({'type': 'vm', 'hosts': ['a'], 'transport_root': temp_dir},
+                                     test_mode=True)
+        manager.prepare()
+        assert os.listdir(temp_dir) == []
+
+def test_ssh_commands_as_strings():
+    """Commands configured as strings are split like a shell, and relay accepts a list"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        transport = transports.SubprocessTransport({
+            'ssh_command': 'sh -c',
+            'copy_command': 'cp {local} {remote}',
+            'relay_command': ['cp', '{remote}', '{target_path}'],
+        })
+        assert transport.close_command is None
+
+        source = transport.connect('web1', None)
+        target = transport.connect('web2', 'deploy')
+        package_path = _package(temp_dir)
+        source.put(package_path, os.path.join(temp_dir, 'put.tar.gz'))
+        assert source.run(f"cat {temp_dir}/put.tar.gz") == 'package'
+
+        source.relay(os.path.join(temp_dir, 'put.tar.gz'), target, os.path.join(temp_dir, 'relayed.tar.gz'))
+        assert os.path.exists(os.path.join(temp_dir, 'relayed.tar.gz'))
+
+def main():
+    tests = [
+        test_local_transport_deploys_to_every_host,
+        test_rolling_batches_and_parallel_cap,
+        test_failed_batch_stops_rollout,
+        test_upload_skipped_when_host_has_package,
+        test_test_mode_touches_nothing,
+        test_ssh_commands_as_strings,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Environment Manager Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+test_orchestrator.py - Test batch deployment planning and execution
+"""
+import os
+import sys
+import time
+import logging
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.orchestrator import BatchDeployer, build_plan, format_results
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_orchestrator")
+
+APPS = {
+    'db': {'name': 'db', 'type': 'python'},
+    'api': {'name': 'api', 'type': 'python', 'depends_on': ['db']},
+    'web': {'name': 'web', 'type': 'perl', 'depends_on': ['api']},
+    'worker': {'name': 'worker', 'type': 'perl'},
+}
+ENVIRONMENTS = {
+    'dev': {'type': 'vm', 'hosts': []},
+    'staging': {'type': 'vm', 'hosts': []},
+}
+
+class FakeManager:
+    """Stands in for DeploymentManager and records the order of stages"""
+    events = []
+    lock = threading.Lock()
+    failing = set()
+    packaged = []
+
+    def __init__(self, app_name, env_name, version=None, test_mode=False,
+                 environments=None, apps=None, packager=None, validator=None, env_manager=None):
+        self.app_name = app_name
+        self.env_name = env_name
+        self.packager = packager or object()
+        self.validator = validator or object()
+
+    def validate(self):
+        return self.app_name not in self.failing
+
+    def package(self):
+        time.sleep(0.05)
+        with self.lock:
+            self.packaged.append(self.app_name)
+        return f"build/{self.app_name}.tar.gz"
+
+    def deploy(self, package_path):
+        with self.lock:
+            self.events.append((self.app_name, self.env_name))
+        return True
+
+def _reset(failing=()):
+    FakeManager.events = []
+    FakeManager.packaged = []
+    FakeManager.failing = set(failing)
+
+def test_plan_orders_dependencies():
+    """Dependencies are planned before their dependents"""
+    plan = list(build_plan(['web', 'api', 'db'], APPS))
+    assert plan.index('db') < plan.index('api') < plan.index('web')
+
+def test_plan_rejects_cycles():
+    """A dependency cycle is reported instead of deadlocking"""
+    apps = {'a': {'depends_on': ['b']}, 'b': {'depends_on': ['a']}}
+    try:
+        build_plan(['a', 'b'], apps)
+    except ValueError as e:
+        assert 'cycle' in str(e)
+    else:
+        raise AssertionError("cycle not detected")
+
+def test_batch_packages_once_and_deploys_everywhere():
+    """Each app is packaged once and deployed to every environment after its dependencies"""
+    _reset()
+    batch = BatchDeployer('all', 'all', ENVIRONMENTS, APPS, jobs=4, manager_class=FakeManager)
+    results = batch.run()
+
+    assert len(results) == 8
+    assert all(r.success for r in results)
+    assert sorted(FakeManager.packaged) == sorted(APPS)
+    order = [app for app, _ in FakeManager.events]
+    assert max(i for i, a in enumerate(order) if a == 'db') < min(i for i, a in enumerate(order) if a == 'api')
+    assert 'OK' in format_results(results)
+
+def test_failed_dependency_skips_dependents():
+    """Apps depending on a failed app are skipped, independent apps still deploy"""
+    _reset(failing={'api'})
+    batch = BatchDeployer('db,api,web,worker', 'dev', ENVIRONMENTS, APPS, jobs=2, manager_class=FakeManager)
+    results = {r.app_name: r for r in batch.run()}
+
+    assert results['db'].success and results['worker'].success
+    assert results['api'].stage == 'validate' and not results['api'].success
+    assert results['web'].stage == 'skipped'
+
+def test_pipelined_batch_matches_results():
+    """Pipeline mode deploys the same apps and still honours dependencies"""
+    _reset(failing={'db'})
+    batch = BatchDeployer('all', 'dev', ENVIRONMENTS, APPS, jobs=3, manager_class=FakeManager,
+                          pipelined=True, queue_size=1)
+    results = {r.app_name: r for r in batch.run()}
+
+    assert results['worker'].success
+    assert results['db'].stage == 'validate'
+    assert results['api'].stage == 'skipped'
+    assert results['web'].stage == 'skipped'
+
+def main():
+    tests = [
+        test_plan_orders_dependencies,
+        test_plan_rejects_cycles,
+        test_batch_packages_once_and_deploys_everywhere,
+        test_failed_dependency_skips_dependents,
+        test_pipelined_batch_matches_results,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Orchestrator Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+test_package_cache.py - Test content-addressed package caching
+"""
+import os
+import sys
+import time
+import shutil
+import logging
+import tarfile
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.app_packager import PythonPackager, PerlPackager
+from src.package_cache import fingerprint_tree
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_cache")
+
+def _make_source(root, name):
+    source_dir = os.path.join(root, name)
+    os.makedirs(os.path.join(source_dir, 'lib'))
+    with open(os.path.join(source_dir, 'app.py'), 'w') as f:
+        f.write("print('hello')\n")
+    with open(os.path.join(source_dir, 'lib', 'util.py'), 'w') as f:
+        f.write("VALUE = 1\n")
+    return source_dir
+
+def test_fingerprint_ignores_touch_with_digests():
+    """Touching a file changes the stat fingerprint but not the content one"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir, 'app')
+        stat_before = fingerprint_tree(source_dir)
+        content_before = fingerprint_tree(source_dir, use_digests=True)
+
+        later = time.time() + 10
+        os.utime(os.path.join(source_dir, 'app.py'), (later, later))
+
+        assert fingerprint_tree(source_dir) != stat_before
+        assert fingerprint_tree(source_dir, use_digests=True) == content_before
+
+def test_unchanged_source_reuses_package():
+    """A second version of an unchanged tree is served from the cache"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir, 'cached-app')
+        app_config = {'name': 'python-cache-test', 'type': 'python', 'source_dir': source_dir}
+        shutil.rmtree('build/python-cache-test', ignore_errors=True)
+
+        packager = PythonPackager(app_config)
+        first = packager.package('1')
+        second = packager.package('2')
+
+        assert first != second
+        assert os.path.samefile(first, second) or os.path.getsize(first) == os.path.getsize(second)
+        with open(first, 'rb') as f1, open(second, 'rb') as f2:
+            assert f1.read() == f2.read()
+
+def test_changed_source_rebuilds_package():
+    """Modifying the tree produces a new artifact"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir, 'perl-cached-app')
+        app_config = {'name': 'perl-cache-test', 'type': 'perl', 'source_dir': source_dir}
+        shutil.rmtree('build/perl-cache-test', ignore_errors=True)
+
+        packager = PerlPackager(app_config)
+        first = packager.package('1')
+        with open(os.path.join(source_dir, 'app.py'), 'a') as f:
+            f.write("print('changed')\n")
+        second = packager.package('2')
+
+        assert not os.path.samefile(first, second)
+
+def test_modes_links_and_directories_rebuild_package():
+    """Mode changes, retargeted directory links and empty directories change the cache key"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir, 'meta-app')
+        os.makedirs(os.path.join(source_dir, 'real'))
+        os.makedirs(os.path.join(source_dir, 'other'))
+        with open(os.path.join(source_dir, 'run.sh'), 'w') as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(os.path.join(source_dir, 'run.sh'), 0o644)
+        os.symlink('real', os.path.join(source_dir, 'link'))
+        app_config = {'name': 'python-meta-cache-test', 'type': 'python', 'source_dir': source_dir}
+        shutil.rmtree('build/python-meta-cache-test', ignore_errors=True)
+
+        packager = PythonPackager(app_config)
+        packager.package('1')
+        os.chmod(os.path.join(source_dir, 'run.sh'), 0o755)
+        os.remove(os.path.join(source_dir, 'link'))
+        os.symlink('other', os.path.join(source_dir, 'link'))
+        os.makedirs(os.path.join(source_dir, 'emptydir'))
+        second = packager.package('2')
+
+        with tarfile.open(second, 'r:*') as tar:
+            members = {member.name: member for member in tar.getmembers()}
+        assert members['meta-app/run.sh'].mode == 0o755
+        assert members['meta-app/link'].linkname == 'other'
+        assert members['meta-app/emptydir'].isdir()
+
+def test_repackaging_same_version():
+    """Packaging a version again from the cache leaves no stray temp files"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = _make_source(temp_dir, 'repack-app')
+        app_config = {'name': 'python-repack-test', 'type': 'python', 'source_dir': source_dir}
+        shutil.rmtree('build/python-repack-test', ignore_errors=True)
+
+        packager = PythonPackager(app_config)
+        first = packager.package('1')
+        again = packager.package('1')
+        third = packager.package('1')
+
+        assert first == again == third
+        assert not [name for name in os.listdir('build/python-repack-test') if name.endswith('.tmp')]
+
+def main():
+    tests = [
+        test_fingerprint_ignores_touch_with_digests,
+        test_unchanged_source_reuses_package,
+        test_changed_source_rebuilds_package,
+        test_modes_links_and_directories_rebuild_package,
+        test_repackaging_same_version,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Package Cache Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
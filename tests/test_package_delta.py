@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+test_package_delta.py - Test incremental packages between versions
+"""
+import os
+import sys
+import shutil
+import logging
+import tarfile
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.app_packager import PerlPackager
+from src.env_manager import EnvironmentManager
+from src.package_delta import build_manifest, diff_manifests, read_delta_metadata
+import source_scanner
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_delta")
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def _archive_contents(path):
+    with tarfile.open(path, 'r:*') as tar:
+        return {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()}
+
+def test_diff_manifests():
+    """Added and modified files are changed, missing ones are deleted"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _write(os.path.join(temp_dir, 'keep.pl'), 'keep')
+        _write(os.path.join(temp_dir, 'edit.pl'), 'v1')
+        _write(os.path.join(temp_dir, 'gone.pl'), 'bye')
+        old = build_manifest(temp_dir)
+
+        _write(os.path.join(temp_dir, 'edit.pl'), 'v2')
+        _write(os.path.join(temp_dir, 'lib', 'new.pm'), 'new')
+        os.remove(os.path.join(temp_dir, 'gone.pl'))
+        changed, deleted = diff_manifests(old, build_manifest(temp_dir))
+
+        # New directories are changed paths of their own
+        assert changed == ['edit.pl', 'lib', 'lib/new.pm']
+        assert deleted == ['gone.pl']
+
+def test_delta_chain_reconstructs_full_package():
+    """base + delta + delta rebuilds exactly the tree of the last version"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'delta-app')
+        _write(os.path.join(source_dir, 'app.pl'), 'print 1;')
+        _write(os.path.join(source_dir, 'lib', 'Old.pm'), '1;')
+        shutil.rmtree('build/perl-delta-test', ignore_errors=True)
+
+        packager = PerlPackager({'name': 'perl-delta-test', 'type': 'perl',
+                                 'source_dir': source_dir, 'package_mode': 'delta'})
+        full = packager.package('1')
+        assert not full.endswith('.delta.tar.gz')
+
+        _write(os.path.join(source_dir, 'app.pl'), 'print 2;')
+        delta_2 = packager.package('2')
+        assert delta_2.endswith('.delta.tar.gz')
+        assert set(_archive_contents(delta_2)) == {'.delta.json', 'delta-app/app.pl'}
+
+        os.remove(os.path.join(source_dir, 'lib', 'Old.pm'))
+        _write(os.path.join(source_dir, 'lib', 'New.pm'), '2;')
+        delta_3 = packager.package('3')
+        metadata = read_delta_metadata(delta_3)
+        assert metadata['base_version'] == '2'
+        assert metadata['deleted'] == ['lib/Old.pm']
+
+        rebuilt = packager.reconstruct('3')
+        assert _archive_contents(rebuilt) == {
+            'delta-app/app.pl': b'print 2;',
+            'delta-app/lib/New.pm': b'2;',
+        }
+
+def _archive_entries(path):
+    with tarfile.open(path, 'r:*') as tar:
+        return {m.name: (m.linkname if m.issym() else m.type) for m in tar.getmembers()}
+
+def test_delta_holds_directories_and_links():
+    """New directories and directory symlinks are part of the delta and of the rebuilt package"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'dir-app')
+        _write(os.path.join(source_dir, 'app.pl'), 'print 1;')
+        shutil.rmtree('build/perl-delta-dirs-test', ignore_errors=True)
+        packager = PerlPackager({'name': 'perl-delta-dirs-test', 'type': 'perl',
+                                 'source_dir': source_dir, 'package_mode': 'delta'})
+        packager.package('1')
+
+        os.makedirs(os.path.join(source_dir, 'logs'))
+        _write(os.path.join(source_dir, 'static', 'index.html'), '<html/>')
+        os.symlink('static', os.path.join(source_dir, 'public'))
+        delta = packager.package('2')
+
+        assert read_delta_metadata(delta)['changed'] == ['logs', 'public', 'static', 'static/index.html']
+        rebuilt = _archive_entries(packager.reconstruct('2'))
+        assert rebuilt['dir-app/logs'] == tarfile.DIRTYPE
+        assert rebuilt['dir-app/public'] == 'static'
+
+def test_delta_follows_file_symlinks():
+    """A symlinked file is stored in the delta as the file it points to, as in a full package"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'symlink-app')
+        _write(os.path.join(source_dir, 'app.pl'), 'print 1;')
+        _write(os.path.join(temp_dir, 'shared', 'config.pl'), 'our $x = 1;')
+        shutil.rmtree('build/perl-delta-symlink-test', ignore_errors=True)
+        packager = PerlPackager({'name': 'perl-delta-symlink-test', 'type': 'perl',
+                                 'source_dir': source_dir, 'package_mode': 'delta'})
+        full = packager.package('1')
+
+        os.symlink(os.path.join(temp_dir, 'shared', 'config.pl'), os.path.join(source_dir, 'config.pl'))
+        delta = packager.package('2')
+
+        assert _archive_contents(delta)['symlink-app/config.pl'] == b'our $x = 1;'
+        assert _archive_contents(packager.reconstruct('2'))['symlink-app/config.pl'] == b'our $x = 1;'
+        assert 'symlink-app/config.pl' not in _archive_contents(full)
+
+def test_unchanged_files_reuse_digests():
+    """Files whose size, mode and mtime match the previous manifest are not read again"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in ('a.pl', 'b.pl', 'lib/c.pm'):
+            _write(os.path.join(temp_dir, name), name)
+            os.utime(os.path.join(temp_dir, name), (1000000000, 1000000000))
+        previous = build_manifest(temp_dir)
+
+        reads = []
+        original = source_scanner.file_digest
+        source_scanner.file_digest = lambda path: reads.append(path) or original(path)
+        try:
+            _write(os.path.join(temp_dir, 'b.pl'), 'changed')
+            files = build_manifest(temp_dir, previous=previous)
+        finally:
+            source_scanner.file_digest = original
+
+        assert reads == [os.path.join(temp_dir, 'b.pl')]
+        assert diff_manifests(previous, files) == (['b.pl'], [])
+
+def test_full_package_every_n_versions():
+    """Delta chains are cut by a full package every full_package_every versions"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'chain-app')
+        shutil.rmtree('build/perl-delta-chain-test', ignore_errors=True)
+        packager = PerlPackager({'name': 'perl-delta-chain-test', 'type': 'perl', 'source_dir': source_dir,
+                                 'package_mode': 'delta', 'full_package_every': 3})
+        kinds = []
+        for version in range(1, 8):
+            _write(os.path.join(source_dir, 'app.pl'), f'print {version};')
+            kinds.append('delta' if packager.package(str(version)).endswith('.delta.tar.gz') else 'full')
+
+        assert kinds == ['full', 'delta', 'delta', 'full', 'delta', 'delta', 'full']
+        assert _archive_contents(packager.reconstruct('6'))['chain-app/app.pl'] == b'print 6;'
+
+def test_delta_deploys_rebuild_on_hosts():
+    """Hosts holding the base package rebuild the new one from the delta; others get the full package"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'deploy-app')
+        _write(os.path.join(source_dir, 'app.pl'), 'print 1;')
+        _write(os.path.join(source_dir, 'lib', 'Big.pm'), '1;\n' * 50000)
+        shutil.rmtree('build/perl-delta-deploy-test', ignore_errors=True)
+        packager = PerlPackager({'name': 'perl-delta-deploy-test', 'type': 'perl',
+                                 'source_dir': source_dir, 'package_mode': 'delta'})
+        env_config = {'type': 'vm', 'hosts': ['web1'], 'transport_root': os.path.join(temp_dir, 'hosts'),
+                      'deploy_dir': '/srv', 'activate_commands': ['tar -xzf {package} -C {release_dir}']}
+
+        first = packager.package('1')
+        assert all(result.success for result in EnvironmentManager(env_config).deploy(first, 'app', '1'))
+
+        _write(os.path.join(source_dir, 'app.pl'), 'print 2;')
+        full_path, delta = packager.deployable('2', packager.package('2'))
+        assert delta['base_version'] == '1' and delta['base_package'] == os.path.basename(first)
+
+        env_config['hosts'] = ['web1', 'web2']
+        assert all(result.success for result in EnvironmentManager(env_config).deploy(full_path, 'app', '2', delta))
+        for host in ('web1', 'web2'):
+            release = os.path.join(temp_dir, 'hosts', host, 'srv', 'app', 'releases', '2')
+            with open(os.path.join(release, 'deploy-app', 'app.pl')) as f:
+                assert f.read() == 'print 2;'
+            assert os.path.getsize(os.path.join(release, 'deploy-app', 'lib', 'Big.pm')) == 150000
+            assert not [name for name in os.listdir(release) if name.endswith('.delta')]
+
+def main():
+    tests = [
+        test_diff_manifests,
+        test_delta_chain_reconstructs_full_package,
+        test_delta_holds_directories_and_links,
+        test_delta_follows_file_symlinks,
+        test_unchanged_files_reuse_digests,
+        test_full_package_every_n_versions,
+        test_delta_deploys_rebuild_on_hosts,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Package Delta Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+test_pipeline.py - Test the staged pipeline used for release trains
+"""
+import os
+import sys
+import time
+import logging
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.pipeline import Pipeline, Stage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_pipeline")
+
+def test_stages_overlap():
+    """Total time approaches the slowest stage, not the sum of all stages"""
+    def slow(payload):
+        time.sleep(0.05)
+        return payload
+
+    stages = [Stage('a', slow), Stage('b', slow), Stage('c', slow)]
+    start = time.monotonic()
+    items = Pipeline(stages).run((i, i) for i in range(6))
+    elapsed = time.monotonic() - start
+
+    assert [item.payload for item in items] == list(range(6))
+    # Sequential would take 6 * 3 * 0.05 = 0.9s; pipelined is about (6 + 2) * 0.05
+    assert elapsed < 0.7, elapsed
+
+def test_back_pressure_bounds_lookahead():
+    """A fast stage never gets more than the queue size ahead of a slow one"""
+    lock = threading.Lock()
+    state = {'produced': 0, 'consumed': 0, 'max_ahead': 0}
+
+    def produce(payload):
+        with lock:
+            state['produced'] += 1
+            state['max_ahead'] = max(state['max_ahead'], state['produced'] - state['consumed'])
+        return payload
+
+    def consume(payload):
+        time.sleep(0.02)
+        with lock:
+            state['consumed'] += 1
+        return payload
+
+    Pipeline([Stage('package', produce), Stage('deploy', consume)], queue_size=2).run((i, i) for i in range(10))
+    # queue_size waiting, one being consumed, one blocked on put
+    assert state['max_ahead'] <= 4, state
+
+def test_failed_items_skip_later_stages():
+    """An item that fails keeps flowing but later stage functions are not called"""
+    calls = []
+
+    def explode(payload):
+        if payload == 'bad':
+            raise ValueError("boom")
+        return payload
+
+    def record(payload):
+        calls.append(payload)
+        return payload
+
+    items = {item.key: item for item in Pipeline([Stage('check', explode), Stage('ship', record)]).run(
+        [('good', 'good'), ('bad', 'bad')])}
+
+    assert items['good'].success
+    assert items['bad'].failed_stage == 'check'
+    assert calls == ['good']
+
+def test_ready_holds_item_without_blocking_others():
+    """An item waiting for its dependency lets independent items pass"""
+    order = []
+    deps = {'child': ['parent'], 'parent': [], 'other': []}
+
+    def slow_parent(payload):
+        if payload == 'parent':
+            time.sleep(0.05)
+        return payload
+
+    def ship(payload):
+        order.append(payload)
+        return payload
+
+    stages = [
+        Stage('build', slow_parent, workers=3),
+        Stage('ship', ship, ready=lambda item, done: all(d in done for d in deps[item.key])),
+    ]
+    Pipeline(stages).run((key, key) for key in ['parent', 'child', 'other'])
+
+    assert order.index('parent') < order.index('child')
+    assert order.index('other') < order.index('parent')
+
+def main():
+    tests = [
+        test_stages_overlap,
+        test_back_pressure_bounds_lookahead,
+        test_failed_items_skip_later_stages,
+        test_ready_holds_item_without_blocking_others,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Pipeline Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
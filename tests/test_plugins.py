@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+test_plugins.py - Test lazy plugin registries, entry-point discovery and the CLI import budget
+"""
+import os
+import re
+import sys
+import logging
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from plugins import Registry
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_plugins")
+
+SRC_DIR = os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src')
+# Modules only a deployment of a particular type needs
+HEAVY_MODULES = ('app_packager', 'env_manager', 'archive_builder', 'docker_export', 'wheelhouse',
+                 'package_cache', 'package_delta', 'source_scanner', 'transports', 'block_sync',
+                 'orchestrator', 'pipeline', 'build_workers', 'daemon',
+                 'validators.python_validator', 'validators.perl_validator', 'yaml')
+# Cumulative import time of deployer, in microseconds; it measures around 50ms, so
+# the budget leaves room for a slow machine but not for another eager import
+IMPORT_BUDGET_US = 150000
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def test_builtin_imported_on_first_load():
+    """A 'module:attr' registration imports its module only when the name is loaded"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _write(os.path.join(temp_dir, 'lazy_node_plugin.py'), "class NodePackager:\n    pass\n")
+        sys.path.insert(0, temp_dir)
+        try:
+            registry = Registry('packagers', {'node': 'lazy_node_plugin:NodePackager'})
+            assert 'node' in registry
+            assert 'lazy_node_plugin' not in sys.modules
+
+            packager_class = registry.load('node')
+            assert packager_class.__name__ == 'NodePackager'
+            assert registry.load('node') is packager_class
+        finally:
+            sys.path.remove(temp_dir)
+            sys.modules.pop('lazy_node_plugin', None)
+
+def test_entry_point_discovery():
+    """Installed distributions add implementations through the deploy_automation.<kind> group"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        _write(os.path.join(temp_dir, 'go_plugin.py'), "class GoPackager:\n    pass\n")
+        dist_info = os.path.join(temp_dir, 'deploy_go-1.0.dist-info')
+        _write(os.path.join(dist_info, 'METADATA'), "Metadata-Version: 2.1\nName: deploy-go\nVersion: 1.0\n")
+        _write(os.path.join(dist_info, 'entry_points.txt'),
+               "[deploy_automation.packagers]\ngo = go_plugin:GoPackager\n")
+        sys.path.insert(0, temp_dir)
+        try:
+            registry = Registry('packagers', {'python': 'app_packager:PythonPackager'})
+            assert 'go' in registry and 'go' in registry.names()
+            assert registry.load('go').__name__ == 'GoPackager'
+
+            # A register() call takes precedence over the entry point
+            registry.register('go', dict)
+            assert registry.load('go') is dict
+        finally:
+            sys.path.remove(temp_dir)
+            sys.modules.pop('go_plugin', None)
+
+def test_unknown_name_lists_available():
+    """Loading an unknown name raises ValueError naming what is available"""
+    registry = Registry('environments', {'vm': 'env_manager:VMEnvironment'})
+    assert 'k8s' not in registry
+    try:
+        registry.load('k8s')
+    except ValueError as e:
+        assert "Unknown environments 'k8s'" in str(e) and 'vm' in str(e)
+    else:
+        raise AssertionError("Expected ValueError for an unknown environment type")
+
+def test_unknown_package_type_is_rejected():
+    """A package_type that is neither built in nor a plugin raises instead of building a tarball"""
+    from app_packager import PythonPackager
+    with tempfile.TemporaryDirectory() as temp_dir:
+        packager = PythonPackager({'name': 'python-rpm-test', 'type': 'python', 'source_dir': temp_dir,
+                                   'package_type': 'rpm'})
+        try:
+            packager.package('1')
+        except ValueError as e:
+            assert 'Unsupported package type: rpm' in str(e) and 'tarball, wheel, docker' in str(e)
+        else:
+            raise AssertionError("Expected ValueError for an unknown package type")
+
+def test_cli_import_budget():
+    """Importing the CLI stays cheap: no type-specific module is imported up front"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import deployer'],
+                            cwd=SRC_DIR, capture_output=True, text=True, check=True)
+    # Lines look like "import time:       123 |       4567 |   deployer"
+    imported = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            imported[match.group(4)] = int(match.group(2))
+
+    assert 'deployer' in imported
+    loaded = [name for name in HEAVY_MODULES if name in imported]
+    assert not loaded, f"deployer imports {', '.join(loaded)} at startup"
+    logger.info(f"deployer import took {imported['deployer'] / 1000:.1f}ms")
+    assert imported['deployer'] < IMPORT_BUDGET_US, \
+        f"deployer import took {imported['deployer']}us, budget is {IMPORT_BUDGET_US}us"
+
+def main():
+    tests = [
+        test_builtin_imported_on_first_load,
+        test_entry_point_discovery,
+        test_unknown_name_lists_available,
+        test_unknown_package_type_is_rejected,
+        test_cli_import_budget,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Plugins Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+test_profiling.py - Test stage timing spans and trace-event output
+"""
+import os
+import sys
+import json
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+# Imported by flat name: the profiler is module state shared with the src modules
+from archive_builder import build_tarball
+from profiling import active_profiler, disable_profiling, enable_profiling, span
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_profiling")
+
+def test_spans_only_recorded_when_enabled():
+    """Spans are free no-ops until profiling is enabled"""
+    with span('ignored'):
+        pass
+    assert active_profiler() is None
+
+    profiler = enable_profiling()
+    try:
+        with span('outer', app='demo') as stage:
+            stage.add_bytes(1024)
+            with span('inner'):
+                pass
+        try:
+            with span('failing'):
+                raise ValueError('boom')
+        except ValueError:
+            pass
+    finally:
+        disable_profiling()
+
+    with span('after'):
+        pass
+
+    names = [s.name for s in profiler.spans]
+    assert sorted(names) == ['failing', 'inner', 'outer']
+    failing = next(s for s in profiler.spans if s.name == 'failing')
+    assert failing.args['error'] == 'ValueError'
+
+def test_trace_events_and_summary():
+    """The trace file is valid trace-event JSON and the summary lists each stage"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'data.bin'), 'wb') as f:
+            f.write(os.urandom(64 * 1024))
+
+        profiler = enable_profiling()
+        try:
+            build_tarball(source_dir, os.path.join(temp_dir, 'app.tar.gz'))
+        finally:
+            disable_profiling()
+
+        trace_path = profiler.write_trace(os.path.join(temp_dir, 'trace.json'))
+        with open(trace_path) as f:
+            trace = json.load(f)
+
+        complete = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+        assert [event['name'] for event in complete] == ['tar_compress']
+        event = complete[0]
+        assert event['args']['bytes'] >= 64 * 1024
+        assert event['args']['output_bytes'] > 0
+        assert event['dur'] >= 0
+        assert any(event['ph'] == 'M' for event in trace['traceEvents'])
+
+        summary = profiler.summary()
+        assert summary.splitlines()[0].split() == ['STAGE', 'COUNT', 'TOTAL', 'MAX', 'BYTES', 'THROUGHPUT']
+        assert 'tar_compress' in summary
+
+def main():
+    tests = [
+        test_spans_only_recorded_when_enabled,
+        test_trace_events_and_summary,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Profiling Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
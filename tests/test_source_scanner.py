@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+test_source_scanner.py - Test the shared source scan and .deployignore handling
+"""
+import os
+import sys
+import shutil
+import logging
+import tarfile
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.app_packager import PythonPackager, sync_directory
+from src.deployer import DeploymentManager
+from src.source_scanner import IgnoreRules, scan_app, scan_tree
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_source_scanner")
+
+def _write(path, content="x\n"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def _make_tree(root):
+    _write(os.path.join(root, 'app.py'), "print('app')\n")
+    _write(os.path.join(root, 'lib', 'util.py'), "VALUE = 1\n")
+    _write(os.path.join(root, 'lib', '__pycache__', 'util.cpython-311.pyc'))
+    _write(os.path.join(root, 'logs', 'today.log'))
+    _write(os.path.join(root, 'logs', 'keep.log'))
+    _write(os.path.join(root, 'notes.tmp'))
+    _write(os.path.join(root, '.deployignore'), "# junk\n**/__pycache__\nlogs\n!logs/keep.log\n*.tmp\n")
+    return root
+
+def test_ignore_rules_follow_dockerignore():
+    """Root-relative globs, ** for any depth, last match wins"""
+    rules = IgnoreRules(['*.log', '**/cache', '!important.log', 'docs/**/*.md', '# comment', ''])
+    assert rules.ignored('debug.log')
+    assert not rules.ignored('sub/debug.log')
+    assert not rules.ignored('important.log')
+    assert rules.ignored('cache') and rules.ignored('a/b/cache') and rules.ignored('a/cache/file.py')
+    assert rules.ignored('docs/intro.md') and rules.ignored('docs/a/b/intro.md')
+    assert not rules.ignored('docs/intro.txt')
+    assert not IgnoreRules([])
+
+def test_scan_honours_deployignore():
+    """Ignored paths are left out of the manifest; negations re-include files"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = _make_tree(os.path.join(temp_dir, 'app'))
+        manifest = scan_tree(root)
+
+        assert [entry.rel_path for entry in manifest.files] == [
+            '.deployignore', 'app.py', 'lib/util.py', 'logs/keep.log']
+        assert [entry.rel_path for entry in manifest.entries if entry.is_dir] == ['lib', 'logs']
+        assert manifest.by_path['app.py'].digest == manifest.by_path['app.py'].digest
+        assert manifest.fingerprint() != manifest.fingerprint(use_digests=True)
+
+def test_packages_and_context_use_the_scan():
+    """Tarballs and the docker build context leave out ignored files"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = _make_tree(os.path.join(temp_dir, 'scan-app'))
+        shutil.rmtree('build/python-scan-test', ignore_errors=True)
+        packager = PythonPackager({'name': 'python-scan-test', 'type': 'python', 'source_dir': root})
+        package_path = packager.package('1')
+
+        with tarfile.open(package_path, 'r:gz') as tar:
+            names = sorted(tar.getnames())
+        assert names == ['scan-app', 'scan-app/.deployignore', 'scan-app/app.py', 'scan-app/lib',
+                         'scan-app/lib/util.py', 'scan-app/logs', 'scan-app/logs/keep.log']
+
+        context = os.path.join(temp_dir, 'context')
+        _write(os.path.join(context, 'notes.tmp'))
+        sync_directory(root, context)
+        synced = sorted(os.path.relpath(os.path.join(dirpath, name), context)
+                        for dirpath, _, files in os.walk(context) for name in files)
+        assert synced == ['.deployignore', 'app.py', 'lib/util.py', 'logs/keep.log']
+
+def test_app_exclude_and_include_lists():
+    """apps.yaml exclude/include lists combine with the default excludes and .deployignore"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = _make_tree(os.path.join(temp_dir, 'app'))
+        _write(os.path.join(root, '.git', 'HEAD'))
+        _write(os.path.join(root, '.venv', 'lib', 'site.py'))
+        _write(os.path.join(root, 'tests', 'data', 'big.bin'))
+        _write(os.path.join(root, 'docs', 'index.md'))
+
+        app_config = {'name': 'scan-app', 'source_dir': root, 'exclude': ['tests', 'docs/**']}
+        manifest = scan_app(app_config)
+        assert [entry.rel_path for entry in manifest.files] == [
+            '.deployignore', 'app.py', 'lib/util.py', 'logs/keep.log']
+
+        app_config = {'name': 'scan-app', 'source_dir': root, 'default_excludes': False}
+        assert '.git/HEAD' in scan_app(app_config).by_path
+
+        app_config = {'name': 'scan-app', 'source_dir': root, 'include': ['app.py', 'lib/*.py', 'tests']}
+        manifest = scan_app(app_config)
+        assert [entry.rel_path for entry in manifest.files] == ['app.py', 'lib/util.py', 'tests/data/big.bin']
+        assert [entry.rel_path for entry in manifest.entries if entry.is_dir] == ['lib', 'tests', 'tests/data']
+
+        rules = IgnoreRules([], include=['src/app/*.py'])
+        assert rules.prunes('docs') and not rules.prunes('src') and not rules.prunes('src/app')
+
+def test_packager_applies_app_rules():
+    """Packagers scan with the app's rules when no manifest is shared"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = _make_tree(os.path.join(temp_dir, 'rules-app'))
+        _write(os.path.join(root, '.git', 'HEAD'))
+        _write(os.path.join(root, 'tests', 'test_app.py'))
+        shutil.rmtree('build/python-rules-test', ignore_errors=True)
+        packager = PythonPackager({'name': 'python-rules-test', 'type': 'python', 'source_dir': root,
+                                   'exclude': ['tests']})
+        package_path = packager.package('1')
+
+        with tarfile.open(package_path, 'r:gz') as tar:
+            names = sorted(tar.getnames())
+        assert 'rules-app/app.py' in names
+        assert not [name for name in names if '.git' in name.split('/') or 'tests' in name.split('/')]
+
+def test_deployment_scans_once():
+    """Validation and packaging of one deployment share a single scan"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = _make_tree(os.path.join(temp_dir, 'app'))
+        apps = {'scan-app': {'name': 'scan-app', 'type': 'python', 'source_dir': root}}
+        environments = {'dev': {'type': 'vm', 'hosts': []}}
+        shutil.rmtree('build/scan-app', ignore_errors=True)
+
+        manager = DeploymentManager('scan-app', 'dev', '1', test_mode=True, environments=environments, apps=apps)
+        assert manager.validate()
+        manifest = manager.manifest
+        manager.package()
+        assert manager.manifest is manifest
+        assert manager.packager.manifest is manifest
+
+def main():
+    tests = [
+        test_ignore_rules_follow_dockerignore,
+        test_scan_honours_deployignore,
+        test_packages_and_context_use_the_scan,
+        test_app_exclude_and_include_lists,
+        test_packager_applies_app_rules,
+        test_deployment_scans_once,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Source Scanner Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+test_validators.py - Test source syntax checks and their content cache
+"""
+import os
+import sys
+import shutil
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.validators.python_validator import PythonValidator
+from src.validators.perl_validator import PerlValidator
+from src.validators import source_checks
+from src.validators.source_checks import SourceChecker, check_requirements
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_validators")
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def test_python_validator_reports_syntax_errors():
+    """Every module is compiled; one broken file fails validation"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        for i in range(12):
+            _write(os.path.join(source_dir, 'pkg', f"mod{i}.py"), f"VALUE = {i}\n")
+        _write(os.path.join(source_dir, 'requirements.txt'), "requests>=2.0\n# comment\n-r base.txt\n")
+
+        app_config = {'name': 'python-validate-test', 'source_dir': source_dir}
+        shutil.rmtree('build/python-validate-test', ignore_errors=True)
+        assert PythonValidator(app_config).validate()
+
+        _write(os.path.join(source_dir, 'pkg', 'mod3.py'), "def broken(:\n")
+        assert not PythonValidator(app_config).validate()
+
+def test_requirements_parse():
+    """Malformed requirement lines are reported with their line number"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'requirements.txt')
+        _write(path, "Django==4.2.7\nflask[async] >=2.0, <4 ; python_version >= '3.8'\n"
+                     "--index-url https://example.com/simple\n./vendor/pkg\n")
+        assert check_requirements(path) is None
+
+        _write(path, "Django==4.2.7\nnot a requirement!!\n")
+        assert 'line 2' in check_requirements(path)
+
+def test_perl_validator_runs_perl_c():
+    """Perl scripts and modules are checked with perl -c"""
+    if shutil.which('perl') is None:
+        logger.info("perl not available, skipping")
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        _write(os.path.join(source_dir, 'lib', 'Demo.pm'), "package Demo;\nsub hello { 1 }\n1;\n")
+        _write(os.path.join(source_dir, 'app.pl'), "use strict;\nuse Demo;\nprint Demo::hello();\n")
+
+        app_config = {'name': 'perl-validate-test', 'source_dir': source_dir}
+        shutil.rmtree('build/perl-validate-test', ignore_errors=True)
+        assert PerlValidator(app_config).validate()
+
+        _write(os.path.join(source_dir, 'app.pl'), "use strict;\nmy $x = ;\n")
+        assert not PerlValidator(app_config).validate()
+
+def test_perl_cache_tracks_included_modules():
+    """A cached perl -c pass is rechecked when a module it uses from an include dir changes"""
+    if shutil.which('perl') is None:
+        logger.info("perl not available, skipping")
+        return
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        shared_module = os.path.join(temp_dir, 'shared', 'Shared.pm')
+        _write(shared_module, "package Shared;\nsub hello { 1 }\n1;\n")
+        _write(os.path.join(source_dir, 'app.pl'), "use strict;\nuse Shared;\nprint Shared::hello();\n")
+
+        app_config = {'name': 'perl-include-test', 'source_dir': source_dir, 'perl_include_dirs': ['../shared']}
+        shutil.rmtree('build/perl-include-test', ignore_errors=True)
+        assert PerlValidator(app_config).validate()
+
+        _write(shared_module, "package Shared;\nsub hello { ;\n1;\n")
+        assert not PerlValidator(app_config).validate()
+
+def test_unchanged_files_are_not_rechecked():
+    """Passing files are cached by content; failures and changed files are checked again"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        for i in range(20):
+            _write(os.path.join(source_dir, f"mod{i}.py"), f"VALUE = {i}\n")
+        _write(os.path.join(source_dir, 'bad.py'), "def broken(:\n")
+        cache_path = os.path.join(temp_dir, 'validation.json')
+
+        def run():
+            checker = SourceChecker(source_dir, cache_path, workers=4)
+            errors = checker.run(checker.select({'.py': ('python', ())}))
+            return checker.stats, errors
+
+        stats, errors = run()
+        assert stats['checked'] == 21 and stats['cached'] == 0
+        assert list(errors) == ['bad.py']
+
+        stats, errors = run()
+        assert stats['checked'] == 1 and stats['cached'] == 20
+        assert list(errors) == ['bad.py']
+
+        _write(os.path.join(source_dir, 'bad.py'), "def fixed():\n    pass\n")
+        _write(os.path.join(source_dir, 'mod0.py'), "VALUE = 'changed'\n")
+        stats, errors = run()
+        assert stats['checked'] == 2 and stats['cached'] == 19
+        assert errors == {}
+
+def test_process_pool_checks():
+    """Python checks above the process threshold run on spawned workers with the same results"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'app')
+        for i in range(6):
+            _write(os.path.join(source_dir, f"mod{i}.py"), f"VALUE = {i}\n")
+        _write(os.path.join(source_dir, 'bad.py'), "def broken(:\n")
+
+        saved = source_checks.PROCESS_THRESHOLD
+        source_checks.PROCESS_THRESHOLD = 2
+        try:
+            checker = SourceChecker(source_dir, workers=2)
+            errors = checker.run(checker.select({'.py': ('python', ())}))
+        finally:
+            source_checks.PROCESS_THRESHOLD = saved
+        assert list(errors) == ['bad.py'] and checker.stats['checked'] == 7
+
+def main():
+    tests = [
+        test_python_validator_reports_syntax_errors,
+        test_requirements_parse,
+        test_perl_validator_runs_perl_c,
+        test_perl_cache_tracks_included_modules,
+        test_unchanged_files_are_not_rechecked,
+        test_process_pool_checks,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Validator Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
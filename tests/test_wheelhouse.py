@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+test_wheelhouse.py - Test the shared wheel cache and offline bundles
+"""
+import os
+import sys
+import logging
+import tarfile
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
+sys.path.insert(1, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'src'))
+from src.wheelhouse import Wheelhouse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("test_wheelhouse")
+
+# Stand-in for `pip wheel -r <file> --wheel-dir <dir> ...` that records each call
+FAKE_PIP = """
+import os, sys
+args = sys.argv[1:]
+with open(os.environ['FAKE_PIP_LOG'], 'a') as log:
+    log.write(' '.join(args) + '\\n')
+wheel_dir = args[args.index('--wheel-dir') + 1]
+with open(args[args.index('-r') + 1]) as f:
+    for line in f:
+        name, _, version = line.strip().partition('==')
+        if name:
+            open(os.path.join(wheel_dir, f"{name}-{version or '1.0'}-py3-none-any.whl"), 'w').close()
+"""
+
+def _fake_build(calls):
+    def build(dist_dir):
+        calls.append(dist_dir)
+        open(os.path.join(dist_dir, 'demo-0.1-py3-none-any.whl'), 'w').close()
+    return build
+
+def test_app_wheel_built_once_per_source():
+    """An unchanged source tree is served from the wheelhouse; a change rebuilds"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, 'src')
+        os.makedirs(source_dir)
+        with open(os.path.join(source_dir, 'setup.py'), 'w') as f:
+            f.write("# setup\n")
+
+        wheelhouse = Wheelhouse(os.path.join(temp_dir, 'wheelhouse'))
+        calls = []
+        first = wheelhouse.app_wheel('demo', source_dir, _fake_build(calls))
+        second = wheelhouse.app_wheel('demo', source_dir, _fake_build(calls))
+        assert first == second
+        assert len(calls) == 1
+        assert os.path.basename(first) == 'demo-0.1-py3-none-any.whl'
+
+        with open(os.path.join(source_dir, 'setup.py'), 'a') as f:
+            f.write("# changed\n")
+        third = wheelhouse.app_wheel('demo', source_dir, _fake_build(calls))
+        assert third != first
+        assert len(calls) == 2
+
+def test_dependency_wheels_and_bundle():
+    """Known requirements resolve without pip; the bundle holds app and dependency wheels"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        fake_pip = os.path.join(temp_dir, 'fake_pip.py')
+        with open(fake_pip, 'w') as f:
+            f.write(FAKE_PIP)
+        log_path = os.path.join(temp_dir, 'pip.log')
+        os.environ['FAKE_PIP_LOG'] = log_path
+
+        requirements = os.path.join(temp_dir, 'requirements.txt')
+        with open(requirements, 'w') as f:
+            f.write("requests==2.31.0\nPyYAML==6.0\n")
+
+        wheelhouse = Wheelhouse(os.path.join(temp_dir, 'wheelhouse'), pip_command=[sys.executable, fake_pip])
+        first = wheelhouse.dependency_wheels(requirements)
+        second = wheelhouse.dependency_wheels(requirements)
+        assert first == second
+        assert sorted(os.path.basename(path) for path in first) == [
+            'PyYAML-6.0-py3-none-any.whl', 'requests-2.31.0-py3-none-any.whl']
+        with open(log_path) as f:
+            calls = f.read().splitlines()
+        assert len(calls) == 1
+        assert '--find-links' in calls[0]
+
+        app_wheel = wheelhouse.app_wheel('demo', temp_dir, _fake_build([]))
+        bundle = wheelhouse.bundle(os.path.join(temp_dir, 'bundle.tar.gz'), [app_wheel] + first, requirements)
+        with tarfile.open(bundle, 'r:gz') as tar:
+            names = sorted(tar.getnames())
+        assert names == ['requirements.txt', 'wheels/PyYAML-6.0-py3-none-any.whl',
+                         'wheels/demo-0.1-py3-none-any.whl', 'wheels/requests-2.31.0-py3-none-any.whl']
+
+class _FakeManifest:
+    def __init__(self, name):
+        self.name = name
+
+    def fingerprint(self, use_digests=False):
+        return f"{self.name}-{'content' if use_digests else 'stat'}"
+
+def test_concurrent_apps_share_the_index():
+    """Wheelhouses of different apps update the shared index concurrently without losing entries"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = os.path.join(temp_dir, 'wheelhouse')
+        errors = []
+
+        def update(app_name):
+            wheelhouse = Wheelhouse(root)
+            try:
+                for number in range(300):
+                    wheelhouse._source_key(_FakeManifest(f"{app_name}-{number}"))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=update, args=(name,)) for name in ('first', 'second')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert not errors
+        assert len(Wheelhouse(root)._load_index()['stat']) == 600
+        assert not [name for name in os.listdir(root) if name.endswith('.tmp')]
+
+def main():
+    tests = [
+        test_app_wheel_built_once_per_source,
+        test_dependency_wheels_and_bundle,
+        test_concurrent_apps_share_the_index,
+    ]
+
+    results = {}
+    for test in tests:
+        try:
+            test()
+            results[test.__name__] = True
+        except Exception as e:
+            logger.error(f"{test.__name__} failed: {str(e)}")
+            results[test.__name__] = False
+
+    print("\n=== Wheelhouse Test Results ===")
+    for name, passed in results.items():
+        print(f"{name}: {'PASSED' if passed else 'FAILED'}")
+
+    return 0 if all(results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())